@@ -6,10 +6,8 @@ import argparse
 import logging
 import sys
 import time
-import threading
-from queue import Queue
+from functools import partial
 from random import randint
-from typing import Any
 
 from mercaido_client.mq.client import ServiceClient
 from mercaido_client.pb.mercaido import (
@@ -17,7 +15,6 @@ from mercaido_client.pb.mercaido import (
     AttributeType,
     Event,
     EventType,
-    MessageType,
     PublishJob,
     Service,
 )
@@ -33,6 +30,12 @@ def parse_cli_arguments(args: list[str]) -> argparse.Namespace:
         help="URL of AMQP server.",
         required=True,
     )
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=1,
+        help="Number of jobs to run at the same time.",
+    )
     parsed_args = parser.parse_args(args)
     return parsed_args
 
@@ -82,93 +85,44 @@ def main() -> int:
         ],
     )
 
-    queue = Queue()
+    client = ServiceClient(srv, args.amqp, concurrency=args.concurrency)
+    with client:
+        client.register()
+        try:
+            # Runs jobs in worker threads until interrupted, running jobs
+            # are finished first.
+            client.serve(partial(do_job, client))
+        except KeyboardInterrupt:
+            pass
 
-    # Run client in a background thread. This client receives jobs from
-    # mercaido_server and put them on a queue (defined above).
-    client = ServiceClient(srv, args.amqp)
-    client_thread = threading.Thread(
-        target=client_job_listener,
-        args=[client, queue],
-        daemon=True,
-    )
-    client_thread.start()
-
-    try:
-        # Job execution loop.
-        while True:
-            msg, ack = queue.get()
-
-            # Check if this is an acceptable message.
-            if msg is None:
-                continue
-            if not msg.request:
-                logger.error("message has not request")
-                continue
-            if msg.request.type != MessageType.MESSAGE_TYPE_PUBLISH_JOB:
-                logger.error(
-                    f"message request type not supported: {msg.request.type!r}"
-                )
-                continue
-
-            do_job(msg.request.publish_job, client, ack)
-            queue.task_done()
-    except KeyboardInterrupt:
-        pass
-    finally:
-        client.close()
-        client_thread.join()
-
-
-def client_job_listener(client, queue):
-    client.open()
-    client.register() #TODO
-    with client.consume() as consumer:
-        # Listen for messages and put them on the queue to be processed
-        # in the job execution loop.
-        for msg, ack in consumer:
-            queue.put((msg, ack))
-    logger.info("client job listener stopped")
-
-
-def do_job(job: PublishJob, client: ServiceClient, ack: Any):
+
+def do_job(client: ServiceClient, job: PublishJob):
     def update(typ, **kwargs):
         # Publish an event to communicate job start, progress updates,
         # completion, and failures.
         client.publish_event(Event(job_id=job.job_id, type=typ, **kwargs))
 
-    try:
-        logger.info(f"job {job.job_id} started")
-        update(EventType.EVENT_TYPE_JOB_START)
-        update(EventType.EVENT_TYPE_JOB_PROGRESS, progress=0)
-        logger.info(f"job {job.job_id} progress 0%")
-
-        # TODO: What is this exactly?
-        fail_attr = [attr for attr in job.services[0].attributes if attr.id == "fail"][
-            0
-        ]
-        fail_job = fail_attr.values[0] == "True"
-        fail_at = randint(1, 10)
-
-        for n in range(1, 11):
-            if fail_job and fail_at == n:
-                update(
-                    EventType.EVENT_TYPE_JOB_ERROR,
-                    error_message="Job failed randomly as requested",
-                )
-                logger.info(f"job {job.job_id} failed randomly as requested")
-                raise Exception("Requested fail")
-
-            update(EventType.EVENT_TYPE_JOB_PROGRESS, progress=10 * n)
-            logger.info(f"job {job.job_id} progress {10 * n}%")
-            time.sleep(2)
-
-        update(EventType.EVENT_TYPE_JOB_STOP)
-        logger.info(f"job {job.job_id} completed")
-
-        # Acknowledge successful completion of job.
-        ack.ok()
-    except Exception:
-        logger.exception(f"job {job.job_id} failed")
-        # Job failed, negative acknowledgement.
-        ack.cancel()
+    logger.info(f"job {job.job_id} started")
+    update(EventType.EVENT_TYPE_JOB_START)
+    update(EventType.EVENT_TYPE_JOB_PROGRESS, progress=0)
+    logger.info(f"job {job.job_id} progress 0%")
+
+    # TODO: What is this exactly?
+    fail_job = job.services[0].attribute("fail").boolean()
+    fail_at = randint(1, 10)
+
+    for n in range(1, 11):
+        if fail_job and fail_at == n:
+            update(
+                EventType.EVENT_TYPE_JOB_ERROR,
+                error_message="Job failed randomly as requested",
+            )
+            logger.info(f"job {job.job_id} failed randomly as requested")
+            raise Exception("Requested fail")
+
+        update(EventType.EVENT_TYPE_JOB_PROGRESS, progress=10 * n)
+        logger.info(f"job {job.job_id} progress {10 * n}%")
+        time.sleep(2)
+
+    update(EventType.EVENT_TYPE_JOB_STOP)
+    logger.info(f"job {job.job_id} completed")
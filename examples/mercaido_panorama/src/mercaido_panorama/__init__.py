@@ -5,23 +5,19 @@
 import argparse
 import logging
 import sys
-import threading
 import traceback
-from queue import Queue
 
-from mercaido_client.mq.client import ServiceClient, Ack
+from mercaido_client.mq.client import ServiceClient
 from mercaido_client.pb.mercaido import (
     Attribute,
     AttributeType,
     EventType,
-    MessageType,
     Service,
     Event,
     PublishJob,
 )
 
 from pprint import pformat
-from concurrent.futures import ThreadPoolExecutor
 
 from .panorama import Panorama
 
@@ -29,9 +25,8 @@ logger = logging.getLogger(__name__)
 
 
 class PanoramaService:
-    def __init__(self, service_id: str, url: str):
+    def __init__(self, service_id: str, url: str, concurrency: int = 1):
         self.service_id = service_id
-        self.work_queue = Queue()
         # self.url = url
         service = Service(
             endpoint=self.service_id,
@@ -82,56 +77,28 @@ class PanoramaService:
                 ),
             ],
         )
-        self.client = ServiceClient(service, url)
-        self.client_thread = threading.Thread()
+        self.client = ServiceClient(service, url, concurrency=concurrency)
 
     def run(self) -> None:
         logger.info(f"{self.service_id} -> Starting")
-        self.client_thread = threading.Thread(
-            target=self.client_job_listener, daemon=True
-        )
-        self.client_thread.start()
-        self.work()
+        with self.client:
+            self.client.register()
+            self.client.serve(self._execute)
 
     def stop(self) -> None:
         logger.info(f"{self.service_id} -> Stopping")
-        self.client.close()
-        self.client_thread.join()
-
-    def client_job_listener(self):
-        self.client.open()
-        self.client.register()
-        with self.client.consume() as consumer:
-            for msg, ack in consumer:
-                self.work_queue.put((msg, ack))
-        logger.info(f"{self.service_id} -> client job listener stopped")
-
-    def work(self):
-        logger.info(f"{self.service_id} -> Starting work queue")
-        # consume work
-        with (
-            ThreadPoolExecutor(max_workers=1) as executor,
-        ):
-            while True:
-                item, ack = self.work_queue.get()
-                logger.debug(f"{self.service_id} -> Received message")
-                logger.debug(f"{pformat(item)}")
-
-                if item.request.type == MessageType.MESSAGE_TYPE_PUBLISH_JOB:
-                    # work = Panorama(item, )
-                    # work.execute()
-                    executor.submit(self._execute, item.request.publish_job, ack)
-
-    def _execute(self, job: PublishJob, ack: Ack):
+        self.client.stop()
+
+    def _execute(self, job: PublishJob):
+        logger.debug(f"{self.service_id} -> Received job")
+        logger.debug(f"{pformat(job)}")
         try:
             panorama = Panorama(job, self.client.publish_event)
             panorama.execute()
-            ack.ok()
-
         except Exception as err:
             logger.error(f"{self.service_id} -> {pformat(err)}")
             logger.error("".join(traceback.format_exception(err)))
-            ack.cancel()
+            raise
 
 
 def main() -> int:
@@ -140,7 +107,7 @@ def main() -> int:
     logging.basicConfig(style="{")
     logging.getLogger("mercaido_panorama").setLevel(logging.INFO)
 
-    service = PanoramaService("horus.mercaido.panorama", args.amqp)
+    service = PanoramaService("horus.mercaido.panorama", args.amqp, args.concurrency)
 
     try:
         service.run()
@@ -156,5 +123,11 @@ def parse_cli_arguments(args: list[str]) -> argparse.Namespace:
         help="URL of AMQP server.",
         required=True,
     )
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=1,
+        help="Number of jobs to run at the same time.",
+    )
     parsed_args = parser.parse_args(args)
     return parsed_args
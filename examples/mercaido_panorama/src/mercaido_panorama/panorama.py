@@ -25,6 +25,10 @@ logger = logging.getLogger(__name__)
 
 
 class Panorama:
+    # Features are sent to the feature server in transactions of this
+    # many features.
+    BATCH_SIZE = 100
+
     job: PublishJob
 
     def __init__(self, job: PublishJob, on_event: Callable[[Event], None]) -> None:
@@ -39,17 +43,13 @@ class Panorama:
     def export(self, service):
         self._send_start_event()
 
-        properties = {}
-        for attr in service.attributes:
-            properties[attr.id] = attr
-
-        db_conn = psycopg2.connect(properties["recordings_server"].values[0])
-        client = Client(properties["media_server"].values[0], 10)
+        db_conn = psycopg2.connect(service.attribute("recordings_server").values[0])
+        client = Client(service.attribute("media_server").values[0], 10)
 
         frames = Frames(db_conn)
         image_provider = ImageProvider()
 
-        feature_server_params = properties["feature_server"].values_as_dict()
+        feature_server_params = service.attribute("feature_server").values_as_dict()
         feature_server = None
         # To use GeoServer with the ability to dynamically create layers:
         if feature_server_params["server_type"] == "geoserver":
@@ -65,7 +65,7 @@ class Panorama:
             )
 
         with feature_server:
-            layer_name = properties["feature_layer"].values[0]
+            layer_name = service.attribute("feature_layer").values[0]
             layer = feature_server.get_layer(layer_name)
 
             if layer is None:
@@ -77,7 +77,7 @@ class Panorama:
                         f"Layer '{layer}' does not exist and creating it is not supported by this feature server implementation"
                     )
 
-            out_dir = properties["outputfolder"].values[0]
+            out_dir = service.attribute("outputfolder").values[0]
             if not os.path.isdir(out_dir):
                 if os.path.exists(out_dir):
                     msg = f"Output {out_dir} exists, but it is not a directory"
@@ -86,14 +86,13 @@ class Panorama:
                 os.makedirs(out_dir)
             # Get frames
             with frames.query(
-                recordingid=int(properties["recordingid"].values[0]),
+                recordingid=service.attribute("recordingid").recording_id(),
                 order_by="index",
-            ) as results:
+            ) as results, layer.transaction(self.BATCH_SIZE):
                 for frame in Frame.iter(results):
                     if frame is None:
-                        self._send_finished_event()
                         print("No frames!")
-                        exit()
+                        break
 
                     # Set parameters
                     mode = Mode.panoramic
@@ -119,7 +118,8 @@ class Panorama:
                         (results.rownumber / results.rowcount) * 100
                     )
 
-                self._send_finished_event()
+        # Only finished once the last features are committed.
+        self._send_finished_event()
 
     def _send_start_event(self) -> None:
         event = Event(type=EventType.EVENT_TYPE_JOB_START)
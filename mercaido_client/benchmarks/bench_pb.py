@@ -0,0 +1,228 @@
+# SPDX-FileCopyrightText: 2023, 2024 Horus View and Explore B.V.
+#
+# SPDX-License-Identifier: MIT
+
+"""Micro-benchmarks of the generated message wrappers.
+
+Every case is timed twice, through the wrappers in
+`mercaido_client.pb.mercaido` and on the raw `mercaido_pb2` messages,
+and the overhead of the wrappers is reported. The payloads are shaped
+like real traffic: services registering with large SVG icons, and jobs
+with many attributes. Run with:
+
+    python benchmarks/bench_pb.py [-k SUBSTRING] [--repeat N]
+"""
+
+import argparse
+import timeit
+from collections.abc import Callable
+from typing import NamedTuple
+
+import mercaido_client.pb.mercaido_pb2 as pb2
+from mercaido_client.pb.mercaido import (
+    Attribute,
+    AttributeType,
+    MessageBase,
+    MessageType,
+    PublishJob,
+    RegisterServices,
+    RequestBase,
+    Service,
+)
+
+N_SERVICES = 5
+N_ATTRIBUTES = 50
+N_OPTIONS = 20
+SVG_SIZE = 64 * 1024
+
+
+class Case(NamedTuple):
+    name: str
+    wrapper: Callable[[], object]
+    raw: Callable[[], object]
+
+
+def _svg(n: int) -> str:
+    head = f'<svg xmlns="http://www.w3.org/2000/svg"><!-- service {n} -->'
+    body = '<path d="M0 0L10 10"/>' * (SVG_SIZE // 22)
+    return head + body + "</svg>"
+
+
+def _options() -> list[str]:
+    values = []
+    for n in range(N_OPTIONS):
+        values.extend([f"option-{n}", f"Option {n}"])
+    return values
+
+
+def _attributes() -> list[Attribute]:
+    return [
+        Attribute(
+            type=AttributeType.ATTRIBUTE_TYPE_SELECTION,
+            id=f"attr-{n}",
+            display_name=f"Attribute {n}",
+            display_description="A selection attribute.",
+            values=_options(),
+        )
+        for n in range(N_ATTRIBUTES)
+    ]
+
+
+def _raw_attributes() -> list[pb2.Attribute]:
+    return [
+        pb2.Attribute(
+            type=AttributeType.ATTRIBUTE_TYPE_SELECTION,
+            id=f"attr-{n}",
+            display_name=f"Attribute {n}",
+            display_description="A selection attribute.",
+            values=_options(),
+        )
+        for n in range(N_ATTRIBUTES)
+    ]
+
+
+def _register_services() -> MessageBase:
+    return MessageBase(
+        recipient="mercaido.dispatcher",
+        request=RequestBase(
+            type=MessageType.MESSAGE_TYPE_REGISTER_SERVICES,
+            register_services=RegisterServices(
+                services=[
+                    Service(
+                        endpoint=f"mercaido.service.{n}",
+                        name=f"Service {n}",
+                        svg=_svg(n),
+                        attributes=_attributes(),
+                    )
+                    for n in range(N_SERVICES)
+                ]
+            ),
+        ),
+    )
+
+
+def _publish_job() -> MessageBase:
+    return MessageBase(
+        recipient="mercaido.service.0",
+        request=RequestBase(
+            type=MessageType.MESSAGE_TYPE_PUBLISH_JOB,
+            publish_job=PublishJob(
+                job_id="42",
+                services=[
+                    Service(endpoint="mercaido.service.0", attributes=_attributes())
+                ],
+            ),
+        ),
+    )
+
+
+def _raw_publish_job() -> pb2.MessageBase:
+    return pb2.MessageBase(
+        recipient="mercaido.service.0",
+        request=pb2.RequestBase(
+            type=MessageType.MESSAGE_TYPE_PUBLISH_JOB,
+            publish_job=pb2.PublishJob(
+                job_id="42",
+                services=[
+                    pb2.Service(
+                        endpoint="mercaido.service.0", attributes=_raw_attributes()
+                    )
+                ],
+            ),
+        ),
+    )
+
+
+def _raw_values_as_dict(attr: pb2.Attribute) -> dict[str, str]:
+    it = iter(attr.values)
+    return dict(zip(it, it))
+
+
+def cases() -> list[Case]:
+    register = _register_services()
+    job = _publish_job()
+    register_data = register.serialize()
+    job_data = job.serialize()
+    raw_job = job.obj
+    attr = job.request.publish_job.services[0].attributes[0]
+
+    def iterate_wrapper():
+        for service in job.request.publish_job.services:
+            for attr in service.attributes:
+                attr.id
+
+    def iterate_raw():
+        for service in raw_job.request.publish_job.services:
+            for attr in service.attributes:
+                attr.id
+
+    return [
+        Case("construct publish_job", _publish_job, _raw_publish_job),
+        Case(
+            "serialize register_services",
+            register.serialize,
+            register.obj.SerializeToString,
+        ),
+        Case("serialize publish_job", job.serialize, raw_job.SerializeToString),
+        Case(
+            "deserialize register_services",
+            lambda: MessageBase.deserialize(register_data),
+            lambda: pb2.MessageBase.FromString(register_data),
+        ),
+        Case(
+            "deserialize publish_job",
+            lambda: MessageBase.deserialize(job_data),
+            lambda: pb2.MessageBase.FromString(job_data),
+        ),
+        Case(
+            "values_as_dict",
+            attr.values_as_dict,
+            lambda: _raw_values_as_dict(attr.obj),
+        ),
+        Case(
+            "nested field",
+            lambda: job.request.publish_job.job_id,
+            lambda: raw_job.request.publish_job.job_id,
+        ),
+        Case(
+            "repeated field",
+            lambda: job.request.publish_job.services[0].endpoint,
+            lambda: raw_job.request.publish_job.services[0].endpoint,
+        ),
+        Case("iterate attributes", iterate_wrapper, iterate_raw),
+    ]
+
+
+def _time(fn: Callable[[], object], repeat: int) -> float:
+    timer = timeit.Timer(fn)
+    number, _ = timer.autorange()
+    return min(timer.repeat(repeat, number)) / number
+
+
+def _format(seconds: float) -> str:
+    for unit, scale in (("s", 1), ("ms", 1e-3), ("us", 1e-6)):
+        if seconds >= scale:
+            return f"{seconds / scale:.1f} {unit}"
+    return f"{seconds / 1e-9:.0f} ns"
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("-k", default="", help="only run cases containing this")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    print(f"{'case':<32} {'wrapper':>10} {'mercaido_pb2':>13} {'overhead':>9}")
+    for case in cases():
+        if args.k not in case.name:
+            continue
+        t_wrapper = _time(case.wrapper, args.repeat)
+        t_raw = _time(case.raw, args.repeat)
+        print(
+            f"{case.name:<32} {_format(t_wrapper):>10} {_format(t_raw):>13}"
+            f" {t_wrapper / t_raw:>8.2f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
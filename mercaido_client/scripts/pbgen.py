@@ -15,6 +15,15 @@ from google.protobuf.message import Message as PBMessage
 from google.protobuf.descriptor import FieldDescriptor as PBFieldDescriptor
 
 
+# Typed getters of Attribute values, by attribute type: the method name,
+# attribute type, return type and conversion of the first value.
+ATTRIBUTE_GETTERS = [
+    ("number", "ATTRIBUTE_TYPE_NUMBER", "float", "float({})"),
+    ("boolean", "ATTRIBUTE_TYPE_BOOLEAN", "bool", '{} == "True"'),
+    ("recording_id", "ATTRIBUTE_TYPE_RECORDING_ID", "int", "int({})"),
+]
+
+
 def main():
     proto_file: PosixPath = files("mercaido_client.pb").joinpath("proto/mercaido.proto")
 
@@ -42,9 +51,9 @@ def main():
         "",
         "from __future__ import annotations",
         "",
-        "from typing import Optional, cast",
+        "from collections.abc import Sequence",
+        "from typing import Optional",
         "from enum import IntEnum",
-        "from itertools import islice",
     ]
 
     _, msg = messages[0]
@@ -52,6 +61,7 @@ def main():
     cbuffer.append("from .message import (")
     cbuffer.append("    Message,")
     cbuffer.append("    MessageRegistry,")
+    cbuffer.append("    RepeatedMessages,")
     cbuffer.append(")")
 
     cbuffer.append("\n")
@@ -66,7 +76,33 @@ def main():
         module = _fqmn(msg.__module__)
         fields = _order_fields(msg.DESCRIPTOR.fields)
 
+        # Wrappers of submessages are cached in a slot per field, so are
+        # the dicts derived from repeated fields. Derived caches are
+        # reset when their field is assigned or deleted.
+        cache_slots = {}
+        derived = {}
+        for field in fields:
+            if _is_list_of_msg(field):
+                wrapper = field.message_type.name
+                cache_slots[_cache_slot(field.name)] = f"RepeatedMessages[{wrapper}]"
+                if _has_id(field.message_type):
+                    slot = _cache_slot(field.name, "index")
+                    cache_slots[slot] = "tuple[int, dict[str, int]]"
+                    derived[field.name] = slot
+            elif _is_msg(field):
+                cache_slots[_cache_slot(field.name)] = field.message_type.name
+            elif _is_list_of_string(field):
+                slot = _cache_slot(field.name, "dict")
+                cache_slots[slot] = "tuple[tuple[str, ...], dict[str, str]]"
+                derived[field.name] = slot
+
         cbuffer.append(f"class {name}(Message):")
+        cbuffer.append(f"    __slots__ = ({''.join(f'{s!r}, ' for s in cache_slots)})")
+        cbuffer.append("")
+        for slot, slot_type in cache_slots.items():
+            cbuffer.append(f"    {slot}: Optional[{slot_type}]")
+        if cache_slots:
+            cbuffer.append("")
         cbuffer.append(f"    TYPE = {module}.{name} # type: ignore[attr-defined]")
         cbuffer.append("")
 
@@ -91,6 +127,8 @@ def main():
         constructor.append("):")
         cbuffer.append(f"    {''.join(constructor)}")
         cbuffer.append("        self.obj = self.TYPE()")
+        if cache_slots:
+            cbuffer.append("        self._reset_cache()")
 
         for field in fields:
             assignment = []
@@ -111,21 +149,41 @@ def main():
 
         cbuffer.append("")
 
+        if cache_slots:
+            cbuffer.append("    def _reset_cache(self) -> None:")
+            for slot in cache_slots:
+                cbuffer.append(f"        self.{slot} = None")
+            cbuffer.append("")
+
+        if name == "Attribute":
+            _attribute_getters(cbuffer)
+
         for field in fields:
             py_type = _field_py_type(field)
+            if _is_list_of_msg(field):
+                py_type = f"Sequence[{field.message_type.name}]"
 
             cbuffer.append(f"    @property")
             cbuffer.append(f"    def {field.name}(self) -> {py_type}:")
 
             # TODO: Handle enum wrapping.
+            slot = _cache_slot(field.name)
             if _is_list_of_msg(field):
+                cbuffer.append(f"        items = self.obj.{field.name}")
+                cbuffer.append(f"        view = self.{slot}")
+                cbuffer.append("        if view is None or view._items is not items:")
                 cbuffer.append(
-                    f"        return cast({py_type}, [self._from_pb(m) for m in self.obj.{field.name}])"
+                    f"            view = self.{slot} = RepeatedMessages(items, {field.message_type.name})"
                 )
+                cbuffer.append("        return view")
             elif _is_msg(field):
+                cbuffer.append(f"        pb = self.obj.{field.name}")
+                cbuffer.append(f"        msg = self.{slot}")
+                cbuffer.append("        if msg is None or msg.obj is not pb:")
                 cbuffer.append(
-                    f"        return cast({py_type}, self._from_pb(self.obj.{field.name}))"
+                    f"            msg = self.{slot} = {field.message_type.name}._wrap(pb)"
                 )
+                cbuffer.append("        return msg")
             else:
                 cbuffer.append(f"        return self.obj.{field.name}")
 
@@ -146,6 +204,8 @@ def main():
                 cbuffer.append(f"        self.obj.{field.name}.CopyFrom(value.obj)")
             else:
                 cbuffer.append(f"        self.obj.{field.name} = value")
+            if field.name in derived:
+                cbuffer.append(f"        self.{derived[field.name]} = None")
 
             cbuffer.append("")
 
@@ -153,23 +213,55 @@ def main():
             cbuffer.append(f"    @{field.name}.deleter")
             cbuffer.append(f"    def {field.name}(self) -> None:")
             cbuffer.append(f'        self.obj.ClearField("{field.name}")')
+            if field.name in derived:
+                cbuffer.append(f"        self.{derived[field.name]} = None")
             cbuffer.append("")
 
+            # The protobuf containers can also change in place, through
+            # `obj`, so the derived caches are checked before they are
+            # used.
             if _is_list_of_string(field):
+                slot = derived[field.name]
                 cbuffer.append(f"    def {field.name}_as_dict(self) -> dict[str, str]:")
-                cbuffer.append(f"        if len(self.{field.name}) == 0:")
-                cbuffer.append("            return {}")
-                cbuffer.append(f"        elif len(self.{field.name}) % 2 != 0:")
+                cbuffer.append(f"        items = tuple(self.obj.{field.name})")
+                cbuffer.append(f"        cached = self.{slot}")
+                cbuffer.append("        if cached is None or cached[0] != items:")
+                cbuffer.append("            if len(items) % 2 != 0:")
                 cbuffer.append(
-                    f"            raise ValueError('Field `{name}.{field.name}` should contain an even amount of items representing alternating keys and values')"
+                    f"                raise ValueError('Field `{name}.{field.name}` should contain an even amount of items representing alternating keys and values')"
                 )
-                cbuffer.append("        def _it_to_tuples(it):")
-                cbuffer.append("            while pair := tuple(islice(it, 2)):")
-                cbuffer.append("                yield pair")
-                cbuffer.append(f"        iterator = iter(self.{field.name})")
+                cbuffer.append("            it = iter(items)")
                 cbuffer.append(
-                    "        return dict([pair for pair in _it_to_tuples(iterator)])"
+                    f"            cached = self.{slot} = (items, dict(zip(it, it)))"
                 )
+                cbuffer.append("        return dict(cached[1])")
+                cbuffer.append("")
+            elif field.name in derived:
+                # A cached position is used when the item there still has
+                # the id and no items were added or removed. Otherwise,
+                # also when the id is not found, the index is rebuilt.
+                slot = derived[field.name]
+                wrapper = field.message_type.name
+                method = field.name.removesuffix("s")
+                cbuffer.append(f"    def {method}(self, id: str) -> {wrapper}:")
+                cbuffer.append(
+                    f'        """Return the last of `{field.name}` with `id`, like a dict'
+                )
+                cbuffer.append('        keyed by id would."""')
+                cbuffer.append(f"        items = self.obj.{field.name}")
+                cbuffer.append(f"        index = self.{slot}")
+                cbuffer.append(
+                    "        if index is not None and index[0] == len(items):"
+                )
+                cbuffer.append("            n = index[1].get(id)")
+                cbuffer.append("            if n is not None and items[n].id == id:")
+                cbuffer.append(f"                return self.{field.name}[n]")
+                cbuffer.append(
+                    "        positions = {item.id: n for n, item in enumerate(items)}"
+                )
+                cbuffer.append(f"        self.{slot} = (len(items), positions)")
+                cbuffer.append(f"        return self.{field.name}[positions[id]]")
+                cbuffer.append("")
 
             cbuffer.append("")
 
@@ -194,6 +286,37 @@ def _order_fields(fields):
     return list(reversed(sorted(fields, key=lambda f: f.label)))
 
 
+def _cache_slot(field_name, suffix=None):
+    return f"_{field_name}_{suffix}" if suffix else f"_{field_name}"
+
+
+def _has_id(message_type):
+    field = message_type.fields_by_name.get("id")
+    return field is not None and _is_string(field)
+
+
+def _attribute_getters(cbuffer):
+    for method, attr_type, py_type, conversion in ATTRIBUTE_GETTERS:
+        cbuffer.append(f"    def {method}(self) -> {py_type}:")
+        short_name = attr_type.removeprefix("ATTRIBUTE_TYPE_")
+        cbuffer.append(f'        """The value of a {short_name} attribute."""')
+        value = f"self._value(AttributeType.{attr_type})"
+        cbuffer.append(f"        return {conversion.format(value)}")
+        cbuffer.append("")
+
+    cbuffer.append("    def _value(self, type: AttributeType) -> str:")
+    cbuffer.append("        if self.obj.type != type:")
+    cbuffer.append(
+        "            raise ValueError(f'Attribute {self.obj.id!r} is not of type {type.name}')"
+    )
+    cbuffer.append("        if not self.obj.values:")
+    cbuffer.append(
+        "            raise ValueError(f'Attribute {self.obj.id!r} has no value')"
+    )
+    cbuffer.append("        return self.obj.values[0]")
+    cbuffer.append("")
+
+
 def _can_be_none(field):
     return (
         field.label == PBFieldDescriptor.LABEL_OPTIONAL
@@ -1,10 +1,16 @@
 from __future__ import annotations
 
 import logging
-from typing import Optional, Any
+import struct
+from collections.abc import Callable, Iterable, Iterator, Sequence
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import ClassVar, Optional, Any
 
-from osgeo import ogr
+import numpy as np
+from osgeo import gdal, ogr
 
+from .cache import DATASOURCE_CACHE, DatasourceCache
 from .exception import NoSuchLayerError, ClientError
 
 
@@ -13,6 +19,7 @@ from .exception import NoSuchLayerError, ClientError
 # This switches it to raise exceptions instead.
 # Reference: https://gdal.org/api/python_gotchas.html#python-bindings-do-not-raise-exceptions-unless-you-explicitly-call-useexceptions
 ogr.UseExceptions()
+gdal.UseExceptions()
 
 logger = logging.getLogger(__name__)
 
@@ -23,15 +30,24 @@ class FeatureServerClient:
     _datasource: ogr.DataSource = None
     _endpoint: str
     _readonly: bool
+    _page_size: Optional[int]
+    _cache: Optional[DatasourceCache]
 
     def __init__(self, endpoint: str, **kwargs) -> None:
         """Create a new FeatureServer instance
 
         Arguments:
         endpoint (str): The HTTP(S) endpoint of the WFS-T server
-        readonly (bool):  Open the layer in read-only mode"""
+        readonly (bool):  Open the layer in read-only mode
+        page_size (int): Fetch features from the server in pages of this
+            many features, instead of all at once
+        cache (DatasourceCache): Reuse opened datasources through this
+            cache, by default the one shared by this process. None opens
+            and closes a datasource every time."""
         self._endpoint = endpoint
         self._readonly = kwargs.get("readonly") or False
+        self._page_size = kwargs.get("page_size")
+        self._cache = kwargs.get("cache", DATASOURCE_CACHE)
         super().__init__()
 
     def __enter__(self):
@@ -44,13 +60,40 @@ class FeatureServerClient:
     def open(self):
         if self._datasource is not None:
             raise ClientError("already opened")
-        self._datasource = ogr.Open(f"WFS:{self._endpoint}", not self._readonly)
+        if self._cache is None:
+            self._datasource = self._open_datasource()
+        else:
+            key = (self._endpoint, self._readonly, self._page_size)
+            self._datasource = self._cache.acquire(
+                self._endpoint, key, self._open_datasource
+            )
 
     def close(self):
         if self._datasource is None:
             raise ClientError("already closed")
-        self._datasource.Close()
-        self._datasource = None
+        datasource, self._datasource = self._datasource, None
+        if self._cache is None:
+            datasource.Close()
+        else:
+            self._cache.release(datasource)
+
+    def invalidate(self) -> None:
+        """Stop reusing cached datasources of this server, because its
+        layers changed. Takes effect when the client is opened again."""
+        if self._cache is not None:
+            self._cache.invalidate(self._endpoint)
+
+    def _open_datasource(self) -> ogr.DataSource:
+        if self._page_size is None:
+            return ogr.Open(f"WFS:{self._endpoint}", not self._readonly)
+        flags = gdal.OF_VECTOR
+        if not self._readonly:
+            flags |= gdal.OF_UPDATE
+        return gdal.OpenEx(
+            f"WFS:{self._endpoint}",
+            flags,
+            open_options=["PAGING_ALLOWED=ON", f"PAGE_SIZE={self._page_size}"],
+        )
 
     def get_layers(self) -> list[Layer]:
         """Return a list of Layers in this FeatureServer"""
@@ -85,12 +128,20 @@ class LayerManagerInterface:
 class Layer:
     """Wrapper around WFS-T Layer"""
 
+    DEFAULT_BATCH_SIZE: ClassVar[int] = 500
+
     _ogr_layer: ogr.Layer
     _feature_definition: ogr.FeatureDefn
+    _in_transaction: bool
+    _batch_size: Optional[int]
+    _pending: int
 
     def __init__(self, ogr_layer: ogr.Layer) -> None:
         self._ogr_layer = ogr_layer
         self._feature_definition = ogr_layer.GetLayerDefn()
+        self._in_transaction = False
+        self._batch_size = None
+        self._pending = 0
 
     @property
     def name(self) -> str:
@@ -122,13 +173,133 @@ class Layer:
 
     def get_features(self) -> list[Feature]:
         """Returns a list of features present on this layer."""
-        features = []
-        self._ogr_layer.ResetReading()
-        while feature := self._ogr_layer.GetNextFeature():
-            features.append(Feature(feature))
+        return list(self.iter_features())
+
+    def iter_features(
+        self,
+        where: Optional[str] = None,
+        bbox: Optional[tuple[float, float, float, float]] = None,
+        fields: Optional[Iterable[str]] = None,
+        geometry: bool = True,
+    ) -> Iterator[Feature]:
+        """Yield the features of this layer one at a time.
 
-        self._ogr_layer.ResetReading()
-        return features
+        Features are read from the server while iterating, in pages when
+        the feature server was opened with a `page_size`. Filters are
+        sent to the server where possible, so only the features and
+        fields that are asked for are transferred.
+
+        A layer has a single read position, don't read from it in other
+        ways while iterating.
+
+        Args:
+            where (str): An attribute filter, an OGR SQL WHERE clause
+            bbox (tuple): Only yield features intersecting this rectangle,
+                given as (min_x, min_y, max_x, max_y) in the layer's CRS
+            fields (Iterable[str]): Only read these fields
+            geometry (bool): Whether to read the geometries
+        """
+        with self._reading(where, bbox, fields, geometry):
+            while feature := self._ogr_layer.GetNextFeature():
+                yield Feature(feature)
+
+    def read_columns(
+        self,
+        where: Optional[str] = None,
+        bbox: Optional[tuple[float, float, float, float]] = None,
+        fields: Optional[Iterable[str]] = None,
+    ) -> FeatureColumns:
+        """Read the features of this layer into NumPy arrays, one per
+        field. The features can be filtered like with `iter_features()`.
+
+        Features are read in bulk through GDAL's Arrow stream interface
+        when it is available. Otherwise they are read one at a time.
+        """
+        with self._reading(where, bbox, fields, geometry=True):
+            if hasattr(self._ogr_layer, "GetArrowStreamAsNumPy"):
+                columns = self._read_arrow_columns()
+                if columns is not None:
+                    return columns
+            return self._read_feature_columns()
+
+    def _read_arrow_columns(self) -> FeatureColumns | None:
+        ogr_layer = self._ogr_layer
+        stream = ogr_layer.GetArrowStreamAsNumPy(
+            options=["USE_MASKED_ARRAYS=NO", "GEOMETRY_ENCODING=WKB"]
+        )
+        batches = list(stream)
+        if not batches:
+            return None
+
+        fid_column = ogr_layer.GetFIDColumn() or "OGC_FID"
+        geometry_column = ogr_layer.GetGeometryColumn() or "wkb_geometry"
+        arrays = {
+            name: np.concatenate([batch[name] for batch in batches])
+            for name in batches[0]
+        }
+        return FeatureColumns(
+            fid=arrays.pop(fid_column).astype(np.int64, copy=False),
+            geometry=arrays.pop(geometry_column, np.empty(0, dtype=object)),
+            columns=arrays,
+        )
+
+    def _read_feature_columns(self) -> FeatureColumns:
+        definition = self._feature_definition
+        names = [
+            definition.GetFieldDefn(n).GetName()
+            for n in range(definition.GetFieldCount())
+            if not definition.GetFieldDefn(n).IsIgnored()
+        ]
+        fids = []
+        geometries = []
+        values: dict[str, list[Any]] = {name: [] for name in names}
+        while feature := self._ogr_layer.GetNextFeature():
+            fids.append(feature.GetFID())
+            geometry = feature.GetGeometryRef()
+            geometries.append(
+                None if geometry is None else bytes(geometry.ExportToIsoWkb())
+            )
+            for name in names:
+                values[name].append(feature.GetField(name))
+
+        return FeatureColumns(
+            fid=np.array(fids, dtype=np.int64),
+            geometry=np.array(geometries, dtype=object),
+            columns={name: _column(column) for name, column in values.items()},
+        )
+
+    @contextmanager
+    def _reading(
+        self,
+        where: Optional[str],
+        bbox: Optional[tuple[float, float, float, float]],
+        fields: Optional[Iterable[str]],
+        geometry: bool,
+    ) -> Iterator[None]:
+        ogr_layer = self._ogr_layer
+        ignored = []
+        if fields is not None:
+            keep = set(fields)
+            definition = self._feature_definition
+            for n in range(definition.GetFieldCount()):
+                name = definition.GetFieldDefn(n).GetName()
+                if name not in keep:
+                    ignored.append(name)
+        if not geometry:
+            ignored.append("OGR_GEOMETRY")
+
+        ogr_layer.SetAttributeFilter(where)
+        if bbox is not None:
+            ogr_layer.SetSpatialFilterRect(*bbox)
+        ogr_layer.SetIgnoredFields(ignored)
+        ogr_layer.ResetReading()
+        try:
+            yield
+        finally:
+            ogr_layer.SetAttributeFilter(None)
+            ogr_layer.SetSpatialFilter(None)
+            ogr_layer.SetIgnoredFields([])
+            ogr_layer.ResetReading()
 
     def create_point(self, point: Point, props: dict[str, Any] = {}) -> Feature:
         """Construct a Point feature for this layer.
@@ -150,6 +321,38 @@ class Layer:
 
         return Feature(ogr_feat, props)
 
+    def create_points(
+        self,
+        coordinates: Any,
+        props: dict[str, Any] = {},
+        dimensions: Optional[int] = None,
+    ) -> Iterator[Feature]:
+        """Construct a Point feature for each row of `coordinates`.
+
+        The geometries are built from WKB in bulk, without a `Point` per
+        feature. Features are created while iterating, so they can be
+        passed to `add_features()` one batch at a time.
+
+        Args:
+            coordinates: An array with a row of longitude, latitude and
+                optionally altitude per point, or a flat buffer of them
+            dimensions (int): The number of values per point in a flat
+                buffer, 2 by default
+
+        Raises:
+            TypeError: If the WFS layer does not support Point features
+        """
+        if self._feature_definition.GetGeomType() is not ogr.wkbPoint:
+            raise TypeError("This layer does not accept points")
+
+        wkbs = _wkb_point_list(coordinate_array(coordinates, dimensions))
+        return (self._create_feature(wkb, props) for wkb in wkbs)
+
+    def _create_feature(self, wkb: bytes, props: dict[str, Any]) -> Feature:
+        ogr_feat = ogr.Feature(feature_def=self._feature_definition)
+        ogr_feat.SetGeometryDirectly(ogr.CreateGeometryFromWkb(wkb))
+        return Feature(ogr_feat, props)
+
     def create_linestring(
         self, points: list[Point], props: dict[str, Any] = {}
     ) -> Feature:
@@ -220,6 +423,42 @@ class Layer:
 
         return Feature(ogr_feat, props)
 
+    @contextmanager
+    def transaction(self, batch_size: Optional[int] = None) -> Iterator[Layer]:
+        """Group the writes to this layer in transactions.
+
+        Features added, updated or deleted in the block are sent to the
+        server in one WFS-T transaction when the block ends, instead of
+        one per feature. With `batch_size`, the transaction is committed
+        and a new one started after every `batch_size` writes.
+
+        When the block raises, the writes since the last commit are
+        rolled back. Transactions don't nest, a transaction started
+        within a transaction is part of the outer one.
+
+        Arguments:
+            batch_size (int): The maximum number of writes per transaction
+        """
+        if self._in_transaction:
+            yield self
+            return
+
+        self._ogr_layer.StartTransaction()
+        self._in_transaction = True
+        self._batch_size = batch_size
+        self._pending = 0
+        try:
+            yield self
+        except BaseException:
+            self._ogr_layer.RollbackTransaction()
+            raise
+        else:
+            self._ogr_layer.CommitTransaction()
+        finally:
+            self._in_transaction = False
+            self._batch_size = None
+            self._pending = 0
+
     def add_feature(self, feature: Feature) -> None:
         """Add a feature to the layer.
 
@@ -230,6 +469,7 @@ class Layer:
             feature (Feature): A Feature to add to the layer.
         """
         self._ogr_layer.CreateFeature(feature._ogr_feature)
+        self._written()
 
     def update_feature(self, feature: Feature) -> None:
         """Update an existing feature.
@@ -240,7 +480,8 @@ class Layer:
         Arguments:
             feature (Feature): The Feature to update
         """
-        self._ogr_layer.SetFeature(feature)
+        self._ogr_layer.SetFeature(feature._ogr_feature)
+        self._written()
 
     def delete_feature(self, feature: Feature) -> None:
         """Delete a feature.
@@ -250,7 +491,87 @@ class Layer:
         Arguments:
             feature (Feature): The Feature to update
         """
-        self._ogr_layer.DeleteFeature(feature)
+        self._ogr_layer.DeleteFeature(feature.id)
+        self._written()
+
+    def add_features(
+        self, features: Iterable[Feature], batch_size: int = DEFAULT_BATCH_SIZE
+    ) -> int:
+        """Add features to the layer, in transactions of `batch_size`
+        features. Returns the number of features added.
+
+        Arguments:
+            features (Iterable[Feature]): The features to add, may be a
+                generator
+            batch_size (int): The maximum number of features per transaction
+        """
+        return self._write_features(self.add_feature, features, batch_size)
+
+    def update_features(
+        self, features: Iterable[Feature], batch_size: int = DEFAULT_BATCH_SIZE
+    ) -> int:
+        """Update existing features, like `add_features()`."""
+        return self._write_features(self.update_feature, features, batch_size)
+
+    def delete_features(
+        self, features: Iterable[Feature], batch_size: int = DEFAULT_BATCH_SIZE
+    ) -> int:
+        """Delete features, like `add_features()`."""
+        return self._write_features(self.delete_feature, features, batch_size)
+
+    def _write_features(
+        self,
+        write: Callable[[Feature], None],
+        features: Iterable[Feature],
+        batch_size: int,
+    ) -> int:
+        count = 0
+        with self.transaction(batch_size):
+            for feature in features:
+                write(feature)
+                count += 1
+        return count
+
+    def _written(self) -> None:
+        if not self._in_transaction or self._batch_size is None:
+            return
+        self._pending += 1
+        if self._pending >= self._batch_size:
+            logger.debug(f"Committing {self._pending} writes to {self.name}")
+            self._ogr_layer.CommitTransaction()
+            self._ogr_layer.StartTransaction()
+            self._pending = 0
+
+
+@dataclass
+class FeatureColumns:
+    """Features of a layer as columns, see `Layer.read_columns()`."""
+
+    # The feature IDs.
+    fid: np.ndarray
+    # The geometries as ISO WKB, None for features without a geometry.
+    geometry: np.ndarray
+    # The values of each field.
+    columns: dict[str, np.ndarray]
+
+    def __len__(self) -> int:
+        return len(self.fid)
+
+    def __getitem__(self, field: str) -> np.ndarray:
+        return self.columns[field]
+
+    def coordinates(self) -> np.ndarray:
+        """Return the coordinates of point geometries.
+
+        Returns an array with a row of x, y and, for 3D points, z per
+        feature. The coordinates of features without a geometry are NaN,
+        M values are dropped.
+
+        Raises:
+            TypeError: If a geometry is not a point, or points have
+                different dimensions
+        """
+        return _point_coordinates(self.geometry)
 
 
 class Feature:
@@ -280,11 +601,79 @@ class Feature:
         self._ogr_feature.SetGeometry(new_geometry)
 
 
+# The WKB point types: the number of values per point, and whether the
+# third is z. ISO WKB adds 1000 for Z, 2000 for M and 3000 for ZM,
+# extended WKB sets the high bits for Z and M.
+_WKB_POINT_TYPES = {
+    1: (2, False),
+    1001: (3, True),
+    2001: (3, False),
+    3001: (4, True),
+    0x80000001: (3, True),
+    0x40000001: (3, False),
+    0xC0000001: (4, True),
+}
+
+
+def _point_coordinates(wkbs: Sequence[Optional[bytes]]) -> np.ndarray:
+    present = np.array([wkb is not None for wkb in wkbs], dtype=bool)
+    points = [wkb for wkb in wkbs if wkb is not None]
+    sizes = np.array([len(wkb) for wkb in points], dtype=np.intp)
+
+    # The points are read in bulk per size, byte order and type.
+    found = np.empty((len(points), 3))
+    dimensions = None
+    for size in np.unique(sizes).tolist():
+        indices = np.flatnonzero(sizes == size)
+        data = b"".join([points[i] for i in indices])
+        raw = np.frombuffer(data, dtype=np.uint8).reshape(-1, size)
+        # Byte order 1 is little endian, 0 big endian.
+        if size < 5 or not np.isin(raw[:, 0], (0, 1)).all():
+            raise TypeError("Geometries are not points")
+        for byte_order, endian in ((1, "<"), (0, ">")):
+            rows = raw[:, 0] == byte_order
+            if not rows.any():
+                continue
+            selected = raw[rows]
+            types = selected[:, 1:5].copy().view(f"{endian}u4").ravel()
+            for geometry_type in np.unique(types).tolist():
+                values, has_z = _WKB_POINT_TYPES.get(geometry_type, (0, False))
+                if size != 5 + 8 * values:
+                    raise TypeError("Geometries are not points")
+                point_dimensions = 3 if has_z else 2
+                if dimensions not in (None, point_dimensions):
+                    raise TypeError("Geometries are not points of the same dimension")
+                dimensions = point_dimensions
+                of_type = types == geometry_type
+                xyz = selected[of_type, 5:].copy().view(f"{endian}f8")
+                found[indices[rows][of_type], :dimensions] = xyz[:, :dimensions]
+
+    dimensions = dimensions or 2
+    coordinates = np.full((len(wkbs), dimensions), np.nan)
+    coordinates[present] = found[:, :dimensions]
+    return coordinates
+
+
+def _column(values: list[Any]) -> np.ndarray:
+    column = np.asarray(values)
+    if column.dtype.kind in "US":
+        # Like the Arrow stream, strings are Python objects.
+        column = np.array(values, dtype=object)
+    return column
+
+
 class Point:
+    """A point in longitude, latitude and optionally altitude.
+
+    Lightweight, the OGR geometry is only created when it is used.
+    """
+
+    __slots__ = ("_latitude", "_longitude", "_altitude", "_ogr_geometry")
+
     _latitude: float
     _longitude: float
     _altitude: Optional[float]
-    _ogr_geometry: ogr.Geometry
+    _ogr_geometry: Optional[ogr.Geometry]
 
     def __init__(
         self, latitude: float, longitude: float, altitude: Optional[float] = None
@@ -292,11 +681,7 @@ class Point:
         self._latitude = latitude
         self._longitude = longitude
         self._altitude = altitude
-        self._ogr_geometry = ogr.Geometry(ogr.wkbPoint)
-        if altitude:
-            self._ogr_geometry.AddPoint(longitude, latitude, altitude)
-        else:
-            self._ogr_geometry.AddPoint_2D(longitude, latitude)
+        self._ogr_geometry = None
 
     @property
     def latitude(self) -> float:
@@ -305,6 +690,7 @@ class Point:
     @latitude.setter
     def latitude(self, value: float) -> None:
         self._latitude = value
+        self._ogr_geometry = None
 
     @property
     def longitude(self) -> float:
@@ -313,6 +699,7 @@ class Point:
     @longitude.setter
     def longitude(self, value: float) -> None:
         self._longitude = value
+        self._ogr_geometry = None
 
     @property
     def altitude(self) -> float:
@@ -321,36 +708,69 @@ class Point:
     @altitude.setter
     def altitude(self, value: float) -> None:
         self._altitude = value
+        self._ogr_geometry = None
 
     @property
     def geometry(self) -> ogr.Geometry:
+        if self._ogr_geometry is None:
+            geometry = ogr.Geometry(ogr.wkbPoint)
+            if self._altitude:
+                geometry.AddPoint(self._longitude, self._latitude, self._altitude)
+            else:
+                geometry.AddPoint_2D(self._longitude, self._latitude)
+            self._ogr_geometry = geometry
         return self._ogr_geometry
 
     def wkt(self) -> str:
-        return self._ogr_geometry.ExportToWkt()
+        return self.geometry.ExportToWkt()
 
 
 class Polyline:
-    _points: list[Point]
+    """A line through points.
+
+    Create it from a list of `Point`s, or from coordinates with
+    `from_coordinates()`. Both are converted to the other on demand.
+    """
+
+    _points: Optional[list[Point]]
+    _coordinates: np.ndarray
     _ogr_geometry: ogr.Geometry
 
     def __init__(self, points: list[Point]) -> None:
         self.points = points
 
+    @classmethod
+    def from_coordinates(
+        cls, coordinates: Any, dimensions: Optional[int] = None
+    ) -> Polyline:
+        """Create a polyline from coordinates.
+
+        Arguments:
+            coordinates: An array with a row of longitude, latitude and
+                optionally altitude per point, or a flat buffer of them
+            dimensions (int): The number of values per point in a flat
+                buffer, 2 by default
+        """
+        polyline = cls.__new__(cls)
+        polyline._set_coordinates(coordinate_array(coordinates, dimensions))
+        return polyline
+
     @property
     def points(self) -> list[Point]:
+        if self._points is None:
+            self._points = points_from_coordinates(self._coordinates)
         return self._points
 
     @points.setter
     def points(self, points: list[Point]) -> None:
+        self._set_coordinates(_points_to_coordinates(points))
         self._points = points
-        geometry = ogr.Geometry(ogr.wkbLineString)
-        for point in points:
-            if point.altitude:
-                geometry.AddPoint(point.longitude, point.latitude, point.altitude)
-            else:
-                geometry.AddPoint_2D(point.longitude, point.latitude)
-        self._ogr_geometry = geometry
+
+    @property
+    def coordinates(self) -> np.ndarray:
+        """The coordinates of the points, a row of longitude, latitude
+        and optionally altitude per point."""
+        return self._coordinates
 
     @property
     def geometry(self) -> ogr.Geometry:
@@ -359,43 +779,57 @@ class Polyline:
     def wkt(self) -> str:
         return self._ogr_geometry.ExportToWkt()
 
+    def _set_coordinates(self, coordinates: np.ndarray) -> None:
+        self._points = None
+        self._coordinates = coordinates
+        self._ogr_geometry = ogr.CreateGeometryFromWkb(_wkb_linestring(coordinates))
+
 
 class Polygon:
-    _points: list[list[Point]]
+    """A polygon of one or more rings of points.
+
+    Create it from lists of `Point`s, or from coordinates with
+    `from_coordinates()`. Both are converted to the other on demand.
+    """
+
+    _points: Optional[list[list[Point]]]
+    _rings: list[np.ndarray]
     _ogr_geometry: ogr.Geometry
 
     def __init__(self, points: list[list[Point]]) -> None:
         self.points = points
 
+    @classmethod
+    def from_coordinates(
+        cls, rings: Sequence[Any], dimensions: Optional[int] = None
+    ) -> Polygon:
+        """Create a polygon from the coordinates of its rings.
+
+        Arguments:
+            rings: A coordinate array per ring, see
+                `Polyline.from_coordinates()`
+            dimensions (int): The number of values per point in flat
+                buffers, 2 by default
+        """
+        polygon = cls.__new__(cls)
+        polygon._set_rings([coordinate_array(ring, dimensions) for ring in rings])
+        return polygon
+
     @property
     def points(self) -> list[list[Point]]:
+        if self._points is None:
+            self._points = [points_from_coordinates(ring) for ring in self._rings]
         return self._points
 
     @points.setter
     def points(self, points: list[list[Point]]) -> None:
-        if len(points) < 1:
-            raise ValueError("A polygon needs at least one ring of points")
-        for i, ring in enumerate(points):
-            if len(ring) < 3:
-                raise ValueError(
-                    f"Polygon ring {i} has too few points, found {len(points)}, need at least 3 to create a polygon"
-                )
-
+        self._set_rings([_points_to_coordinates(ring) for ring in points])
         self._points = points
-        geometry = ogr.Geometry(ogr.wkbPolygon)
-        for ring in points:
-            ring_geom = ogr.Geometry(ogr.wkbLinearRing)
-
-            for point in ring:
-                if point.altitude:
-                    ring_geom.AddPoint(point.longitude, point.latitude, point.altitude)
-                else:
-                    ring_geom.AddPoint_2D(point.longitude, point.latitude)
-
-            ring_geom.CloseRings()
-            geometry.AddGeometry(ring_geom)
 
-        self._ogr_geometry = geometry
+    @property
+    def rings(self) -> list[np.ndarray]:
+        """The coordinates of the rings, like `Polyline.coordinates`."""
+        return self._rings
 
     @property
     def geometry(self) -> ogr.Geometry:
@@ -403,3 +837,110 @@ class Polygon:
 
     def wkt(self) -> str:
         return self._ogr_geometry.ExportToWkt()
+
+    def _set_rings(self, rings: list[np.ndarray]) -> None:
+        if len(rings) < 1:
+            raise ValueError("A polygon needs at least one ring of points")
+        for i, ring in enumerate(rings):
+            if len(ring) < 3:
+                raise ValueError(
+                    f"Polygon ring {i} has too few points, found {len(ring)}, need at least 3 to create a polygon"
+                )
+
+        self._points = None
+        self._rings = rings
+        self._ogr_geometry = ogr.CreateGeometryFromWkb(_wkb_polygon(rings))
+
+
+def coordinate_array(coordinates: Any, dimensions: Optional[int] = None) -> np.ndarray:
+    """Return `coordinates` as an array with a row per point.
+
+    Arguments:
+        coordinates: An array-like with a row of longitude, latitude and
+            optionally altitude per point, or a flat buffer of them
+        dimensions (int): The number of values per point in a flat
+            buffer, 2 by default
+
+    Raises:
+        ValueError: If the coordinates don't have 2 or 3 dimensions
+    """
+    array = np.asarray(coordinates, dtype=np.float64)
+    if array.ndim == 1:
+        array = array.reshape(-1, dimensions or 2)
+    if array.ndim != 2 or array.shape[1] not in (2, 3):
+        raise ValueError(
+            f"Expected coordinates with 2 or 3 dimensions, found shape {array.shape}"
+        )
+    return array
+
+
+def points_from_coordinates(coordinates: Any) -> list[Point]:
+    """Create `Point`s from coordinates, see `coordinate_array()`."""
+    array = coordinate_array(coordinates)
+    if array.shape[1] == 2:
+        return [Point(latitude, longitude) for longitude, latitude in array.tolist()]
+    return [
+        Point(latitude, longitude, altitude)
+        for longitude, latitude, altitude in array.tolist()
+    ]
+
+
+def _points_to_coordinates(points: Sequence[Point]) -> np.ndarray:
+    # Like AddPoint_2D() on a 3D geometry, points without an altitude
+    # get an altitude of 0.
+    if any(point.altitude for point in points):
+        return np.array(
+            [(p.longitude, p.latitude, p.altitude or 0.0) for p in points],
+            dtype=np.float64,
+        ).reshape(-1, 3)
+    return np.array(
+        [(p.longitude, p.latitude) for p in points], dtype=np.float64
+    ).reshape(-1, 2)
+
+
+# ISO WKB geometry types. 3D types are 1000 higher.
+_WKB_POINT = 1
+_WKB_LINESTRING = 2
+_WKB_POLYGON = 3
+
+
+def _wkb_header(geometry_type: int, dimensions: int) -> bytes:
+    if dimensions == 3:
+        geometry_type += 1000
+    # Little endian byte order.
+    return struct.pack("<BI", 1, geometry_type)
+
+
+def _wkb_points(coordinates: np.ndarray) -> bytes:
+    return struct.pack("<I", len(coordinates)) + coordinates.astype("<f8").tobytes()
+
+
+def _wkb_linestring(coordinates: np.ndarray) -> bytes:
+    header = _wkb_header(_WKB_LINESTRING, coordinates.shape[1])
+    return header + _wkb_points(coordinates)
+
+
+def _wkb_polygon(rings: list[np.ndarray]) -> bytes:
+    dimensions = max(ring.shape[1] for ring in rings)
+    parts = [_wkb_header(_WKB_POLYGON, dimensions), struct.pack("<I", len(rings))]
+    for ring in rings:
+        if ring.shape[1] < dimensions:
+            ring = np.hstack([ring, np.zeros((len(ring), 1))])
+        if not np.array_equal(ring[0], ring[-1]):
+            # Close the ring, like CloseRings().
+            ring = np.vstack([ring, ring[:1]])
+        parts.append(_wkb_points(ring))
+    return b"".join(parts)
+
+
+def _wkb_point_list(coordinates: np.ndarray) -> list[bytes]:
+    # The WKB of a point per row of coordinates, built in one pass.
+    dimensions = coordinates.shape[1]
+    dtype = np.dtype([("order", "u1"), ("type", "<u4"), ("xyz", "<f8", (dimensions,))])
+    records = np.empty(len(coordinates), dtype=dtype)
+    records["order"] = 1
+    records["type"] = _WKB_POINT + (1000 if dimensions == 3 else 0)
+    records["xyz"] = coordinates
+    data = records.tobytes()
+    size = dtype.itemsize
+    return [data[n : n + size] for n in range(0, len(data), size)]
@@ -0,0 +1,152 @@
+from __future__ import annotations
+
+import logging
+import threading
+import time
+from collections.abc import Callable, Hashable
+from dataclasses import dataclass
+from typing import Any, ClassVar, Optional
+
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class _Entry:
+    datasource: Any
+    endpoint: str
+    key: Hashable
+    generation: int
+    epoch: int
+    opened_at: float
+
+
+class DatasourceCache:
+    """A pool of opened feature server datasources, shared by clients.
+
+    Opening a WFS datasource fetches the server's capabilities, and the
+    layer descriptions when layers are used. When a client is closed,
+    its datasource goes back to the cache and the next client of the
+    same server reuses it without those requests.
+
+    A datasource is leased to one client at a time, GDAL datasources
+    are not thread-safe. Datasources older than `ttl` seconds are not
+    reused, neither are those of an endpoint that was invalidated, for
+    example because one of its layers was created or deleted. At most
+    `max_idle` datasources are kept per server.
+
+    Thread-safe.
+    """
+
+    DEFAULT_TTL: ClassVar[float] = 300.0
+    DEFAULT_MAX_IDLE: ClassVar[int] = 4
+
+    _ttl: float
+    _max_idle: int
+    _idle: dict[Hashable, list[_Entry]]
+    _leased: dict[int, _Entry]
+    _generations: dict[str, int]
+    _epoch: int
+    _lock: threading.Lock
+
+    def __init__(
+        self, ttl: float = DEFAULT_TTL, max_idle: int = DEFAULT_MAX_IDLE
+    ) -> None:
+        self._ttl = ttl
+        self._max_idle = max_idle
+        self._idle = {}
+        self._leased = {}
+        self._generations = {}
+        self._epoch = 0
+        self._lock = threading.Lock()
+
+    def acquire(self, endpoint: str, key: Hashable, open: Callable[[], Any]) -> Any:
+        """Lease an idle datasource for `key`, or one opened with
+        `open()`. Hand it back with `release()`."""
+        now = time.monotonic()
+        entry = None
+        stale = []
+        with self._lock:
+            idle = self._idle.get(key, [])
+            while idle and entry is None:
+                candidate = idle.pop()
+                if self._is_fresh(candidate, now):
+                    entry = candidate
+                else:
+                    stale.append(candidate)
+            # Read before opening, an invalidation while opening makes
+            # the new datasource stale.
+            generation = self._generations.get(endpoint, 0)
+            epoch = self._epoch
+        self._close(stale)
+
+        if entry is None:
+            logger.debug(f"Opening datasource for {endpoint}")
+            entry = _Entry(open(), endpoint, key, generation, epoch, now)
+        else:
+            logger.debug(f"Reusing datasource for {endpoint}")
+
+        with self._lock:
+            self._leased[id(entry.datasource)] = entry
+        return entry.datasource
+
+    def release(self, datasource: Any) -> None:
+        """Hand back a leased datasource. It is closed when it can't be
+        reused."""
+        with self._lock:
+            entry = self._leased.pop(id(datasource), None)
+            if entry is not None and self._is_fresh(entry, time.monotonic()):
+                idle = self._idle.setdefault(entry.key, [])
+                if len(idle) < self._max_idle:
+                    idle.append(entry)
+                    return
+        if entry is None:
+            logger.warning("Released a datasource that was not leased, closing it")
+            datasource.Close()
+        else:
+            self._close([entry])
+
+    def invalidate(self, endpoint: Optional[str] = None) -> None:
+        """Stop reusing the datasources of `endpoint`, or of all
+        endpoints. Leased datasources are closed when released."""
+        now = time.monotonic()
+        with self._lock:
+            if endpoint is None:
+                self._epoch += 1
+            else:
+                self._generations[endpoint] = self._generations.get(endpoint, 0) + 1
+
+            stale = []
+            for key, idle in list(self._idle.items()):
+                stale.extend(e for e in idle if not self._is_fresh(e, now))
+                idle[:] = [e for e in idle if self._is_fresh(e, now)]
+                if not idle:
+                    del self._idle[key]
+        self._close(stale)
+
+    def clear(self) -> None:
+        """Close all idle datasources."""
+        with self._lock:
+            stale = [e for idle in self._idle.values() for e in idle]
+            self._idle.clear()
+        self._close(stale)
+
+    def _is_fresh(self, entry: _Entry, now: float) -> bool:
+        # Called with the lock held.
+        return (
+            now - entry.opened_at < self._ttl
+            and entry.epoch == self._epoch
+            and entry.generation == self._generations.get(entry.endpoint, 0)
+        )
+
+    @staticmethod
+    def _close(entries: list[_Entry]) -> None:
+        for entry in entries:
+            try:
+                entry.datasource.Close()
+            except Exception:
+                logger.exception(f"Failed to close datasource for {entry.endpoint}")
+
+
+# Shared by the feature server clients in this process.
+DATASOURCE_CACHE = DatasourceCache()
@@ -30,7 +30,9 @@ class GeoServerClient(FeatureServerClient, LayerManagerInterface):
     _workspace: str
     _datastore: str
 
-    def __init__(self, wfs_endpoint: str, workspace: str, datastore: str) -> None:
+    def __init__(
+        self, wfs_endpoint: str, workspace: str, datastore: str, **kwargs
+    ) -> None:
         url = urlsplit(wfs_endpoint)._asdict()
         url["path"] = "/".join(
             [cmp for cmp in takewhile(lambda c: c != workspace, url["path"].split("/"))]
@@ -42,7 +44,7 @@ class GeoServerClient(FeatureServerClient, LayerManagerInterface):
         self._api_endpoint = urlunsplit(SplitResult(**url))
         self._workspace = workspace
         self._datastore = datastore
-        super().__init__(endpoint=wfs_endpoint)
+        super().__init__(endpoint=wfs_endpoint, **kwargs)
 
     @property
     def api_endpoint(self) -> str:
@@ -98,6 +100,7 @@ class GeoServerClient(FeatureServerClient, LayerManagerInterface):
 
         response.raise_for_status()
 
+        self.invalidate()
         super().close()
         super().open()
 
@@ -119,6 +122,7 @@ class GeoServerClient(FeatureServerClient, LayerManagerInterface):
         response = httpx.delete(url, params=params)
         response.raise_for_status()
 
+        self.invalidate()
         super().close()
         super().open()
 
@@ -3,53 +3,112 @@
 # SPDX-License-Identifier: MIT
 
 import logging
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 from threading import Event
-from typing import Callable, Any, ClassVar
+from typing import Callable, Any, ClassVar, Optional
 
 from pika import SelectConnection, URLParameters, BasicProperties
 from pika.channel import Channel
-from pika.exchange_type import ExchangeType
 from pika.frame import Method
 from pika.exceptions import ChannelClosedByClient
 from pika.spec import Basic
 
-from mercaido_client.pb.message import MessageRegistry
 from mercaido_client.pb.mercaido import MessageBase
+from mercaido_client.pb.message import MessageView
+
+from .client import DISPATCHER_QUEUE, MAIN_EXCHANGE
 
 logger = logging.getLogger(__name__)
 
 
 class Connection:
+    """An event-driven consumer that stays connected.
+
+    Declares the main exchange and a queue bound to it, then passes
+    every message on the queue to the on-message callback. A message is
+    acknowledged after the callback returns and rejected, without
+    requeueing, when it raises. By default the dispatcher's queue is
+    consumed.
+
+    When the connection is lost it is re-established with exponential
+    backoff and the topology is declared again.
+
+    With `workers`, callbacks run in a pool of that many threads. Up to
+    `prefetch_count` messages are in flight at the same time, and their
+    acknowledgements are sent from the I/O loop's thread.
+
+    With `lazy`, the callback receives `MessageView`s that decode fields
+    when they are read, instead of fully parsed messages.
+    """
+
     DEFAULT_CONNECT_TIMEOUT: ClassVar[float] = 10.0
+    DEFAULT_RECONNECT_DELAY: ClassVar[float] = 1.0
+    DEFAULT_MAX_RECONNECT_DELAY: ClassVar[float] = 30.0
+
+    EXCHANGE: ClassVar[str] = MAIN_EXCHANGE.name
 
     _url: str
-    _connection: SelectConnection
-    _channel: Channel
+    _connection: SelectConnection | None
+    _channel: Channel | None
     _queue_name: str
+    _binding_keys: list[str]
     _exclusive: bool
-    _routing_key: str
-    _consumer_tag: str
-    _consuming: bool = False  # FIXME: Unused.
-    _closing: bool = False
-    _on_message_callback: Callable[[MessageBase], None]
+    _prefetch_count: int
+    _workers: int
+    _executor: ThreadPoolExecutor | None
+    _consumer_tag: str | None
+    _consuming: bool
+    _in_flight: int
+    _lazy: bool
+    _on_message_callback: Callable[[Any], None] | None
 
     _connect_event: Event
-    _is_connected: bool
+    _stopping: Event
     _error: Exception | None
-
-    EXCHANGE: str = "mercaido"
+    _reconnect_delay: float
+    _max_reconnect_delay: float
+    _delay: float
 
     def __init__(
-        self, url: str, queue_name: str, routing_key: str, exclusive: bool = False
+        self,
+        url: str,
+        queue_name: str = DISPATCHER_QUEUE.name,
+        binding_keys: Optional[list[str]] = None,
+        exclusive: bool = False,
+        prefetch_count: int = 1,
+        workers: int = 0,
+        reconnect_delay: float = DEFAULT_RECONNECT_DELAY,
+        max_reconnect_delay: float = DEFAULT_MAX_RECONNECT_DELAY,
+        lazy: bool = False,
     ) -> None:
+        """Create a consumer of `queue_name`.
+
+        The queue is bound to the main exchange with `binding_keys`,
+        which default to the queue's name. An `exclusive` queue is
+        deleted when the connection closes, others are durable.
+        """
         self._url = url
         self._queue_name = queue_name
-        self._routing_key = routing_key
+        self._binding_keys = binding_keys if binding_keys is not None else [queue_name]
         self._exclusive = exclusive
+        self._prefetch_count = max(prefetch_count, workers, 1)
+        self._workers = workers
+        self._executor = None
+        self._connection = None
+        self._channel = None
+        self._consumer_tag = None
+        self._consuming = False
+        self._in_flight = 0
+        self._lazy = lazy
+        self._on_message_callback = None
 
         self._connect_event = Event()
-        self._is_connected = False
+        self._stopping = Event()
         self._error = None
+        self._reconnect_delay = reconnect_delay
+        self._max_reconnect_delay = max_reconnect_delay
+        self._delay = reconnect_delay
 
     def connect(self) -> SelectConnection:
         connection_params = URLParameters(self._url)
@@ -60,31 +119,79 @@ class Connection:
             on_close_callback=self._on_connection_close,
         )
 
-    def wait_until_connected(self, timeout: float | None=None) -> bool:
+    def wait_until_connected(self, timeout: float | None = None) -> bool:
+        """Wait until messages are being consumed."""
         if timeout is None:
             timeout = self.DEFAULT_CONNECT_TIMEOUT
-        result = self._connect_event.wait(timeout)
-        self._is_connected = result and self._error is None
-        return self._is_connected
+        return self._connect_event.wait(timeout)
 
-    def wait_until_connected_or_error(self, timeout: float | None=None) -> bool:
+    def wait_until_connected_or_error(self, timeout: float | None = None) -> bool:
+        """Like `wait_until_connected()`, but raises the last connection
+        error when no connection was made in time."""
         result = self.wait_until_connected(timeout)
-        if self._error is not None:
+        if not result and self._error is not None:
             raise self._error
         return result
 
     def is_connected(self) -> bool:
-        return self._is_connected
+        return self._connect_event.is_set()
 
     def error(self) -> Exception | None:
         return self._error
 
+    def run(self) -> None:
+        """Connect and consume until `stop()` is called."""
+        if self._workers:
+            self._executor = ThreadPoolExecutor(
+                self._workers, thread_name_prefix=self._queue_name
+            )
+        try:
+            while not self._stopping.is_set():
+                self._connection = self.connect()
+                self._connection.ioloop.start()
+                self._on_disconnected()
+                if not self._stopping.is_set():
+                    logger.info(f"Reconnecting in {self._delay:.1f} seconds")
+                    self._stopping.wait(self._delay)
+                    self._delay = min(self._delay * 2, self._max_reconnect_delay)
+        finally:
+            if self._executor is not None:
+                self._executor.shutdown(wait=True)
+                self._executor = None
+
+    def stop(self) -> None:
+        """Stop consuming and close the connection. Safe to call from
+        any thread. Messages that are being handled are acknowledged
+        first."""
+        self._stopping.set()
+        if self._connection is not None:
+            self._connection.ioloop.add_callback_threadsafe(self._do_stop)
+
+    def send(self, recipient: str, message: bytes) -> None:
+        logger.debug(f"Sending message of {len(message)} bytes to {recipient}")
+        if self._connection is None:
+            raise RuntimeError("not connected")
+        self._connection.ioloop.add_callback_threadsafe(
+            partial(self._publish, recipient, message)
+        )
+
+    def send_message(self, message: MessageBase) -> None:
+        self.send(message.recipient, message.serialize())
+
+    def set_on_message_callback(
+        self,
+        callback: Callable[[MessageBase], None]
+        | Callable[[MessageView[MessageBase]], None],
+    ) -> None:
+        self._on_message_callback = callback
+
     # XXX: Can't figure out the type of 'connection' arg of the
     # _on_connection_* functions.
 
     def _on_connection_open(self, connection: Any) -> None:
         logger.info(f"Connection opened to {connection.params.host}")
-        self._connection.channel(on_open_callback=self._on_channel_open)
+        self._error = None
+        connection.channel(on_open_callback=self._on_channel_open)
 
     def _on_connection_open_error(
         self, connection: Any, error: Exception | str
@@ -92,75 +199,97 @@ class Connection:
         if not isinstance(error, Exception):
             error = RuntimeError(error)
         self._error = error
-        self._connect_event.set()
         logger.error(f"Error connecting to {connection.params.host}: {error}")
-        self._connection.ioloop.stop()
+        connection.ioloop.stop()
 
-    def _on_connection_close(
-        self, connection: Any, reason: Exception
-    ) -> None:
-        logger.info(f"Connection to {connection.params.host} closed: {reason}")
-        self._connection.ioloop.stop()
+    def _on_connection_close(self, connection: Any, reason: Exception) -> None:
+        self._channel = None
+        if self._stopping.is_set():
+            logger.info(f"Connection to {connection.params.host} closed")
+        else:
+            logger.warning(f"Connection to {connection.params.host} lost: {reason}")
+        connection.ioloop.stop()
+
+    def _on_disconnected(self) -> None:
+        self._connect_event.clear()
+        self._consuming = False
+        # Messages of the lost channel can't be settled anymore, their
+        # workers may still finish while the next channel is opened.
+        self._in_flight = 0
 
     def _on_channel_open(self, channel: Channel) -> None:
         self._channel = channel
         self._channel.add_on_close_callback(self._on_channel_close)
-        self._setup_exchange(self.EXCHANGE)
+        self._channel.add_on_cancel_callback(self._on_consumer_cancelled)
+        logger.info(f"Declaring exchange '{self.EXCHANGE}'")
+        self._channel.exchange_declare(
+            exchange=self.EXCHANGE,
+            exchange_type=MAIN_EXCHANGE.type,
+            durable=MAIN_EXCHANGE.durable,
+            callback=self._on_exchange_declare,
+        )
 
     def _on_channel_close(self, channel: Channel, reason: Exception) -> None:
         if isinstance(reason, ChannelClosedByClient):
             logger.info("Channel closed")
         else:
-            logger.error(f"Channel closed unexpectedly, closing connection: {reason}")
-        self._connection.close()
-
-    def _setup_exchange(self, exchange_name: str) -> None:
-        logger.info(f"Declaring exchange '{exchange_name}'")
-        self._channel.exchange_declare(
-            exchange=exchange_name,
-            exchange_type=ExchangeType.topic,
-            auto_delete=False,
-            callback=self._on_exchange_declare,
-        )
+            logger.error(f"Channel closed unexpectedly, reconnecting: {reason}")
+        self._channel = None
+        if self._connection is not None and self._connection.is_open:
+            self._connection.close()
 
     def _on_exchange_declare(self, _frame: Method) -> None:
-        logger.info("Exchange declared")
-        self._setup_queue()
-
-    def _setup_queue(self) -> None:
         logger.info(f"Declaring queue '{self._queue_name}'")
+        assert self._channel is not None
         self._channel.queue_declare(
             queue=self._queue_name,
+            durable=not self._exclusive,
             exclusive=self._exclusive,
-            auto_delete=True,
+            auto_delete=self._exclusive,
             callback=self._on_queue_declare,
         )
 
     def _on_queue_declare(self, _frame: Method) -> None:
+        self._bind(list(self._binding_keys))
+
+    def _bind(self, binding_keys: list[str], _frame: Method | None = None) -> None:
+        assert self._channel is not None
+        if not binding_keys:
+            logger.info(f"Queue '{self._queue_name}' bound")
+            self._channel.basic_qos(
+                prefetch_count=self._prefetch_count, callback=self._on_qos_ok
+            )
+            return
+        routing_key, *rest = binding_keys
         logger.info(
-            f"Queue '{self._queue_name}' declared, binding with routing key {self._routing_key}..."
+            f"Binding queue '{self._queue_name}' with routing key {routing_key}"
         )
         self._channel.queue_bind(
             queue=self._queue_name,
             exchange=self.EXCHANGE,
-            routing_key=self._routing_key,
-            callback=self._on_queue_bind,
+            routing_key=routing_key,
+            callback=partial(self._bind, rest),
         )
 
-    def _on_queue_bind(self, _frame: Method) -> None:
-        logger.info(f"Queue '{self._queue_name}' bound")
-        self._set_qos()
-
-    def _set_qos(self) -> None:
-        self._channel.basic_qos(prefetch_count=1, callback=self._on_qos_ok)
-
-    def _on_qos_ok(self, _frame: Method):
-        logger.info("QoS set")
+    def _on_qos_ok(self, _frame: Method) -> None:
+        logger.info(f"QoS set, prefetch count {self._prefetch_count}")
         self._start_consuming()
 
+    def _start_consuming(self) -> None:
+        assert self._channel is not None
+        self._consumer_tag = self._channel.basic_consume(
+            self._queue_name, self._on_message
+        )
+        self._consuming = True
+        self._delay = self._reconnect_delay
+        self._connect_event.set()
+        logger.info(
+            f"Consuming messages from {self._queue_name} as {self._consumer_tag}"
+        )
+
     def _on_consumer_cancelled(self, frame: Method) -> None:
-        logger.info(f"Consumer cancelled remotely, shutting down: {frame}")
-        if getattr(self, "_channel", None):
+        logger.info(f"Consumer cancelled remotely, reconnecting: {frame}")
+        if self._channel is not None:
             self._channel.close()
 
     def _on_message(
@@ -171,63 +300,81 @@ class Connection:
         body: bytes,
     ) -> None:
         logger.debug(f"Message received on {channel.channel_number}: {body!r}")
-        if self._on_message_callback is not None:
-            message = MessageBase.deserialize(body)
-            # FIXME: Types.
-            self._on_message_callback(message)  # type: ignore
-        logger.debug(f"Acknowledging message on {channel.channel_number}")
         assert basic_deliver.delivery_tag is not None  # No auto-ack.
-        self._ack_message(basic_deliver.delivery_tag)
-
-    def _ack_message(self, delivery_tag: int) -> None:
-        self._channel.basic_ack(delivery_tag)
-
-    def _on_cancel(self, _frame: Method) -> None:
-        logger.info(f"Consumer {self._consumer_tag} cancelled")
-        self._consuming = False
-        self._channel.close()
-
-    def _start_consuming(self) -> None:
-        logger.info(f"Starting {self._queue_name}")
-        self._connect_event.set()
-        self._channel.add_on_cancel_callback(self._on_consumer_cancelled)
-        self._consumer_tag = self._channel.basic_consume(
-            self._queue_name, self._on_message
+        self._in_flight += 1
+        if self._executor is not None:
+            self._executor.submit(
+                self._handle_message, channel, basic_deliver.delivery_tag, body
+            )
+        else:
+            self._handle_message(channel, basic_deliver.delivery_tag, body)
+
+    def _handle_message(self, channel: Channel, delivery_tag: int, body: bytes) -> None:
+        # Runs in a worker thread when there are workers.
+        try:
+            message: MessageBase | MessageView[MessageBase]
+            if self._lazy:
+                message = MessageBase.view(body)
+            else:
+                message = MessageBase.deserialize(body)
+            if self._on_message_callback is not None:
+                self._on_message_callback(message)
+            ok = True
+        except Exception:
+            logger.exception("Failed to handle message, rejecting it")
+            ok = False
+
+        settle = partial(self._settle_message, channel, delivery_tag, ok)
+        if self._executor is None:
+            settle()
+        else:
+            # Channels are not thread-safe, let the I/O loop send the ack.
+            assert self._connection is not None
+            self._connection.ioloop.add_callback_threadsafe(settle)
+
+    def _settle_message(self, channel: Channel, delivery_tag: int, ok: bool) -> None:
+        # Delivery tags are only valid on the channel they arrived on.
+        if channel is not self._channel:
+            logger.debug(f"Not settling message of closed channel {channel}")
+            return
+        self._in_flight -= 1
+        if channel.is_open:
+            if ok:
+                logger.debug(f"Acknowledging message on {channel.channel_number}")
+                channel.basic_ack(delivery_tag)
+            else:
+                channel.basic_nack(delivery_tag, requeue=False)
+        # Close once the last message is handled after stop() cancelled
+        # consuming. A new channel is not consuming yet either.
+        if self._stopping.is_set() and not self._consuming and self._in_flight == 0:
+            self._close_channel()
+
+    def _publish(self, recipient: str, message: bytes) -> None:
+        if self._channel is None or not self._channel.is_open:
+            logger.warning(f"Not connected, dropped message to {recipient}")
+            return
+        self._channel.basic_publish(
+            exchange=self.EXCHANGE, routing_key=recipient, body=message
         )
-        self._consuming = True
-        logger.info(f"Consuming messages as {self._consumer_tag}")
 
-    def _stop_consuming(self) -> None:
-        if self._channel:
+    def _do_stop(self) -> None:
+        logger.info("Stopping...")
+        if self._consuming and self._channel is not None:
             logger.info("Sending cancel message to RabbitMQ")
             self._channel.basic_cancel(self._consumer_tag, callback=self._on_cancel)
+        elif self._connection is not None and self._connection.is_open:
+            self._connection.close()
+        elif self._connection is not None:
+            self._connection.ioloop.stop()
 
-    def run(self) -> None:
-        self._connection = self.connect()
-        self._connection.ioloop.start()
-
-    def _do_stop(self) -> None:
-        if not self._closing:
-            # TODO: Set _consuming = False
-            self._connect_event.clear()
-            self._is_connected = False
-            self._closing = True
-            logger.info("Stopping...")
-            self._stop_consuming()
-
-    def stop(self) -> None:
-        self._connection.ioloop.add_callback_threadsafe(self._do_stop)
-
-    def send(self, recipient: str, message: bytes) -> None:
-        logger.debug(f"Sending message of {len(message)} bytes to {recipient}")
-        self._connection.ioloop.add_callback_threadsafe(
-            lambda: self._channel.basic_publish(
-                exchange=self.EXCHANGE, routing_key=recipient, body=message
-            )
-        )
-
-    def send_message(self, message: MessageBase) -> None:
-        self.send(message.recipient, message.serialize())
+    def _on_cancel(self, _frame: Method) -> None:
+        logger.info(f"Consumer {self._consumer_tag} cancelled")
+        self._consuming = False
+        if self._in_flight == 0:
+            self._close_channel()
+        else:
+            logger.info(f"Waiting for {self._in_flight} message(s) to be handled")
 
-    def set_on_message_callback(self, callback: Callable[[MessageBase], None]) -> None:
-        self._on_message_callback = callback
+    def _close_channel(self) -> None:
+        if self._channel is not None and self._channel.is_open:
+            self._channel.close()
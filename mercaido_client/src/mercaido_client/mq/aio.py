@@ -0,0 +1,737 @@
+# SPDX-FileCopyrightText: 2023, 2024 Horus View and Explore B.V.
+#
+# SPDX-License-Identifier: MIT
+
+"""asyncio versions of the Mercaido clients.
+
+`AsyncServiceClient`, `AsyncPublishJobClient` and `AsyncEventListenerClient`
+mirror their blocking counterparts in `mercaido_client.mq.client`, but
+run on an asyncio event loop instead of in threads. A service that is
+mostly waiting on I/O can run many jobs concurrently on one loop::
+
+    async def handle(job: PublishJob) -> None:
+        ...
+
+    async with AsyncServiceClient(service, url, concurrency=16) as client:
+        await client.register()
+        await client.serve(handle)
+
+All methods must be called from the thread running the event loop. URLs
+of the form ``memory://name`` connect to the in-memory broker ``name``,
+just like the blocking clients.
+"""
+
+import asyncio
+import logging
+from collections.abc import AsyncIterator, Awaitable, Callable
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from typing import Any, ClassVar, Optional, Protocol
+from urllib.parse import urlsplit
+from uuid import uuid4
+
+import pika.exceptions
+from pika import URLParameters
+from pika.adapters.asyncio_connection import AsyncioConnection
+from pika.channel import Channel as PikaChannel
+from pika.exchange_type import ExchangeType
+
+from ..attrs import AttrDict
+from ..pb.mercaido import (
+    Event,
+    MessageBase,
+    MessageType,
+    PublishJob,
+    RegisterServices,
+    RequestBase,
+    Service,
+)
+from .client import (
+    ClientError,
+    DISPATCHER_QUEUE,
+    DISPATCHER_ROUTING_KEY,
+    EVENT_INGRESS_EXCHANGE,
+    EVENTS_EXCHANGE,
+    MAIN_EXCHANGE,
+    SERVICE_BINDING_KEYS_PART,
+)
+from .transport import (
+    MEMORY_SCHEME,
+    Delivery,
+    InMemoryBroker,
+    InMemoryChannel,
+    InMemoryConnection,
+    _PERSISTENT,
+)
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncChannel(Protocol):
+    """An AMQP channel on an asyncio event loop.
+
+    Methods that wait for the broker are coroutines. Publishing and
+    acknowledging only write to the connection's buffer.
+    """
+
+    async def exchange_declare(
+        self, exchange: str, exchange_type: ExchangeType, durable: bool = True
+    ) -> None:
+        ...
+
+    async def exchange_bind(
+        self, destination: str, source: str, routing_key: str
+    ) -> None:
+        ...
+
+    async def queue_declare(self, queue: str, durable: bool = True) -> None:
+        ...
+
+    async def queue_bind(self, queue: str, exchange: str, routing_key: str) -> None:
+        ...
+
+    async def queue_delete(self, queue: str) -> None:
+        ...
+
+    async def basic_qos(self, prefetch_count: int) -> None:
+        ...
+
+    def basic_publish(
+        self, exchange: str, routing_key: str, body: bytes, persistent: bool = False
+    ) -> None:
+        ...
+
+    def basic_ack(self, delivery_tag: int, multiple: bool = False) -> None:
+        ...
+
+    def basic_nack(
+        self, delivery_tag: int, multiple: bool = False, requeue: bool = True
+    ) -> None:
+        ...
+
+    def consume(self, queue: str) -> AsyncIterator[Delivery]:
+        """Yield deliveries until `cancel()` is called."""
+        ...
+
+    async def cancel(self) -> None:
+        ...
+
+    async def close(self) -> None:
+        ...
+
+
+class AsyncTransport(Protocol):
+    async def connect(self) -> AsyncChannel:
+        ...
+
+
+def async_transport_for_url(url: str) -> AsyncTransport:
+    if urlsplit(url).scheme == MEMORY_SCHEME:
+        return AsyncInMemoryTransport(InMemoryBroker.named(urlsplit(url).netloc))
+    return AsyncPikaTransport(url)
+
+
+# Pika
+
+
+class AsyncPikaChannel:
+    _CLOSED: ClassVar[object] = object()
+
+    _connection: AsyncioConnection
+    _channel: PikaChannel
+    _pending: set[asyncio.Future]
+    _deliveries: asyncio.Queue
+    _consumer_tag: Optional[str]
+    _error: Optional[BaseException]
+
+    def __init__(self, connection: AsyncioConnection, channel: PikaChannel) -> None:
+        self._connection = connection
+        self._channel = channel
+        self._pending = set()
+        self._deliveries = asyncio.Queue()
+        self._consumer_tag = None
+        self._error = None
+        self._channel.add_on_close_callback(self._on_close)
+
+    async def exchange_declare(
+        self, exchange: str, exchange_type: ExchangeType, durable: bool = True
+    ) -> None:
+        await self._rpc(
+            self._channel.exchange_declare,
+            exchange=exchange,
+            exchange_type=exchange_type,
+            durable=durable,
+        )
+
+    async def exchange_bind(
+        self, destination: str, source: str, routing_key: str
+    ) -> None:
+        await self._rpc(
+            self._channel.exchange_bind, destination, source, routing_key=routing_key
+        )
+
+    async def queue_declare(self, queue: str, durable: bool = True) -> None:
+        await self._rpc(self._channel.queue_declare, queue, durable=durable)
+
+    async def queue_bind(self, queue: str, exchange: str, routing_key: str) -> None:
+        await self._rpc(
+            self._channel.queue_bind, queue, exchange, routing_key=routing_key
+        )
+
+    async def queue_delete(self, queue: str) -> None:
+        await self._rpc(self._channel.queue_delete, queue)
+
+    async def basic_qos(self, prefetch_count: int) -> None:
+        await self._rpc(self._channel.basic_qos, prefetch_count=prefetch_count)
+
+    def basic_publish(
+        self, exchange: str, routing_key: str, body: bytes, persistent: bool = False
+    ) -> None:
+        self._check_open()
+        self._channel.basic_publish(
+            exchange,
+            routing_key,
+            body,
+            properties=_PERSISTENT if persistent else None,
+        )
+
+    def basic_ack(self, delivery_tag: int, multiple: bool = False) -> None:
+        self._check_open()
+        self._channel.basic_ack(delivery_tag, multiple)
+
+    def basic_nack(
+        self, delivery_tag: int, multiple: bool = False, requeue: bool = True
+    ) -> None:
+        self._check_open()
+        self._channel.basic_nack(delivery_tag, multiple, requeue)
+
+    async def consume(self, queue: str) -> AsyncIterator[Delivery]:
+        self._check_open()
+        self._consumer_tag = self._channel.basic_consume(queue, self._on_message)
+        while True:
+            delivery = await self._deliveries.get()
+            if delivery is self._CLOSED:
+                break
+            yield delivery
+        if self._error is not None:
+            raise self._error
+
+    async def cancel(self) -> None:
+        if self._consumer_tag is None or not self._channel.is_open:
+            return
+        consumer_tag, self._consumer_tag = self._consumer_tag, None
+        await self._rpc(self._channel.basic_cancel, consumer_tag)
+        # Return messages that were received but not yet consumed.
+        while not self._deliveries.empty():
+            delivery = self._deliveries.get_nowait()
+            if delivery is not self._CLOSED:
+                self._channel.basic_nack(delivery.delivery_tag, requeue=True)
+        self._deliveries.put_nowait(self._CLOSED)
+
+    async def close(self) -> None:
+        if self._connection.is_closed:
+            return
+        closed = asyncio.get_running_loop().create_future()
+        self._connection.add_on_close_callback(lambda *args: closed.set_result(None))
+        self._connection.close()
+        await closed
+
+    def _check_open(self) -> None:
+        if self._error is not None:
+            raise self._error
+        if not self._channel.is_open:
+            raise ClientError("channel closed")
+
+    def _rpc(self, method: Callable[..., Any], *args, **kwargs) -> asyncio.Future:
+        self._check_open()
+        future = asyncio.get_running_loop().create_future()
+        self._pending.add(future)
+        future.add_done_callback(self._pending.discard)
+
+        def on_done(frame) -> None:
+            if not future.done():
+                future.set_result(frame)
+
+        method(*args, callback=on_done, **kwargs)
+        return future
+
+    def _on_message(self, channel, method, properties, body: bytes) -> None:
+        self._deliveries.put_nowait(
+            Delivery(method.delivery_tag, body, properties.reply_to)
+        )
+
+    def _on_close(self, channel: PikaChannel, reason: BaseException) -> None:
+        if not isinstance(reason, pika.exceptions.ChannelClosedByClient):
+            logger.error(f"channel closed unexpectedly: {reason!r}")
+            self._error = reason
+        for future in list(self._pending):
+            if not future.done():
+                future.set_exception(ClientError(f"channel closed: {reason!r}"))
+        self._deliveries.put_nowait(self._CLOSED)
+
+
+class AsyncPikaTransport:
+    _params: URLParameters
+
+    def __init__(self, url: str) -> None:
+        self._params = URLParameters(url)
+
+    async def connect(self) -> AsyncPikaChannel:
+        loop = asyncio.get_running_loop()
+        opened = loop.create_future()
+
+        def on_open_error(connection, error) -> None:
+            if not isinstance(error, BaseException):
+                error = pika.exceptions.AMQPConnectionError(error)
+            opened.set_exception(error)
+
+        connection = AsyncioConnection(
+            self._params,
+            on_open_callback=opened.set_result,
+            on_open_error_callback=on_open_error,
+            custom_ioloop=loop,
+        )
+        await opened
+
+        channel_opened = loop.create_future()
+        connection.channel(on_open_callback=channel_opened.set_result)
+        return AsyncPikaChannel(connection, await channel_opened)
+
+
+# In-memory
+
+
+class AsyncInMemoryChannel:
+    """Uses an `InMemoryChannel` from the event loop's thread.
+
+    Instead of blocking, consumers wait for the broker to signal new
+    messages on the event loop.
+    """
+
+    _connection: InMemoryConnection
+    _channel: InMemoryChannel
+    _wakeups: set[asyncio.Event]
+    _consuming: bool
+
+    def __init__(self, broker: InMemoryBroker) -> None:
+        self._connection = InMemoryConnection(broker)
+        self._channel = self._connection.channel()
+        self._wakeups = set()
+        self._consuming = False
+
+    async def exchange_declare(
+        self, exchange: str, exchange_type: ExchangeType, durable: bool = True
+    ) -> None:
+        self._channel.exchange_declare(exchange, exchange_type, durable)
+
+    async def exchange_bind(
+        self, destination: str, source: str, routing_key: str
+    ) -> None:
+        self._channel.exchange_bind(destination, source, routing_key)
+
+    async def queue_declare(self, queue: str, durable: bool = True) -> None:
+        self._channel.queue_declare(queue, durable)
+
+    async def queue_bind(self, queue: str, exchange: str, routing_key: str) -> None:
+        self._channel.queue_bind(queue, exchange, routing_key)
+
+    async def queue_delete(self, queue: str) -> None:
+        self._channel.queue_delete(queue)
+
+    async def basic_qos(self, prefetch_count: int) -> None:
+        self._channel.basic_qos(prefetch_count)
+
+    def basic_publish(
+        self, exchange: str, routing_key: str, body: bytes, persistent: bool = False
+    ) -> None:
+        self._channel.basic_publish(exchange, routing_key, body, persistent)
+
+    def basic_ack(self, delivery_tag: int, multiple: bool = False) -> None:
+        self._channel.basic_ack(delivery_tag, multiple)
+        # Room in the prefetch window.
+        self._wake()
+
+    def basic_nack(
+        self, delivery_tag: int, multiple: bool = False, requeue: bool = True
+    ) -> None:
+        self._channel.basic_nack(delivery_tag, multiple, requeue)
+        self._wake()
+
+    async def consume(self, queue: str) -> AsyncIterator[Delivery]:
+        loop = asyncio.get_running_loop()
+        wakeup = asyncio.Event()
+
+        def listener() -> None:
+            loop.call_soon_threadsafe(wakeup.set)
+
+        self._consuming = True
+        self._wakeups.add(wakeup)
+        self._channel._broker.add_listener(listener)
+        try:
+            while self._consuming and self._channel.is_open:
+                wakeup.clear()
+                if (delivery := self._channel._take(queue)) is not None:
+                    yield delivery
+                else:
+                    await wakeup.wait()
+        finally:
+            self._channel._broker.remove_listener(listener)
+            self._wakeups.discard(wakeup)
+
+    async def cancel(self) -> None:
+        self._consuming = False
+        self._wake()
+
+    async def close(self) -> None:
+        await self.cancel()
+        self._connection.close()
+
+    def _wake(self) -> None:
+        for wakeup in self._wakeups:
+            wakeup.set()
+
+
+class AsyncInMemoryTransport:
+    _broker: InMemoryBroker
+
+    def __init__(self, broker: InMemoryBroker) -> None:
+        self._broker = broker
+
+    @property
+    def broker(self) -> InMemoryBroker:
+        return self._broker
+
+    async def connect(self) -> AsyncInMemoryChannel:
+        return AsyncInMemoryChannel(self._broker)
+
+
+# Clients
+
+
+@dataclass(frozen=True, slots=True)
+class AsyncAck:
+    _channel: AsyncChannel
+    _delivery_tag: int
+
+    async def ok(self, multiple: bool = False) -> None:
+        self._channel.basic_ack(self._delivery_tag, multiple)
+
+    async def cancel(self, multiple: bool = False, requeue: bool = True) -> None:
+        self._channel.basic_nack(self._delivery_tag, multiple, requeue)
+
+
+class AsyncClient:
+    _transport: AsyncTransport
+    _channel: Optional[AsyncChannel]
+
+    def __init__(self, url: str, transport: Optional[AsyncTransport] = None) -> None:
+        self._transport = (
+            transport if transport is not None else async_transport_for_url(url)
+        )
+        self._channel = None
+
+    async def __aenter__(self):
+        await self.open()
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    async def open(self) -> None:
+        if self._channel is not None:
+            raise ClientError("connection already open")
+        self._channel = await self._transport.connect()
+
+    async def close(self) -> None:
+        if self._channel is None:
+            raise ClientError("connection already closed")
+        channel, self._channel = self._channel, None
+        await channel.close()
+
+    @property
+    def channel(self) -> AsyncChannel:
+        if self._channel is None:
+            raise ClientError("connection closed")
+        return self._channel
+
+    async def exchange(
+        self,
+        exchange_name: str,
+        exchange_type: ExchangeType,
+        durable: bool = True,
+    ) -> AttrDict:
+        await self.channel.exchange_declare(exchange_name, exchange_type, durable)
+        return AttrDict(name=exchange_name, type=exchange_type)
+
+    async def exchange_bind(
+        self, destination: str, source: str, binding_keys: list[str]
+    ) -> None:
+        for binding_key in binding_keys:
+            await self.channel.exchange_bind(destination, source, binding_key)
+
+    async def queue(
+        self,
+        queue_name: str,
+        exchange_name: str,
+        binding_keys: list[str],
+        durable: bool = True,
+    ) -> AttrDict:
+        await self.channel.queue_declare(queue_name, durable)
+        for binding_key in binding_keys:
+            await self.channel.queue_bind(queue_name, exchange_name, binding_key)
+        return AttrDict(name=queue_name, binding_keys=binding_keys)
+
+    @asynccontextmanager
+    async def temporary_queue(self, *args, **kwargs) -> AsyncIterator[AttrDict]:
+        result = await self.queue(*args, durable=False, **kwargs)
+        try:
+            yield result
+        finally:
+            if self._channel is not None:
+                await self._channel.queue_delete(result.name)
+
+    async def publish(
+        self,
+        exchange: str,
+        routing_key: str,
+        msg: MessageBase,
+        persistent: bool = False,
+    ) -> None:
+        self.channel.basic_publish(exchange, routing_key, msg.serialize(), persistent)
+
+    @asynccontextmanager
+    async def consume(
+        self, queue: str, prefetch_count: int = 1
+    ) -> AsyncIterator[AsyncIterator[tuple[MessageBase, AsyncAck]]]:
+        channel = self.channel
+        await channel.basic_qos(prefetch_count)
+        try:
+            yield self._consume_generator(channel, queue)
+        finally:
+            if self._channel is not None:
+                await channel.cancel()
+
+    async def cancel(self) -> None:
+        """Stop consuming, consumers stop iterating."""
+        await self.channel.cancel()
+
+    @staticmethod
+    async def _consume_generator(
+        channel: AsyncChannel, queue: str
+    ) -> AsyncIterator[tuple[MessageBase, AsyncAck]]:
+        async for delivery in channel.consume(queue):
+            if delivery.reply_to:
+                raise NotImplementedError("reply_to implemented")
+            msg = MessageBase.deserialize(delivery.body)
+            yield msg, AsyncAck(channel, delivery.delivery_tag)
+
+
+AsyncJobHandler = Callable[[PublishJob], Awaitable[None]]
+
+
+async def declare_topology(client: AsyncClient) -> None:
+    """Declare Mercaido's exchanges and the dispatcher's queue, like
+    `client.declare_topology()`."""
+    for exchange in (MAIN_EXCHANGE, EVENTS_EXCHANGE, EVENT_INGRESS_EXCHANGE):
+        await client.exchange(exchange.name, exchange.type, exchange.durable)
+    await client.exchange_bind(EVENTS_EXCHANGE.name, EVENT_INGRESS_EXCHANGE.name, [""])
+    await client.queue(
+        DISPATCHER_QUEUE.name,
+        DISPATCHER_QUEUE.exchange,
+        binding_keys=DISPATCHER_QUEUE.binding_keys,
+    )
+    await client.queue(DISPATCHER_QUEUE.name, EVENT_INGRESS_EXCHANGE.name, [""])
+
+
+class AsyncServiceClient:
+    _service: Service
+    _client: AsyncClient
+    _concurrency: int
+
+    def __init__(
+        self,
+        service: Service,
+        url: str,
+        transport: Optional[AsyncTransport] = None,
+        concurrency: int = 1,
+    ) -> None:
+        """Create a client for `service`.
+
+        `concurrency` is the number of jobs the service runs at the same
+        time. It is also the number of messages the broker sends ahead.
+        """
+        if concurrency < 1:
+            raise ValueError(f"concurrency must be at least 1, got {concurrency}")
+        self._service = service
+        self._client = AsyncClient(url, transport)
+        self._concurrency = concurrency
+
+    async def __aenter__(self):
+        await self.open()
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    async def open(self) -> None:
+        await self._client.open()
+        try:
+            # Events are published to the ingress exchange, which may not
+            # exist yet on a fresh broker.
+            await declare_topology(self._client)
+        except BaseException:
+            await self._client.close()
+            raise
+
+    async def close(self) -> None:
+        await self._client.close()
+
+    async def register(self) -> None:
+        await self._client.queue(
+            queue_name=self._service.endpoint,
+            exchange_name=MAIN_EXCHANGE.name,
+            binding_keys=[self._service.endpoint] + SERVICE_BINDING_KEYS_PART,
+        )
+        await self._client.publish(
+            MAIN_EXCHANGE.name,
+            DISPATCHER_ROUTING_KEY,
+            MessageBase(
+                recipient=DISPATCHER_QUEUE.name,
+                request=RequestBase(
+                    type=MessageType.MESSAGE_TYPE_REGISTER_SERVICES,
+                    register_services=RegisterServices(
+                        services=[self._service],
+                    ),
+                ),
+            ),
+        )
+
+    async def publish_event(self, event: Event) -> None:
+        msg = MessageBase(
+            request=RequestBase(
+                type=MessageType.MESSAGE_TYPE_EVENT,
+                event=event,
+            ),
+        )
+        # Routed to the dispatcher and to all event listeners by the
+        # broker.
+        await self._client.publish(EVENT_INGRESS_EXCHANGE.name, "", msg)
+
+    @asynccontextmanager
+    async def consume(
+        self,
+    ) -> AsyncIterator[AsyncIterator[tuple[MessageBase, AsyncAck]]]:
+        async with self._client.consume(
+            self._service.endpoint, prefetch_count=self._concurrency
+        ) as consumer:
+            yield consumer
+
+    async def serve(self, handler: AsyncJobHandler) -> None:
+        """Run `handler` for every job sent to this service.
+
+        Every job runs in its own task, the prefetch limits them to
+        `concurrency` at a time. A job is acknowledged when `handler`
+        returns. When it raises the job is rejected and not delivered
+        again, `handler` is expected to report the error with an event.
+
+        Runs until `stop()` is called. Jobs that are still running are
+        finished before returning.
+        """
+        tasks: set[asyncio.Task] = set()
+        try:
+            async with self.consume() as consumer:
+                async for msg, ack in consumer:
+                    if msg.request.type != MessageType.MESSAGE_TYPE_PUBLISH_JOB:
+                        logger.warning(f"ignoring message of type {msg.request.type!r}")
+                        await ack.ok()
+                        continue
+                    task = asyncio.create_task(
+                        self._run_job(handler, msg.request.publish_job, ack)
+                    )
+                    tasks.add(task)
+                    task.add_done_callback(tasks.discard)
+        finally:
+            if tasks:
+                logger.info(f"waiting for {len(tasks)} running job(s) to finish")
+                await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def stop(self) -> None:
+        """Stop `serve()`."""
+        await self._client.cancel()
+
+    async def _run_job(
+        self, handler: AsyncJobHandler, job: PublishJob, ack: AsyncAck
+    ) -> None:
+        try:
+            await handler(job)
+        except Exception:
+            logger.exception(f"job {job.job_id} failed")
+            await ack.cancel(requeue=False)
+        else:
+            await ack.ok()
+
+
+class AsyncPublishJobClient:
+    _client: AsyncClient
+
+    def __init__(self, url: str, transport: Optional[AsyncTransport] = None) -> None:
+        self._client = AsyncClient(url, transport)
+
+    async def __aenter__(self):
+        await self.open()
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    async def open(self) -> None:
+        await self._client.open()
+
+    async def close(self) -> None:
+        await self._client.close()
+
+    async def publish(self, endpoint: str, publish_job: PublishJob) -> None:
+        await self._client.publish(
+            MAIN_EXCHANGE.name,
+            endpoint,  # Routing key is the same as the endpoint.
+            MessageBase(
+                recipient=endpoint,
+                request=RequestBase(
+                    type=MessageType.MESSAGE_TYPE_PUBLISH_JOB,
+                    publish_job=publish_job,
+                ),
+            ),
+            # Jobs must survive a broker restart.
+            persistent=True,
+        )
+
+
+class AsyncEventListenerClient:
+    _client: AsyncClient
+
+    def __init__(self, url: str, transport: Optional[AsyncTransport] = None) -> None:
+        self._client = AsyncClient(url, transport)
+
+    async def __aenter__(self):
+        await self.open()
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    async def open(self) -> None:
+        await self._client.open()
+
+    async def close(self) -> None:
+        await self._client.close()
+
+    @asynccontextmanager
+    async def consume(
+        self,
+    ) -> AsyncIterator[AsyncIterator[tuple[MessageBase, AsyncAck]]]:
+        name = f"mercaido.events.{uuid4().hex}"
+        exch = EVENTS_EXCHANGE.name
+
+        async with self._client.temporary_queue(name, exch, [""]):
+            async with self._client.consume(name) as consumer:
+                yield consumer
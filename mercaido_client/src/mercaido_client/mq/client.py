@@ -3,18 +3,19 @@
 # SPDX-License-Identifier: MIT
 
 import logging
-from collections.abc import Generator
+import queue
+import threading
+import time
+from collections import deque
+from collections.abc import Callable, Generator
+from concurrent.futures import Future, ThreadPoolExecutor, wait
 from contextlib import contextmanager
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from functools import partial
-from typing import Optional
+from typing import ClassVar, Optional
 from uuid import uuid4
 
-from pika import URLParameters
-from pika.adapters.blocking_connection import (
-    BlockingConnection,
-    BlockingChannel,
-)
+import pika.exceptions
 from pika.exchange_type import ExchangeType
 
 from ..attrs import AttrDict
@@ -27,6 +28,14 @@ from ..pb.mercaido import (
     Event,
     PublishJob,
 )
+from .progress import ProgressReporter
+from .transport import (
+    CONNECTION_ERRORS,
+    Channel,
+    Connection,
+    Transport,
+    transport_for_url,
+)
 
 logger = logging.getLogger(__name__)
 
@@ -43,6 +52,14 @@ EVENTS_EXCHANGE = AttrDict(
     durable=True,
 )
 
+# Services publish events here once. The broker routes them to the
+# dispatcher's queue and to the events exchange.
+EVENT_INGRESS_EXCHANGE = AttrDict(
+    name="mercaido.events",
+    type=ExchangeType.fanout,
+    durable=True,
+)
+
 _DISPATCHER_NAME = "mercaido.dispatcher"
 DISPATCHER_QUEUE = AttrDict(
     name=_DISPATCHER_NAME,
@@ -60,36 +77,166 @@ class ClientError(Exception):
     pass
 
 
+class PublishError(ClientError):
+    """The broker rejected messages, or did not confirm them in time."""
+
+    nacked: list[MessageBase]
+    unconfirmed: list[MessageBase]
+
+    def __init__(
+        self, nacked: list[MessageBase], unconfirmed: list[MessageBase]
+    ) -> None:
+        super().__init__(
+            f"{len(nacked)} message(s) rejected by the broker, "
+            f"{len(unconfirmed)} message(s) not confirmed"
+        )
+        self.nacked = nacked
+        self.unconfirmed = unconfirmed
+
+
 @dataclass(frozen=True, slots=True)
 class Ack:
-    _channel: BlockingChannel
+    _channel: Channel
     _delivery_tag: int
 
-    def ok(self) -> None:
-        self._channel.connection.add_callback_threadsafe(
-            partial(self._channel.basic_ack, delivery_tag=self._delivery_tag)
+    def ok(self, multiple: bool = False) -> None:
+        """Acknowledge this message, or with `multiple` this message and
+        all earlier unacknowledged messages on the same channel."""
+        self._send(
+            partial(
+                self._channel.basic_ack,
+                delivery_tag=self._delivery_tag,
+                multiple=multiple,
+            )
         )
 
-    def cancel(self) -> None:
-        self._channel.connection.add_callback_threadsafe(
-            partial(self._channel.basic_nack, delivery_tag=self._delivery_tag)
+    def cancel(self, multiple: bool = False, requeue: bool = True) -> None:
+        """Reject this message. Without `requeue` the broker drops it."""
+        self._send(
+            partial(
+                self._channel.basic_nack,
+                delivery_tag=self._delivery_tag,
+                multiple=multiple,
+                requeue=requeue,
+            )
         )
 
+    def _send(self, callback: Callable[[], None]) -> None:
+        try:
+            self._channel.connection.add_callback_threadsafe(callback)
+        except CONNECTION_ERRORS:
+            # The broker requeues unacknowledged messages of a lost
+            # connection, so it will be delivered again.
+            logger.warning(
+                f"connection lost, cannot settle delivery {self._delivery_tag}"
+            )
+
+
+@dataclass
+class ConnectionMetrics:
+    """Counters of lost connections and attempts to recover them."""
+
+    # Connections lost.
+    disconnects: int = 0
+    # Attempts to connect again, successful or not.
+    reconnect_attempts: int = 0
+    # Connections recovered.
+    reconnects: int = 0
+    # Total time in seconds without a connection.
+    downtime: float = 0.0
+
 
 class BlockingClient:
     DEFAULT_INACTIVITY_TIMEOUT: float = 40.0
+    DEFAULT_CONFIRM_TIMEOUT: float = 10.0
+    CONFIRM_POLL_INTERVAL: float = 0.01
+    RECONNECT_DELAY: float = 1.0
+    MAX_RECONNECT_DELAY: float = 30.0
 
     @dataclass(frozen=True, slots=True)
     class State:
-        connection: BlockingConnection
-        channel: BlockingChannel
+        connection: Connection
+        channel: Channel
 
-    _state: State | None
-    _params: URLParameters
+    @dataclass(frozen=True, slots=True)
+    class Topology:
+        """Exchanges, queues and bindings to declare again after
+        reconnecting, in the order they were declared."""
+
+        exchanges: dict[str, tuple[ExchangeType, bool]] = field(default_factory=dict)
+        queues: dict[str, bool] = field(default_factory=dict)
+        # (destination, source exchange, binding key)
+        exchange_bindings: dict[tuple[str, str, str], None] = field(
+            default_factory=dict
+        )
+        queue_bindings: dict[tuple[str, str, str], None] = field(default_factory=dict)
+
+        def clear(self) -> None:
+            self.exchanges.clear()
+            self.queues.clear()
+            self.exchange_bindings.clear()
+            self.queue_bindings.clear()
+
+        def forget_exchange(self, name: str) -> None:
+            self.exchanges.pop(name, None)
+            for binding in list(self.exchange_bindings):
+                if name in binding[:2]:
+                    del self.exchange_bindings[binding]
+            for binding in list(self.queue_bindings):
+                if binding[1] == name:
+                    del self.queue_bindings[binding]
+
+        def forget_queue(self, name: str) -> None:
+            self.queues.pop(name, None)
+            for binding in list(self.queue_bindings):
+                if binding[0] == name:
+                    del self.queue_bindings[binding]
 
-    def __init__(self, url: str) -> None:
+    _state: State | None
+    _transport: Transport
+    _confirms: bool
+    _publish_seq: int
+    _unconfirmed: dict[int, MessageBase]
+    _nacked: list[MessageBase]
+    _lost: list[MessageBase]
+    _reconnect: bool
+    _topology: Topology
+    metrics: ConnectionMetrics
+
+    def __init__(
+        self,
+        url: str,
+        transport: Optional[Transport] = None,
+        confirms: bool = False,
+        reconnect: bool = False,
+    ) -> None:
+        """Create a client for the broker at `url`.
+
+        The transport is chosen based on the URL, unless `transport` is
+        given. See `transport_for_url()`.
+
+        With `confirms`, the broker confirms every published message.
+        Publishing does not wait for them, call `wait_for_confirms()`
+        after publishing one or more messages.
+
+        With `reconnect`, a lost connection is re-established, waiting
+        `RECONNECT_DELAY` seconds after the first failed attempt and
+        twice as long after each next one, up to `MAX_RECONNECT_DELAY`.
+        Exchanges and queues declared with this client are declared
+        again and consuming continues. Messages that were not
+        acknowledged yet are delivered again by the broker. `metrics`
+        counts the lost connections and downtime.
+        """
         self._state = None
-        self._params = URLParameters(url)
+        self._transport = transport if transport is not None else transport_for_url(url)
+        self._confirms = confirms
+        self._publish_seq = 0
+        self._unconfirmed = {}
+        self._nacked = []
+        self._lost = []
+        self._reconnect = reconnect
+        self._topology = self.Topology()
+        self.metrics = ConnectionMetrics()
 
     def __enter__(self):
         self.open()
@@ -101,31 +248,125 @@ class BlockingClient:
     def open(self) -> None:
         if self._state is not None:
             raise ClientError("connection already open")
-        connection = BlockingConnection(self._params)
-        connection.add_on_connection_blocked_callback(
-            self._on_connection_blocked_callback
-        )
-        connection.add_on_connection_unblocked_callback(
-            self._on_connection_unblocked_callback
-        )
-        channel = connection.channel()
-        self._state = self.State(connection, channel)
+        self._unconfirmed.clear()
+        self._nacked.clear()
+        self._lost.clear()
+        self._topology.clear()
+        self._connect()
 
     def close(self) -> None:
         if self._state is None:
             raise ClientError("connection already closed")
-        self._state.channel.close()
-        self._state.connection.close()
+        if self._state.connection.is_open:
+            if self._state.channel.is_open:
+                self._state.channel.close()
+            self._state.connection.close()
+        self._state = None
+
+    def _connect(self) -> None:
+        connection = self._transport.connect()
+        channel = connection.channel()
+        if self._confirms:
+            self._publish_seq = 0
+            channel.confirm_select(self._on_confirm)
+        self._state = self.State(connection, channel)
+
+    def _is_connection_error(self, error: Exception) -> bool:
+        # Operations on channels of a closed connection raise channel
+        # errors with pika.
+        if isinstance(error, CONNECTION_ERRORS):
+            return True
+        return (
+            isinstance(error, pika.exceptions.AMQPChannelError)
+            and self._state is not None
+            and not self._state.connection.is_open
+        )
+
+    def _recover(self, error: Exception) -> None:
+        """Reconnect after losing the connection with `error`.
+
+        Re-raises `error` when reconnecting is not enabled.
+        """
+        if not self._reconnect or self._state is None:
+            raise error
+
+        logger.warning(f"connection lost: {error!r}, reconnecting")
+        self.metrics.disconnects += 1
+        lost_at = time.monotonic()
+
+        # Messages published on the lost connection will never be
+        # confirmed.
+        self._lost.extend(self._unconfirmed.values())
+        self._unconfirmed.clear()
+        try:
+            self._state.connection.close()
+        except Exception:
+            pass
         self._state = None
 
+        delay = self.RECONNECT_DELAY
+        while True:
+            self.metrics.reconnect_attempts += 1
+            try:
+                self._connect()
+                self._declare_topology()
+                break
+            except Exception as e:
+                if not self._is_connection_error(e):
+                    raise
+                self._state = None
+                logger.warning(f"reconnecting failed: {e!r}, retrying in {delay}s")
+                time.sleep(delay)
+                delay = min(delay * 2, self.MAX_RECONNECT_DELAY)
+
+        downtime = time.monotonic() - lost_at
+        self.metrics.reconnects += 1
+        self.metrics.downtime += downtime
+        logger.info(f"reconnected after {downtime:.1f}s")
+
+    def _declare_topology(self) -> None:
+        assert self._state is not None
+        channel = self._state.channel
+        topology = self._topology
+        for name, (exchange_type, durable) in topology.exchanges.items():
+            channel.exchange_declare(name, exchange_type, durable=durable)
+        for destination, source, binding_key in topology.exchange_bindings:
+            channel.exchange_bind(destination, source, binding_key)
+        for name, durable in topology.queues.items():
+            channel.queue_declare(name, durable=durable)
+        for name, exchange, binding_key in topology.queue_bindings:
+            channel.queue_bind(name, routing_key=binding_key, exchange=exchange)
+
+    def _retry(self, operation: Callable[[], None]) -> None:
+        """Run `operation`, once more after recovering a lost connection."""
+        try:
+            operation()
+        except Exception as e:
+            if not self._is_connection_error(e):
+                raise
+            self._recover(e)
+            operation()
+
     def is_open(self):
-        return self._state is not None
+        return (
+            self._state is not None
+            and self._state.connection.is_open
+            and self._state.channel.is_open
+        )
 
-    def _on_connection_blocked_callback(self, connection, method):
-        logger.warning(f"connection {connection} blocked: {method=}")
+    def process_data_events(self, time_limit: float = 0) -> None:
+        """Process pending I/O such as heartbeats and callbacks.
 
-    def _on_connection_unblocked_callback(self, connection, method):
-        logger.warning(f"connection {connection} unblocked: {method=}")
+        Raises a pika exception when the connection was lost.
+        """
+        if self._state is None:
+            raise ClientError("connection closed")
+        try:
+            self._state.connection.process_data_events(time_limit=time_limit)
+        except Exception as e:
+            if not self._is_connection_error(e):
+                raise
+            self._recover(e)
 
     def exchange(
         self,
@@ -135,13 +376,33 @@ class BlockingClient:
     ) -> AttrDict:
         if self._state is None:
             raise ClientError("connection closed")
-        self._state.channel.exchange_declare(
-            exchange_name,
-            exchange_type,
-            durable=durable,
+        self._retry(
+            lambda: self._state.channel.exchange_declare(  # type: ignore
+                exchange_name,
+                exchange_type,
+                durable=durable,
+            )
         )
+        self._topology.exchanges[exchange_name] = (exchange_type, durable)
         return AttrDict(name=exchange_name, type=exchange_type)
 
+    def exchange_bind(
+        self, destination: str, source: str, binding_keys: list[str]
+    ) -> None:
+        """Route messages from the `source` exchange that match any of
+        `binding_keys` to the `destination` exchange too."""
+        if self._state is None:
+            raise ClientError("connection closed")
+
+        def bind() -> None:
+            assert self._state is not None
+            for binding_key in binding_keys:
+                self._state.channel.exchange_bind(destination, source, binding_key)
+
+        self._retry(bind)
+        for binding_key in binding_keys:
+            self._topology.exchange_bindings[destination, source, binding_key] = None
+
     def queue(
         self,
         queue_name: str,
@@ -151,16 +412,21 @@ class BlockingClient:
     ) -> AttrDict:
         if self._state is None:
             raise ClientError("connection closed")
-        self._state.channel.queue_declare(
-            queue=queue_name,
-            durable=durable,
-        )
+
+        def declare() -> None:
+            assert self._state is not None
+            self._state.channel.queue_declare(queue_name, durable=durable)
+            for binding_key in binding_keys:
+                self._state.channel.queue_bind(
+                    queue_name,
+                    routing_key=binding_key,
+                    exchange=exchange_name,
+                )
+
+        self._retry(declare)
+        self._topology.queues[queue_name] = durable
         for binding_key in binding_keys:
-            self._state.channel.queue_bind(
-                queue_name,
-                routing_key=binding_key,
-                exchange=exchange_name,
-            )
+            self._topology.queue_bindings[queue_name, exchange_name, binding_key] = None
         return AttrDict(name=queue_name, binding_keys=binding_keys)
 
     @contextmanager
@@ -169,7 +435,10 @@ class BlockingClient:
         try:
             yield result
         finally:
-            self._state.channel.exchange_delete(result.name)  # type: ignore
+            self._topology.forget_exchange(result.name)
+            self._retry(
+                lambda: self._state.channel.exchange_delete(result.name)  # type: ignore
+            )
 
     @contextmanager
     def temporary_queue(self, *args, **kwargs) -> Generator[AttrDict, None, None]:
@@ -177,71 +446,256 @@ class BlockingClient:
         try:
             yield result
         finally:
-            self._state.channel.queue_delete(result.name)  # type: ignore
+            self._topology.forget_queue(result.name)
+            self._retry(
+                lambda: self._state.channel.queue_delete(result.name)  # type: ignore
+            )
+
+    def publish(
+        self,
+        exchange: str,
+        routing_key: str,
+        msg: MessageBase,
+        persistent: bool = False,
+    ) -> None:
+        """Publish a message.
 
-    def publish(self, exchange: str, routing_key: str, msg: MessageBase) -> None:
+        A `persistent` message survives a broker restart when it is
+        routed to a durable queue.
+        """
+        self._publish(exchange, routing_key, msg, msg.serialize(), persistent)
+
+    def _publish(
+        self,
+        exchange: str,
+        routing_key: str,
+        msg: MessageBase,
+        body: bytes,
+        persistent: bool = False,
+    ) -> None:
         if self._state is None:
             raise ClientError("connection closed")
-        # TODO: Durable message.
-        self._state.channel.basic_publish(
-            exchange=exchange,
-            routing_key=routing_key,
-            body=msg.serialize(),
-        )
+
+        def publish() -> None:
+            assert self._state is not None
+            # Track the message before sending it, its confirm may
+            # arrive while the channel flushes its output.
+            if self._confirms:
+                self._publish_seq += 1
+                self._unconfirmed[self._publish_seq] = msg
+            try:
+                self._state.channel.basic_publish(
+                    exchange, routing_key, body, persistent
+                )
+            except BaseException:
+                if self._confirms:
+                    self._unconfirmed.pop(self._publish_seq, None)
+                    self._publish_seq -= 1
+                raise
+
+        self._retry(publish)
+
+    def wait_for_confirms(self, timeout: float = DEFAULT_CONFIRM_TIMEOUT) -> None:
+        """Wait until the broker confirmed the messages published since
+        the previous call.
+
+        Raises `PublishError` with the messages that were rejected or
+        not confirmed within `timeout` seconds, or published on a
+        connection that was lost. Returns immediately when confirms are
+        not enabled.
+        """
+        if not self._confirms:
+            return
+
+        deadline = time.monotonic() + timeout
+        while self._unconfirmed:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            self.process_data_events(min(remaining, self.CONFIRM_POLL_INTERVAL))
+
+        nacked, self._nacked = self._nacked, []
+        unconfirmed, self._lost = self._lost + list(self._unconfirmed.values()), []
+        # Confirms that arrive later are ignored.
+        self._unconfirmed.clear()
+        if nacked or unconfirmed:
+            raise PublishError(nacked, unconfirmed)
+
+    def _on_confirm(self, delivery_tag: int, ack: bool, multiple: bool) -> None:
+        if multiple:
+            tags = [tag for tag in self._unconfirmed if tag <= delivery_tag]
+        else:
+            tags = [delivery_tag]
+        for tag in tags:
+            msg = self._unconfirmed.pop(tag, None)
+            if msg is not None and not ack:
+                self._nacked.append(msg)
 
     @contextmanager
     def consume(
-        self, queue: str, timeout: Optional[float] = DEFAULT_INACTIVITY_TIMEOUT
+        self,
+        queue: str,
+        timeout: Optional[float] = DEFAULT_INACTIVITY_TIMEOUT,
+        prefetch_count: int = 1,
+        lazy: bool = False,
     ):
-        if self._state is None:
-            raise ClientError("connection closed")
+        """Consume messages from `queue`.
 
-        channel = self._state.connection.channel()
-        channel.basic_qos(prefetch_count=1)
-        channel.add_on_return_callback(self._on_channel_return_callback)
+        Yields `(msg, ack)` for every message, and `(None, None)` when no
+        message arrived for `timeout` seconds. With `lazy`, messages are
+        `MessageView`s that decode fields when they are read.
 
+        Messages are consumed on a channel of their own, that is closed
+        when the block ends. Messages that were not acknowledged by then
+        are returned to the queue.
+        """
         if self._state is None:
             raise ClientError("connection closed")
+
+        # The consumer's channel, replaced after reconnecting.
+        current = [self._consume_channel(prefetch_count)]
         try:
-            yield self._consume_generator(channel, queue, timeout)
+            yield self._consume_generator(current, queue, timeout, prefetch_count, lazy)
         finally:
-            channel.cancel()
+            self._close_channel(current[0])
 
-    def _consume_generator(self, channel: BlockingChannel, queue: str, timeout: float):
+    def _consume_channel(self, prefetch_count: int) -> Channel:
         assert self._state is not None
-        consumer = channel.consume(queue, inactivity_timeout=timeout)
-        for method_frame, header_frame, body in consumer:
-            if method_frame is None:
-                yield None, None
-                continue
-
-            if header_frame.reply_to:
-                raise NotImplementedError("reply_to implemented")
-
-            assert body is not None  # method_frame is already checked.
-            assert method_frame.delivery_tag is not None
-            # TODO: Use content-type.
-            msg = MessageBase.deserialize(body)
-            ack = Ack(channel, method_frame.delivery_tag)
-            yield msg, ack
+        channel = self._state.connection.channel()
+        channel.basic_qos(prefetch_count=prefetch_count)
+        return channel
 
-    def _on_channel_return_callback(
+    def _close_channel(self, channel: Channel) -> None:
+        if not channel.is_open:
+            return
+        try:
+            # Send the acknowledgements that other threads queued first.
+            channel.connection.process_data_events()
+            channel.close()
+        except CONNECTION_ERRORS as e:
+            # The channel is closed with its connection.
+            logger.debug(f"connection lost while closing a channel: {e!r}")
+
+    def _consume_generator(
         self,
-        channel: BlockingChannel,
-        method,
-        properties,
-        body,
-    ) -> None:
-        logger.warning(f"message returned on channel {channel}: {method=}")
+        current: list[Channel],
+        queue: str,
+        timeout: Optional[float],
+        prefetch_count: int,
+        lazy: bool,
+    ):
+        decode = MessageBase.view if lazy else MessageBase.deserialize
+        while True:
+            channel = current[0]
+            try:
+                for delivery in channel.consume(queue, inactivity_timeout=timeout):
+                    if delivery is None:
+                        yield None, None
+                        continue
+
+                    if delivery.reply_to:
+                        raise NotImplementedError("reply_to implemented")
+
+                    # TODO: Use content-type.
+                    msg = decode(delivery.body)
+                    ack = Ack(channel, delivery.delivery_tag)
+                    yield msg, ack
+                return
+            except Exception as e:
+                if not self._is_connection_error(e):
+                    raise
+                self._close_channel(channel)
+                self._recover(e)
+                current[0] = self._consume_channel(prefetch_count)
+
+
+def declare_topology(client: BlockingClient) -> None:
+    """Declare Mercaido's exchanges and the dispatcher's queue."""
+    for exchange in (MAIN_EXCHANGE, EVENTS_EXCHANGE, EVENT_INGRESS_EXCHANGE):
+        client.exchange(exchange.name, exchange.type, exchange.durable)
+    client.exchange_bind(EVENTS_EXCHANGE.name, EVENT_INGRESS_EXCHANGE.name, [""])
+    client.queue(
+        DISPATCHER_QUEUE.name,
+        DISPATCHER_QUEUE.exchange,
+        binding_keys=DISPATCHER_QUEUE.binding_keys,
+    )
+    client.queue(DISPATCHER_QUEUE.name, EVENT_INGRESS_EXCHANGE.name, [""])
+
+
+JobHandler = Callable[[PublishJob], None]
 
 
 class ServiceClient:
+    """Client for a service that runs jobs.
+
+    The connection is owned by an I/O thread that the client starts when
+    it is opened. It processes I/O all the time, so heartbeats, acks and
+    events are sent promptly however long jobs, or the thread consuming
+    jobs, take. Every method is safe to call from any thread.
+
+    Calls to the I/O thread, such as publishing events, are queued by
+    the client and not by the connection. They wait while the I/O thread
+    reconnects, and fail with `ClientError` when it stops.
+
+    Progress events are rate-limited by a `ProgressReporter`.
+    """
+
+    POLL_INTERVAL: ClassVar[float] = 0.5
+    IO_INTERVAL: ClassVar[float] = 0.1
+
     _service: Service
     _client: BlockingClient
+    _concurrency: int
+    _stopping: threading.Event
+    _closing: threading.Event
+    _consuming: threading.Event
+    _deliveries: "queue.Queue[tuple[Optional[MessageBase], Optional[Ack]]]"
+    _io_thread: Optional[threading.Thread]
+    _io_error: Optional[BaseException]
+    _calls: deque[tuple[Future, Callable, tuple]]
+    _calls_lock: threading.Lock
+    _accepting_calls: bool
+    _progress: ProgressReporter
+
+    def __init__(
+        self,
+        service: Service,
+        url: str,
+        transport: Optional[Transport] = None,
+        concurrency: int = 1,
+        reconnect: bool = True,
+        progress_interval: float = ProgressReporter.DEFAULT_INTERVAL,
+        progress_min_delta: float = ProgressReporter.DEFAULT_MIN_DELTA,
+    ) -> None:
+        """Create a client for `service`.
+
+        `concurrency` is the number of jobs the service runs at the same
+        time. It is also the number of messages the broker sends ahead.
 
-    def __init__(self, service: Service, url: str) -> None:
+        With `reconnect` the client survives broker restarts, see
+        `BlockingClient`.
+
+        A job's progress is published at most once per
+        `progress_interval` seconds, when it changed at least
+        `progress_min_delta`. Set both to zero to publish all progress.
+        """
+        if concurrency < 1:
+            raise ValueError(f"concurrency must be at least 1, got {concurrency}")
         self._service = service
-        self._client = BlockingClient(url)
+        self._client = BlockingClient(url, transport, reconnect=reconnect)
+        self._concurrency = concurrency
+        self._stopping = threading.Event()
+        self._closing = threading.Event()
+        self._consuming = threading.Event()
+        self._deliveries = queue.Queue()
+        self._io_thread = None
+        self._io_error = None
+        self._calls = deque()
+        self._calls_lock = threading.Lock()
+        self._accepting_calls = False
+        self._progress = ProgressReporter(
+            self._send_event, progress_interval, progress_min_delta
+        )
 
     def __enter__(self):
         self.open()
@@ -251,63 +705,287 @@ class ServiceClient:
         self.close()
 
     def open(self):
-        self._client.open()
+        if self._io_thread is not None:
+            raise ClientError("connection already open")
+        opened: Future = Future()
+        self._closing.clear()
+        self._deliveries = queue.Queue()
+        self._io_error = None
+        self._io_thread = threading.Thread(
+            target=self._run_io,
+            args=(opened,),
+            name=f"{self._service.endpoint}-io",
+            daemon=True,
+        )
+        self._io_thread.start()
+        try:
+            opened.result()
+        except BaseException:
+            self._io_thread.join()
+            self._io_thread = None
+            raise
 
     def close(self):
-        # XXX: Allow client to be closed from other threads.
-        self._client._state.channel.connection.add_callback_threadsafe(
-            self._client.close
-        )
+        if self._io_thread is None:
+            raise ClientError("connection already closed")
+        self._closing.set()
+        self._wake()
+        if threading.current_thread() is not self._io_thread:
+            self._io_thread.join()
+            self._io_thread = None
 
     def register(self) -> None:
-        self._client.queue(
-            queue_name=self._service.endpoint,
-            exchange_name=MAIN_EXCHANGE.name,
-            binding_keys=[self._service.endpoint] + SERVICE_BINDING_KEYS_PART,
-        )
-        self._client.publish(
-            MAIN_EXCHANGE.name,
-            DISPATCHER_ROUTING_KEY,
-            MessageBase(
-                recipient=DISPATCHER_QUEUE.name,
-                request=RequestBase(
-                    type=MessageType.MESSAGE_TYPE_REGISTER_SERVICES,
-                    register_services=RegisterServices(
-                        services=[self._service],
+        def register() -> None:
+            self._client.queue(
+                queue_name=self._service.endpoint,
+                exchange_name=MAIN_EXCHANGE.name,
+                binding_keys=[self._service.endpoint] + SERVICE_BINDING_KEYS_PART,
+            )
+            self._client.publish(
+                MAIN_EXCHANGE.name,
+                DISPATCHER_ROUTING_KEY,
+                MessageBase(
+                    recipient=DISPATCHER_QUEUE.name,
+                    request=RequestBase(
+                        type=MessageType.MESSAGE_TYPE_REGISTER_SERVICES,
+                        register_services=RegisterServices(
+                            services=[self._service],
+                        ),
                     ),
                 ),
-            ),
-        )
+            )
+
+        self._call(register).result()
 
     # TODO: unregister.
     # TODO: pong.
 
     def publish_event(self, event: Event) -> None:
-        tsc = self._client._state.channel.connection.add_callback_threadsafe
+        self._progress.publish_event(event)
+
+    def _send_event(self, event: Event) -> None:
         msg = MessageBase(
             request=RequestBase(
                 type=MessageType.MESSAGE_TYPE_EVENT,
                 event=event,
             ),
         )
-        tsc(
-            partial(
-                self._client.publish, MAIN_EXCHANGE.name, DISPATCHER_ROUTING_KEY, msg
-            )
-        )
-        tsc(partial(self._client.publish, EVENTS_EXCHANGE.name, "", msg))
+        # Routed to the dispatcher and to all event listeners by the
+        # broker.
+        future = self._call(self._client.publish, EVENT_INGRESS_EXCHANGE.name, "", msg)
+        future.add_done_callback(_log_failed_event)
 
     @contextmanager
     def consume(self, timeout: Optional[float] = None):
-        with self._client.consume(self._service.endpoint, timeout) as consumer:
-            yield consumer
+        """Consume jobs sent to this service.
+
+        Yields `(msg, ack)` for every message, and `(None, None)` when no
+        message arrived for `timeout` seconds. Messages are received by
+        the I/O thread, consuming them may take as long as it needs.
+        """
+        if self._io_thread is None:
+            raise ClientError("connection closed")
+        self._consuming.set()
+        self._wake()
+        try:
+            yield self._consume_generator(timeout)
+        finally:
+            self._consuming.clear()
+            self._wake()
+
+    def _consume_generator(self, timeout: Optional[float]):
+        while True:
+            try:
+                item = self._deliveries.get(timeout=timeout)
+            except queue.Empty:
+                yield None, None
+                continue
+            if item is _IO_STOPPED:
+                if self._io_error is not None:
+                    raise ClientError("I/O thread failed") from self._io_error
+                return
+            yield item
+
+    def serve(self, handler: JobHandler) -> None:
+        """Run `handler` for every job sent to this service.
+
+        Up to `concurrency` jobs run at the same time, each in a worker
+        thread. A job is acknowledged when `handler` returns. When it
+        raises the job is rejected and not delivered again, `handler`
+        is expected to report the error with an event.
+
+        Runs until `stop()` is called, or the thread is interrupted.
+        Jobs that are still running are finished before returning.
+        """
+        self._stopping.clear()
+        futures: set[Future] = set()
+
+        with ThreadPoolExecutor(
+            self._concurrency, thread_name_prefix=self._service.endpoint
+        ) as executor, self.consume(self.POLL_INTERVAL) as consumer:
+            try:
+                for msg, ack in consumer:
+                    if self._stopping.is_set():
+                        if ack is not None:
+                            ack.cancel()
+                        break
+                    futures = {f for f in futures if not f.done()}
+                    if msg is None:
+                        continue
+                    assert ack is not None
+                    if msg.request.type != MessageType.MESSAGE_TYPE_PUBLISH_JOB:
+                        logger.warning(f"ignoring message of type {msg.request.type!r}")
+                        ack.ok()
+                        continue
+                    futures.add(
+                        executor.submit(
+                            self._run_job, handler, msg.request.publish_job, ack
+                        )
+                    )
+            finally:
+                if futures:
+                    logger.info(f"waiting for {len(futures)} running job(s) to finish")
+                wait(futures)
+
+    def stop(self) -> None:
+        """Stop `serve()`. Safe to call from any thread."""
+        self._stopping.set()
+
+    def _run_job(self, handler: JobHandler, job: PublishJob, ack: Ack) -> None:
+        try:
+            handler(job)
+        except Exception:
+            logger.exception(f"job {job.job_id} failed")
+            ack.cancel(requeue=False)
+        else:
+            ack.ok()
+        finally:
+            self._progress.finish(job.job_id)
+
+    # I/O thread.
+
+    def _call(self, fn: Callable, *args) -> Future:
+        """Run `fn` on the I/O thread."""
+        future: Future = Future()
+        with self._calls_lock:
+            if not self._accepting_calls or self._closing.is_set():
+                raise ClientError("connection closed")
+            self._calls.append((future, fn, args))
+        self._wake()
+        return future
+
+    def _run_calls(self) -> None:
+        # Calls queued meanwhile run after the next processing of I/O. A
+        # lost connection is recovered by the calls themselves or by
+        # processing I/O, calls wait in the queue until then.
+        with self._calls_lock:
+            calls, self._calls = self._calls, deque()
+        for future, fn, args in calls:
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                future.set_result(fn(*args))
+            except BaseException as e:
+                future.set_exception(e)
+
+    def _stop_calls(self) -> None:
+        with self._calls_lock:
+            self._accepting_calls = False
+            calls, self._calls = self._calls, deque()
+        for future, _, _ in calls:
+            if future.set_running_or_notify_cancel():
+                future.set_exception(ClientError("connection closed"))
+
+    def _wake(self) -> None:
+        # Interrupt the I/O thread waiting for I/O.
+        state = self._client._state
+        if state is not None:
+            try:
+                state.connection.add_callback_threadsafe(_noop)
+            except CONNECTION_ERRORS:
+                pass
+
+    def _run_io(self, opened: Future) -> None:
+        try:
+            self._client.open()
+            # Events are published to the ingress exchange, which may not
+            # exist yet on a fresh broker. The topology is declared again
+            # when the connection is recovered.
+            declare_topology(self._client)
+        except BaseException as e:
+            if self._client.is_open():
+                self._client.close()
+            opened.set_exception(e)
+            return
+        with self._calls_lock:
+            self._accepting_calls = True
+        opened.set_result(None)
+
+        try:
+            while not self._closing.is_set():
+                if self._consuming.is_set():
+                    self._pump_consumer()
+                else:
+                    self._client.process_data_events(self.IO_INTERVAL)
+                    self._progress.flush()
+                    self._run_calls()
+            # Send what was published before closing.
+            self._run_calls()
+        except BaseException as e:
+            logger.exception("I/O thread failed")
+            self._io_error = e
+        finally:
+            self._stop_calls()
+            # Let a consumer that is waiting know.
+            self._deliveries.put(_IO_STOPPED)  # type: ignore
+            try:
+                self._client.close()
+            except Exception as e:
+                logger.warning(f"error closing connection: {e!r}")
+
+    def _pump_consumer(self) -> None:
+        with self._client.consume(
+            self._service.endpoint,
+            self.IO_INTERVAL,
+            prefetch_count=self._concurrency,
+        ) as consumer:
+            for msg, ack in consumer:
+                if msg is not None:
+                    self._deliveries.put((msg, ack))
+                self._progress.flush()
+                self._run_calls()
+                if self._closing.is_set() or not self._consuming.is_set():
+                    break
+            # Return messages that were not consumed to the broker.
+            while True:
+                try:
+                    item = self._deliveries.get_nowait()
+                except queue.Empty:
+                    break
+                if item is not _IO_STOPPED:
+                    item[1].cancel()  # type: ignore
+            self._client.process_data_events()
+
+
+_IO_STOPPED = object()
+
+
+def _noop() -> None:
+    pass
+
+
+def _log_failed_event(future: Future) -> None:
+    if not future.cancelled() and future.exception() is not None:
+        logger.error(f"failed to publish event: {future.exception()!r}")
 
 
 class PublishJobClient:
     _client: BlockingClient
 
-    def __init__(self, url: str) -> None:
-        self._client = BlockingClient(url)
+    def __init__(
+        self, url: str, transport: Optional[Transport] = None, confirms: bool = False
+    ) -> None:
+        self._client = BlockingClient(url, transport, confirms)
 
     def __enter__(self):
         self.open()
@@ -322,6 +1000,17 @@ class PublishJobClient:
     def close(self):
         self._client.close()
 
+    def is_open(self) -> bool:
+        return self._client.is_open()
+
+    def process_data_events(self, time_limit: float = 0) -> None:
+        self._client.process_data_events(time_limit)
+
+    def wait_for_confirms(
+        self, timeout: float = BlockingClient.DEFAULT_CONFIRM_TIMEOUT
+    ) -> None:
+        self._client.wait_for_confirms(timeout)
+
     def publish(self, endpoint: str, publish_job: PublishJob) -> None:
         # FIXME: Currently directly send to the service. Better to
         # send it to the dispatcher for storage, sanity checking, and
@@ -336,14 +1025,16 @@ class PublishJobClient:
                     publish_job=publish_job,
                 ),
             ),
+            # Jobs must survive a broker restart.
+            persistent=True,
         )
 
 
 class EventListenerClient:
     _client: BlockingClient
 
-    def __init__(self, url: str) -> None:
-        self._client = BlockingClient(url)
+    def __init__(self, url: str, transport: Optional[Transport] = None) -> None:
+        self._client = BlockingClient(url, transport)
 
     def __enter__(self):
         self.open()
@@ -359,11 +1050,11 @@ class EventListenerClient:
         self._client.close()
 
     @contextmanager
-    def consume(self, timeout: Optional[float] = None):
+    def consume(self, timeout: Optional[float] = None, lazy: bool = False):
         name = f"mercaido.events.{uuid4().hex}"
         exch = EVENTS_EXCHANGE.name
 
         # TODO: Enable auto-ack, easier for dumb listeners.
         with self._client.temporary_queue(name, exch, [""]):
-            with self._client.consume(name, timeout) as consumer:
+            with self._client.consume(name, timeout, lazy=lazy) as consumer:
                 yield consumer
@@ -0,0 +1,119 @@
+# SPDX-FileCopyrightText: 2023, 2024 Horus View and Explore B.V.
+#
+# SPDX-License-Identifier: MIT
+
+import threading
+import time
+from collections.abc import Callable
+from dataclasses import dataclass
+from typing import ClassVar, Optional
+
+from ..pb.mercaido import Event, EventType
+
+
+@dataclass
+class _JobProgress:
+    sent: Optional[float] = None
+    sent_at: float = 0.0
+    pending: Optional[float] = None
+
+
+class ProgressReporter:
+    """Rate-limits the progress events of jobs.
+
+    A job's progress is published at most once every `interval` seconds,
+    and only when it changed by at least `min_delta` since the progress
+    that was published last. Of the progress reported in between only
+    the latest value is kept, `flush()` publishes it once it is due.
+
+    The first progress of a job is published immediately. Other events,
+    like the start, stop or error of a job, are never held back. Before
+    a job's stop or error event, its pending progress is published.
+
+    Thread-safe, `publish` is called without holding a lock.
+    """
+
+    DEFAULT_INTERVAL: ClassVar[float] = 1.0
+    DEFAULT_MIN_DELTA: ClassVar[float] = 0.5
+
+    _publish: Callable[[Event], None]
+    _interval: float
+    _min_delta: float
+    _jobs: dict[str, _JobProgress]
+    _lock: threading.Lock
+
+    def __init__(
+        self,
+        publish: Callable[[Event], None],
+        interval: float = DEFAULT_INTERVAL,
+        min_delta: float = DEFAULT_MIN_DELTA,
+    ) -> None:
+        self._publish = publish
+        self._interval = interval
+        self._min_delta = min_delta
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def publish_event(self, event: Event) -> None:
+        """Publish `event`, or hold it back if it reports progress."""
+        job_id = event.job_id
+        now = time.monotonic()
+        events = []
+
+        with self._lock:
+            match event.type:
+                case EventType.EVENT_TYPE_JOB_PROGRESS:
+                    job = self._jobs.setdefault(job_id, _JobProgress())
+                    job.pending = event.progress
+                    if (progress := self._due(job, now)) is not None:
+                        events.append(progress_event(job_id, progress))
+                case EventType.EVENT_TYPE_JOB_STOP | EventType.EVENT_TYPE_JOB_ERROR:
+                    job = self._jobs.pop(job_id, None)
+                    if job is not None and job.pending is not None:
+                        events.append(progress_event(job_id, job.pending))
+                    events.append(event)
+                case _:
+                    self._jobs.pop(job_id, None)
+                    events.append(event)
+
+        for e in events:
+            self._publish(e)
+
+    def finish(self, job_id: str) -> None:
+        """Publish the pending progress of a job that ended, and forget
+        the job."""
+        with self._lock:
+            job = self._jobs.pop(job_id, None)
+        if job is not None and job.pending is not None:
+            self._publish(progress_event(job_id, job.pending))
+
+    def flush(self) -> None:
+        """Publish pending progress that is due."""
+        now = time.monotonic()
+        with self._lock:
+            events = [
+                progress_event(job_id, progress)
+                for job_id, job in self._jobs.items()
+                if (progress := self._due(job, now)) is not None
+            ]
+        for event in events:
+            self._publish(event)
+
+    def _due(self, job: _JobProgress, now: float) -> float | None:
+        # Called with the lock held. Marks the returned progress as sent.
+        if job.pending is None:
+            return None
+        if job.sent is not None and (
+            now - job.sent_at < self._interval
+            or abs(job.pending - job.sent) < self._min_delta
+        ):
+            return None
+        progress, job.pending = job.pending, None
+        job.sent, job.sent_at = progress, now
+        return progress
+
+
+def progress_event(job_id: str, progress: float) -> Event:
+    return Event(
+        job_id=job_id, type=EventType.EVENT_TYPE_JOB_PROGRESS, progress=progress
+    )
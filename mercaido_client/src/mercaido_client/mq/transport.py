@@ -0,0 +1,795 @@
+# SPDX-FileCopyrightText: 2023, 2024 Horus View and Explore B.V.
+#
+# SPDX-License-Identifier: MIT
+
+"""Transports carry messages between clients and a broker.
+
+`BlockingClient` talks to a broker through a `Transport`. Two transports
+are available:
+
+- `PikaTransport` connects to an AMQP server, such as RabbitMQ.
+- `InMemoryTransport` connects to an `InMemoryBroker` in the same
+  process. It implements the topic, fanout and direct exchanges used by
+  Mercaido, prefetch and acknowledgements. Use it for tests, benchmarks
+  and single process deployments.
+
+`transport_for_url()` picks a transport based on the URL scheme. URLs
+of the form ``memory://name`` connect to the in-memory broker ``name``.
+"""
+
+import logging
+import threading
+import time
+import weakref
+from collections import deque
+from collections.abc import Callable, Iterator
+from dataclasses import dataclass, field
+from functools import lru_cache, partial
+from itertools import count
+from typing import ClassVar, NamedTuple, Optional, Protocol
+from urllib.parse import urlsplit
+
+import pika.exceptions
+import pika.frame
+import pika.spec
+from pika import BasicProperties, DeliveryMode, URLParameters
+from pika.adapters.blocking_connection import BlockingChannel, BlockingConnection
+from pika.exchange_type import ExchangeType
+
+logger = logging.getLogger(__name__)
+
+
+MEMORY_SCHEME = "memory"
+
+
+class TransportError(Exception):
+    pass
+
+
+class ConnectionLost(TransportError):
+    """The connection to the broker was lost."""
+
+
+# Errors after which connecting again may help.
+CONNECTION_ERRORS: tuple[type[Exception], ...] = (
+    ConnectionLost,
+    pika.exceptions.AMQPConnectionError,
+)
+
+
+class Delivery(NamedTuple):
+    delivery_tag: int
+    body: bytes
+    reply_to: Optional[str] = None
+
+
+ConfirmCallback = Callable[[int, bool, bool], None]
+
+
+class Channel(Protocol):
+    """A channel on a `Connection`.
+
+    Like pika's `BlockingChannel`, a channel must only be used from the
+    thread that owns its connection.
+    """
+
+    @property
+    def connection(self) -> "Connection":
+        ...
+
+    @property
+    def is_open(self) -> bool:
+        ...
+
+    def exchange_declare(
+        self, exchange: str, exchange_type: ExchangeType, durable: bool = True
+    ) -> None:
+        ...
+
+    def exchange_delete(self, exchange: str) -> None:
+        ...
+
+    def exchange_bind(self, destination: str, source: str, routing_key: str) -> None:
+        """Route messages matching `routing_key` from the `source`
+        exchange to the `destination` exchange too."""
+        ...
+
+    def queue_declare(self, queue: str, durable: bool = True) -> None:
+        ...
+
+    def queue_bind(self, queue: str, exchange: str, routing_key: str) -> None:
+        ...
+
+    def queue_delete(self, queue: str) -> None:
+        ...
+
+    def basic_qos(self, prefetch_count: int) -> None:
+        ...
+
+    def basic_publish(
+        self, exchange: str, routing_key: str, body: bytes, persistent: bool = False
+    ) -> None:
+        """Publish a message. A `persistent` message is written to disk
+        by the broker when it is routed to a durable queue."""
+        ...
+
+    def confirm_select(self, on_confirm: ConfirmCallback) -> None:
+        """Enable publisher confirms.
+
+        Messages published afterwards are numbered from 1. The broker
+        confirms them with `on_confirm(number, ack, multiple)`, called
+        on the connection's thread while it processes I/O. With
+        `multiple`, all messages up to and including `number` are
+        confirmed.
+        """
+        ...
+
+    def basic_ack(self, delivery_tag: int, multiple: bool = False) -> None:
+        ...
+
+    def basic_nack(
+        self, delivery_tag: int, multiple: bool = False, requeue: bool = True
+    ) -> None:
+        ...
+
+    def consume(
+        self, queue: str, inactivity_timeout: Optional[float] = None
+    ) -> Iterator[Optional[Delivery]]:
+        """Yield deliveries, or None after `inactivity_timeout` seconds
+        without one."""
+        ...
+
+    def cancel(self) -> None:
+        """Stop consuming. Delivered messages can still be acknowledged,
+        messages that are not are returned to their queue when the
+        channel closes."""
+        ...
+
+    def close(self) -> None:
+        ...
+
+
+class Connection(Protocol):
+    @property
+    def is_open(self) -> bool:
+        ...
+
+    def channel(self) -> Channel:
+        ...
+
+    def add_callback_threadsafe(self, callback: Callable[[], None]) -> None:
+        """Run `callback` on the connection's thread, the next time it
+        processes I/O. This is the only method that is safe to call
+        from other threads."""
+        ...
+
+    def process_data_events(self, time_limit: float = 0) -> None:
+        ...
+
+    def close(self) -> None:
+        ...
+
+
+class Transport(Protocol):
+    def connect(self) -> Connection:
+        ...
+
+
+def transport_for_url(url: str) -> Transport:
+    if urlsplit(url).scheme == MEMORY_SCHEME:
+        return InMemoryTransport.from_url(url)
+    return PikaTransport(url)
+
+
+# Pika
+
+
+_PERSISTENT = BasicProperties(delivery_mode=DeliveryMode.Persistent)
+
+
+class PikaChannel:
+    _connection: "PikaConnection"
+    _channel: BlockingChannel
+
+    def __init__(self, connection: "PikaConnection", channel: BlockingChannel):
+        self._connection = connection
+        self._channel = channel
+        self._channel.add_on_return_callback(self._on_return)
+
+    @property
+    def connection(self) -> "PikaConnection":
+        return self._connection
+
+    @property
+    def is_open(self) -> bool:
+        return self._channel.is_open
+
+    def exchange_declare(
+        self, exchange: str, exchange_type: ExchangeType, durable: bool = True
+    ) -> None:
+        self._channel.exchange_declare(exchange, exchange_type, durable=durable)
+
+    def exchange_delete(self, exchange: str) -> None:
+        self._channel.exchange_delete(exchange)
+
+    def exchange_bind(self, destination: str, source: str, routing_key: str) -> None:
+        self._channel.exchange_bind(destination, source, routing_key=routing_key)
+
+    def queue_declare(self, queue: str, durable: bool = True) -> None:
+        self._channel.queue_declare(queue=queue, durable=durable)
+
+    def queue_bind(self, queue: str, exchange: str, routing_key: str) -> None:
+        self._channel.queue_bind(queue, exchange, routing_key=routing_key)
+
+    def queue_delete(self, queue: str) -> None:
+        self._channel.queue_delete(queue)
+
+    def basic_qos(self, prefetch_count: int) -> None:
+        self._channel.basic_qos(prefetch_count=prefetch_count)
+
+    def basic_publish(
+        self, exchange: str, routing_key: str, body: bytes, persistent: bool = False
+    ) -> None:
+        self._channel.basic_publish(
+            exchange=exchange,
+            routing_key=routing_key,
+            body=body,
+            properties=_PERSISTENT if persistent else None,
+        )
+
+    def confirm_select(self, on_confirm: ConfirmCallback) -> None:
+        # BlockingChannel.confirm_delivery() makes every publish wait for
+        # its own confirm. Enable confirms on the underlying channel
+        # instead, so many messages can be in flight: the broker's acks
+        # and nacks arrive as callbacks while the connection processes
+        # I/O. The underlying channel is not public API, pika is pinned
+        # to a version this was tested with.
+        def on_ack_nack(frame: pika.frame.Method) -> None:
+            method = frame.method
+            ack = isinstance(method, pika.spec.Basic.Ack)
+            on_confirm(method.delivery_tag, ack, method.multiple)
+
+        selected: list[pika.frame.Method] = []
+        self._channel._impl.confirm_delivery(
+            ack_nack_callback=on_ack_nack, callback=selected.append
+        )
+        while not selected:
+            if not self._channel.is_open:
+                raise pika.exceptions.ChannelWrongStateError("channel closed")
+            self._channel.connection.process_data_events(time_limit=None)
+
+    def basic_ack(self, delivery_tag: int, multiple: bool = False) -> None:
+        self._channel.basic_ack(delivery_tag=delivery_tag, multiple=multiple)
+
+    def basic_nack(
+        self, delivery_tag: int, multiple: bool = False, requeue: bool = True
+    ) -> None:
+        self._channel.basic_nack(
+            delivery_tag=delivery_tag, multiple=multiple, requeue=requeue
+        )
+
+    def consume(
+        self, queue: str, inactivity_timeout: Optional[float] = None
+    ) -> Iterator[Optional[Delivery]]:
+        consumer = self._channel.consume(queue, inactivity_timeout=inactivity_timeout)
+        for method_frame, header_frame, body in consumer:
+            if method_frame is None:
+                yield None
+                continue
+            assert body is not None  # method_frame is already checked.
+            assert method_frame.delivery_tag is not None
+            yield Delivery(method_frame.delivery_tag, body, header_frame.reply_to)
+
+    def cancel(self) -> None:
+        self._channel.cancel()
+
+    def close(self) -> None:
+        self._channel.close()
+
+    def _on_return(self, channel, method, properties, body) -> None:
+        logger.warning(f"message returned on channel {channel}: {method=}")
+
+
+class PikaConnection:
+    _connection: BlockingConnection
+
+    def __init__(self, connection: BlockingConnection) -> None:
+        self._connection = connection
+        self._connection.add_on_connection_blocked_callback(self._on_blocked)
+        self._connection.add_on_connection_unblocked_callback(self._on_unblocked)
+
+    @property
+    def is_open(self) -> bool:
+        return self._connection.is_open
+
+    def channel(self) -> PikaChannel:
+        return PikaChannel(self, self._connection.channel())
+
+    def add_callback_threadsafe(self, callback: Callable[[], None]) -> None:
+        self._connection.add_callback_threadsafe(callback)
+
+    def process_data_events(self, time_limit: float = 0) -> None:
+        self._connection.process_data_events(time_limit=time_limit)
+
+    def close(self) -> None:
+        self._connection.close()
+
+    def _on_blocked(self, connection, method) -> None:
+        logger.warning(f"connection {connection} blocked: {method=}")
+
+    def _on_unblocked(self, connection, method) -> None:
+        logger.warning(f"connection {connection} unblocked: {method=}")
+
+
+class PikaTransport:
+    _params: URLParameters
+
+    def __init__(self, url: str) -> None:
+        self._params = URLParameters(url)
+
+    def connect(self) -> PikaConnection:
+        return PikaConnection(BlockingConnection(self._params))
+
+
+# In-memory
+
+
+@lru_cache(maxsize=1024)
+def topic_matches(binding_key: str, routing_key: str) -> bool:
+    """Match a routing key against a topic exchange binding key.
+
+    In the binding key "*" matches exactly one word and "#" zero or more
+    words.
+    """
+    return _match_words(tuple(binding_key.split(".")), tuple(routing_key.split(".")))
+
+
+def _match_words(pattern: tuple[str, ...], words: tuple[str, ...]) -> bool:
+    if not pattern:
+        return not words
+    head, rest = pattern[0], pattern[1:]
+    if head == "#":
+        return any(_match_words(rest, words[i:]) for i in range(len(words) + 1))
+    if not words:
+        return False
+    return (head == "*" or head == words[0]) and _match_words(rest, words[1:])
+
+
+@dataclass
+class _Exchange:
+    type: ExchangeType
+    durable: bool
+    # (queue, binding key)
+    bindings: set[tuple[str, str]] = field(default_factory=set)
+    # (destination exchange, binding key)
+    exchange_bindings: set[tuple[str, str]] = field(default_factory=set)
+
+    def matches(self, binding_key: str, routing_key: str) -> bool:
+        match self.type:
+            case ExchangeType.fanout:
+                return True
+            case ExchangeType.direct:
+                return binding_key == routing_key
+            case ExchangeType.topic:
+                return topic_matches(binding_key, routing_key)
+        raise TransportError(f"unsupported exchange type: {self.type}")
+
+    def route(self, routing_key: str) -> set[str]:
+        return {queue for queue, key in self.bindings if self.matches(key, routing_key)}
+
+
+@dataclass
+class _Queue:
+    durable: bool
+    messages: deque[bytes] = field(default_factory=deque)
+
+
+class InMemoryBroker:
+    """A message broker living in the current process.
+
+    Exchanges route like an AMQP server's. The default exchange ("")
+    routes to the queue named by the routing key. Messages that cannot
+    be routed are dropped, like RabbitMQ does for non-mandatory
+    publishes.
+
+    The broker is thread-safe. Every client connects with its own
+    `InMemoryConnection`. `restart()` simulates a broker restart.
+    """
+
+    _brokers: ClassVar[dict[str, "InMemoryBroker"]] = {}
+    _brokers_lock: ClassVar[threading.Lock] = threading.Lock()
+
+    _exchanges: dict[str, _Exchange]
+    _queues: dict[str, _Queue]
+    _changed: threading.Condition
+    _listeners: set[Callable[[], None]]
+    _connections: "weakref.WeakSet[InMemoryConnection]"
+
+    def __init__(self) -> None:
+        self._exchanges = {}
+        self._queues = {}
+        self._changed = threading.Condition()
+        self._listeners = set()
+        self._connections = weakref.WeakSet()
+
+    def add_listener(self, listener: Callable[[], None]) -> None:
+        """Call `listener` whenever messages were added to a queue.
+
+        It is called with the broker's lock held, from the publishing
+        thread, and must not block.
+        """
+        with self._changed:
+            self._listeners.add(listener)
+
+    def remove_listener(self, listener: Callable[[], None]) -> None:
+        with self._changed:
+            self._listeners.discard(listener)
+
+    @classmethod
+    def named(cls, name: str) -> "InMemoryBroker":
+        """Return the process-wide broker called `name`."""
+        with cls._brokers_lock:
+            if name not in cls._brokers:
+                cls._brokers[name] = cls()
+            return cls._brokers[name]
+
+    def exchange_declare(
+        self, exchange: str, exchange_type: ExchangeType, durable: bool = True
+    ) -> None:
+        exchange_type = ExchangeType(exchange_type)
+        with self._changed:
+            existing = self._exchanges.get(exchange)
+            if existing is None:
+                self._exchanges[exchange] = _Exchange(exchange_type, durable)
+            elif existing.type != exchange_type:
+                raise TransportError(
+                    f"exchange {exchange!r} already declared with type "
+                    f"{existing.type.value!r}"
+                )
+
+    def exchange_delete(self, exchange: str) -> None:
+        with self._changed:
+            self._exchanges.pop(exchange, None)
+            self._drop_exchange_bindings()
+
+    def exchange_bind(self, destination: str, source: str, routing_key: str) -> None:
+        with self._changed:
+            self._get_exchange(destination)
+            self._get_exchange(source).exchange_bindings.add((destination, routing_key))
+
+    def queue_declare(self, queue: str, durable: bool = True) -> None:
+        with self._changed:
+            self._queues.setdefault(queue, _Queue(durable))
+
+    def queue_bind(self, queue: str, exchange: str, routing_key: str) -> None:
+        with self._changed:
+            if queue not in self._queues:
+                raise TransportError(f"no queue {queue!r}")
+            self._get_exchange(exchange).bindings.add((queue, routing_key))
+
+    def queue_delete(self, queue: str) -> None:
+        with self._changed:
+            self._queues.pop(queue, None)
+            for exchange in self._exchanges.values():
+                exchange.bindings = {b for b in exchange.bindings if b[0] != queue}
+
+    def publish(self, exchange: str, routing_key: str, body: bytes) -> None:
+        with self._changed:
+            if exchange == "":
+                queues = {routing_key} & self._queues.keys()
+            else:
+                queues = self._route(exchange, routing_key)
+            for queue in queues:
+                self._queues[queue].messages.append(body)
+            if queues:
+                self._notify()
+
+    def message_count(self, queue: str) -> int:
+        with self._changed:
+            return len(self._get_queue(queue).messages)
+
+    def restart(self) -> None:
+        """Drop all connections, like a restarting AMQP server.
+
+        Unacknowledged messages are requeued. Exchanges and queues that
+        are not durable are deleted, together with their messages.
+        """
+        with self._changed:
+            connections = list(self._connections)
+            self._connections.clear()
+        for connection in connections:
+            connection._lose()
+        with self._changed:
+            self._exchanges = {
+                name: exchange
+                for name, exchange in self._exchanges.items()
+                if exchange.durable
+            }
+            self._queues = {
+                name: queue for name, queue in self._queues.items() if queue.durable
+            }
+            for exchange in self._exchanges.values():
+                exchange.bindings = {
+                    b for b in exchange.bindings if b[0] in self._queues
+                }
+            self._drop_exchange_bindings()
+            self._notify()
+
+    def _route(self, exchange: str, routing_key: str) -> set[str]:
+        # Called with the lock held. Follows bindings between exchanges,
+        # every exchange routes a message once.
+        queues: set[str] = set()
+        seen = {exchange}
+        todo = [self._get_exchange(exchange)]
+        while todo:
+            source = todo.pop()
+            queues |= source.route(routing_key)
+            for destination, key in source.exchange_bindings:
+                if destination not in seen and source.matches(key, routing_key):
+                    seen.add(destination)
+                    todo.append(self._exchanges[destination])
+        return queues
+
+    def _drop_exchange_bindings(self) -> None:
+        # Called with the lock held. Removes bindings to deleted exchanges.
+        for exchange in self._exchanges.values():
+            exchange.exchange_bindings = {
+                b for b in exchange.exchange_bindings if b[0] in self._exchanges
+            }
+
+    def _notify(self) -> None:
+        # Called with the lock held.
+        self._changed.notify_all()
+        for listener in self._listeners:
+            listener()
+
+    def _get_exchange(self, exchange: str) -> _Exchange:
+        try:
+            return self._exchanges[exchange]
+        except KeyError:
+            raise TransportError(f"no exchange {exchange!r}") from None
+
+    def _get_queue(self, queue: str) -> _Queue:
+        try:
+            return self._queues[queue]
+        except KeyError:
+            raise TransportError(f"no queue {queue!r}") from None
+
+
+class InMemoryChannel:
+    _connection: "InMemoryConnection"
+    _broker: InMemoryBroker
+    _prefetch_count: int
+    _unacked: dict[int, tuple[str, bytes]]
+    _consuming: bool
+    _is_open: bool
+
+    def __init__(self, connection: "InMemoryConnection", broker: InMemoryBroker):
+        self._connection = connection
+        self._broker = broker
+        self._prefetch_count = 0
+        self._delivery_tags = count(1)
+        self._unacked = {}
+        self._consuming = False
+        self._is_open = True
+        self._on_confirm: Optional[ConfirmCallback] = None
+
+    @property
+    def connection(self) -> "InMemoryConnection":
+        return self._connection
+
+    @property
+    def is_open(self) -> bool:
+        return self._is_open and self._connection.is_open
+
+    def exchange_declare(
+        self, exchange: str, exchange_type: ExchangeType, durable: bool = True
+    ) -> None:
+        self._check_open()
+        self._broker.exchange_declare(exchange, exchange_type, durable)
+
+    def exchange_delete(self, exchange: str) -> None:
+        self._check_open()
+        self._broker.exchange_delete(exchange)
+
+    def exchange_bind(self, destination: str, source: str, routing_key: str) -> None:
+        self._check_open()
+        self._broker.exchange_bind(destination, source, routing_key)
+
+    def queue_declare(self, queue: str, durable: bool = True) -> None:
+        self._check_open()
+        self._broker.queue_declare(queue, durable)
+
+    def queue_bind(self, queue: str, exchange: str, routing_key: str) -> None:
+        self._check_open()
+        self._broker.queue_bind(queue, exchange, routing_key)
+
+    def queue_delete(self, queue: str) -> None:
+        self._check_open()
+        self._broker.queue_delete(queue)
+
+    def basic_qos(self, prefetch_count: int) -> None:
+        self._prefetch_count = prefetch_count
+
+    def basic_publish(
+        self, exchange: str, routing_key: str, body: bytes, persistent: bool = False
+    ) -> None:
+        # Nothing outlives the process, so persistence is ignored.
+        self._check_open()
+        self._broker.publish(exchange, routing_key, body)
+        if self._on_confirm is not None:
+            self._connection.add_callback_threadsafe(
+                partial(self._on_confirm, next(self._publish_tags), True, False)
+            )
+
+    def confirm_select(self, on_confirm: ConfirmCallback) -> None:
+        self._on_confirm = on_confirm
+        self._publish_tags = count(1)
+
+    def basic_ack(self, delivery_tag: int, multiple: bool = False) -> None:
+        self._settle(delivery_tag, multiple)
+
+    def basic_nack(
+        self, delivery_tag: int, multiple: bool = False, requeue: bool = True
+    ) -> None:
+        settled = self._settle(delivery_tag, multiple)
+        if requeue:
+            self._requeue(settled)
+
+    def consume(
+        self, queue: str, inactivity_timeout: Optional[float] = None
+    ) -> Iterator[Optional[Delivery]]:
+        self._check_open()
+        self._consuming = True
+        changed = self._broker._changed
+        deadline = None
+        if inactivity_timeout is not None:
+            deadline = time.monotonic() + inactivity_timeout
+
+        while self._consuming and self.is_open:
+            self._connection.process_data_events()
+            if (delivery := self._take(queue)) is not None:
+                yield delivery
+                if inactivity_timeout is not None:
+                    deadline = time.monotonic() + inactivity_timeout
+                continue
+
+            with changed:
+                if not self._can_take(queue) and not self._connection._callbacks:
+                    changed.wait(
+                        None if deadline is None else deadline - time.monotonic()
+                    )
+            if deadline is not None and time.monotonic() >= deadline:
+                yield None
+                deadline = time.monotonic() + inactivity_timeout  # type: ignore
+        if self._connection._lost:
+            raise ConnectionLost("connection lost")
+
+    def cancel(self) -> None:
+        self._consuming = False
+
+    def close(self) -> None:
+        self._consuming = False
+        self._requeue(list(self._unacked.items()))
+        self._unacked.clear()
+        self._is_open = False
+
+    def _check_open(self) -> None:
+        if self._connection._lost:
+            raise ConnectionLost("connection lost")
+        if not self.is_open:
+            raise TransportError("channel is closed")
+
+    def _can_take(self, queue: str) -> bool:
+        # Called with the broker lock held.
+        if self._prefetch_count and len(self._unacked) >= self._prefetch_count:
+            return False
+        return bool(self._broker._get_queue(queue).messages)
+
+    def _take(self, queue: str) -> Optional[Delivery]:
+        with self._broker._changed:
+            if not self._can_take(queue):
+                return None
+            body = self._broker._get_queue(queue).messages.popleft()
+        delivery_tag = next(self._delivery_tags)
+        self._unacked[delivery_tag] = (queue, body)
+        return Delivery(delivery_tag, body)
+
+    def _settle(
+        self, delivery_tag: int, multiple: bool
+    ) -> list[tuple[int, tuple[str, bytes]]]:
+        if multiple:
+            tags = [tag for tag in self._unacked if tag <= delivery_tag]
+        elif delivery_tag in self._unacked:
+            tags = [delivery_tag]
+        else:
+            raise TransportError(f"unknown delivery tag {delivery_tag}")
+        return [(tag, self._unacked.pop(tag)) for tag in tags]
+
+    def _requeue(self, settled: list[tuple[int, tuple[str, bytes]]]) -> None:
+        with self._broker._changed:
+            # Put messages back in their original order.
+            for _, (queue, body) in sorted(settled, reverse=True):
+                if queue in self._broker._queues:
+                    self._broker._queues[queue].messages.appendleft(body)
+            self._broker._notify()
+
+
+class InMemoryConnection:
+    _broker: InMemoryBroker
+    _callbacks: deque[Callable[[], None]]
+    _is_open: bool
+    _lost: bool
+
+    def __init__(self, broker: InMemoryBroker) -> None:
+        self._broker = broker
+        self._callbacks = deque()
+        self._channels: list[InMemoryChannel] = []
+        self._is_open = True
+        self._lost = False
+        with broker._changed:
+            broker._connections.add(self)
+
+    @property
+    def is_open(self) -> bool:
+        return self._is_open
+
+    def channel(self) -> InMemoryChannel:
+        if self._lost:
+            raise ConnectionLost("connection lost")
+        if not self._is_open:
+            raise TransportError("connection is closed")
+        channel = InMemoryChannel(self, self._broker)
+        self._channels.append(channel)
+        return channel
+
+    def add_callback_threadsafe(self, callback: Callable[[], None]) -> None:
+        with self._broker._changed:
+            self._callbacks.append(callback)
+            self._broker._changed.notify_all()
+
+    def process_data_events(self, time_limit: float = 0) -> None:
+        if self._lost:
+            raise ConnectionLost("connection lost")
+        changed = self._broker._changed
+        with changed:
+            if not self._callbacks and time_limit > 0:
+                changed.wait(time_limit)
+            callbacks, self._callbacks = self._callbacks, deque()
+        for callback in callbacks:
+            callback()
+
+    def close(self) -> None:
+        for channel in self._channels:
+            if channel.is_open:
+                channel.close()
+        self._is_open = False
+        with self._broker._changed:
+            self._broker._connections.discard(self)
+
+    def _lose(self) -> None:
+        self.close()
+        self._lost = True
+        self._callbacks.clear()
+
+
+class InMemoryTransport:
+    _broker: InMemoryBroker
+
+    def __init__(self, broker: InMemoryBroker) -> None:
+        self._broker = broker
+
+    @classmethod
+    def from_url(cls, url: str) -> "InMemoryTransport":
+        """Create a transport for a ``memory://name`` URL.
+
+        All transports with the same name share a broker.
+        """
+        return cls(InMemoryBroker.named(urlsplit(url).netloc))
+
+    @property
+    def broker(self) -> InMemoryBroker:
+        return self._broker
+
+    def connect(self) -> InMemoryConnection:
+        return InMemoryConnection(self._broker)
@@ -3,13 +3,14 @@
 
 from __future__ import annotations
 
-from typing import Optional, cast
+from collections.abc import Sequence
+from typing import Optional
 from enum import IntEnum
-from itertools import islice
 import mercaido_client.pb.mercaido_pb2
 from .message import (
     Message,
     MessageRegistry,
+    RepeatedMessages,
 )
 
 
@@ -43,6 +44,10 @@ class EventType(IntEnum):
 
 
 class Attribute(Message):
+    __slots__ = ("_values_dict",)
+
+    _values_dict: Optional[tuple[tuple[str, ...], dict[str, str]]]
+
     TYPE = mercaido_client.pb.mercaido_pb2.Attribute  # type: ignore[attr-defined]
 
     def __init__(
@@ -56,6 +61,7 @@ class Attribute(Message):
         display_name: Optional[str] = None,
     ):
         self.obj = self.TYPE()
+        self._reset_cache()
         if values is not None:
             self.obj.values[:] = values
         self.obj.type = type
@@ -68,6 +74,28 @@ class Attribute(Message):
         if display_name is not None:
             self.obj.display_name = display_name
 
+    def _reset_cache(self) -> None:
+        self._values_dict = None
+
+    def number(self) -> float:
+        """The value of a NUMBER attribute."""
+        return float(self._value(AttributeType.ATTRIBUTE_TYPE_NUMBER))
+
+    def boolean(self) -> bool:
+        """The value of a BOOLEAN attribute."""
+        return self._value(AttributeType.ATTRIBUTE_TYPE_BOOLEAN) == "True"
+
+    def recording_id(self) -> int:
+        """The value of a RECORDING_ID attribute."""
+        return int(self._value(AttributeType.ATTRIBUTE_TYPE_RECORDING_ID))
+
+    def _value(self, type: AttributeType) -> str:
+        if self.obj.type != type:
+            raise ValueError(f"Attribute {self.obj.id!r} is not of type {type.name}")
+        if not self.obj.values:
+            raise ValueError(f"Attribute {self.obj.id!r} has no value")
+        return self.obj.values[0]
+
     @property
     def values(self) -> list[str]:
         return self.obj.values
@@ -75,25 +103,24 @@ class Attribute(Message):
     @values.setter
     def values(self, value: list[str]):
         self.obj.values[:] = value
+        self._values_dict = None
 
     @values.deleter
     def values(self) -> None:
         self.obj.ClearField("values")
+        self._values_dict = None
 
     def values_as_dict(self) -> dict[str, str]:
-        if len(self.values) == 0:
-            return {}
-        elif len(self.values) % 2 != 0:
-            raise ValueError(
-                "Field `Attribute.values` should contain an even amount of items representing alternating keys and values"
-            )
-
-        def _it_to_tuples(it):
-            while pair := tuple(islice(it, 2)):
-                yield pair
-
-        iterator = iter(self.values)
-        return dict([pair for pair in _it_to_tuples(iterator)])
+        items = tuple(self.obj.values)
+        cached = self._values_dict
+        if cached is None or cached[0] != items:
+            if len(items) % 2 != 0:
+                raise ValueError(
+                    "Field `Attribute.values` should contain an even amount of items representing alternating keys and values"
+                )
+            it = iter(items)
+            cached = self._values_dict = (items, dict(zip(it, it)))
+        return dict(cached[1])
 
     @property
     def type(self) -> AttributeType:
@@ -157,6 +184,8 @@ class Attribute(Message):
 
 
 class Event(Message):
+    __slots__ = ()
+
     TYPE = mercaido_client.pb.mercaido_pb2.Event  # type: ignore[attr-defined]
 
     def __init__(
@@ -226,6 +255,14 @@ class Event(Message):
 
 
 class MessageBase(Message):
+    __slots__ = (
+        "_response",
+        "_request",
+    )
+
+    _response: Optional[ResponseBase]
+    _request: Optional[RequestBase]
+
     TYPE = mercaido_client.pb.mercaido_pb2.MessageBase  # type: ignore[attr-defined]
 
     def __init__(
@@ -236,6 +273,7 @@ class MessageBase(Message):
         recipient: Optional[str] = None,
     ):
         self.obj = self.TYPE()
+        self._reset_cache()
         if response is not None:
             self.obj.response.CopyFrom(response.obj)
         if request is not None:
@@ -243,9 +281,17 @@ class MessageBase(Message):
         if recipient is not None:
             self.obj.recipient = recipient
 
+    def _reset_cache(self) -> None:
+        self._response = None
+        self._request = None
+
     @property
     def response(self) -> ResponseBase:
-        return cast(ResponseBase, self._from_pb(self.obj.response))
+        pb = self.obj.response
+        msg = self._response
+        if msg is None or msg.obj is not pb:
+            msg = self._response = ResponseBase._wrap(pb)
+        return msg
 
     @response.setter
     def response(self, value: ResponseBase):
@@ -257,7 +303,11 @@ class MessageBase(Message):
 
     @property
     def request(self) -> RequestBase:
-        return cast(RequestBase, self._from_pb(self.obj.request))
+        pb = self.obj.request
+        msg = self._request
+        if msg is None or msg.obj is not pb:
+            msg = self._request = RequestBase._wrap(pb)
+        return msg
 
     @request.setter
     def request(self, value: RequestBase):
@@ -281,20 +331,32 @@ class MessageBase(Message):
 
 
 class PublishJob(Message):
+    __slots__ = ("_services",)
+
+    _services: Optional[RepeatedMessages[Service]]
+
     TYPE = mercaido_client.pb.mercaido_pb2.PublishJob  # type: ignore[attr-defined]
 
     def __init__(self, *, services: Optional[list[Service]] = None, job_id: str):
         self.obj = self.TYPE()
+        self._reset_cache()
         if services is not None:
             self.obj.services.extend([m.obj for m in services])
         self.obj.job_id = job_id
 
+    def _reset_cache(self) -> None:
+        self._services = None
+
     @property
-    def services(self) -> list[Service]:
-        return cast(list[Service], [self._from_pb(m) for m in self.obj.services])
+    def services(self) -> Sequence[Service]:
+        items = self.obj.services
+        view = self._services
+        if view is None or view._items is not items:
+            view = self._services = RepeatedMessages(items, Service)
+        return view
 
     @services.setter
-    def services(self, value: list[Service]):
+    def services(self, value: Sequence[Service]):
         del self.obj.services[:]
         self.obj.services.extend([m.obj for m in value])
 
@@ -316,19 +378,31 @@ class PublishJob(Message):
 
 
 class RegisterServices(Message):
+    __slots__ = ("_services",)
+
+    _services: Optional[RepeatedMessages[Service]]
+
     TYPE = mercaido_client.pb.mercaido_pb2.RegisterServices  # type: ignore[attr-defined]
 
     def __init__(self, *, services: Optional[list[Service]] = None):
         self.obj = self.TYPE()
+        self._reset_cache()
         if services is not None:
             self.obj.services.extend([m.obj for m in services])
 
+    def _reset_cache(self) -> None:
+        self._services = None
+
     @property
-    def services(self) -> list[Service]:
-        return cast(list[Service], [self._from_pb(m) for m in self.obj.services])
+    def services(self) -> Sequence[Service]:
+        items = self.obj.services
+        view = self._services
+        if view is None or view._items is not items:
+            view = self._services = RepeatedMessages(items, Service)
+        return view
 
     @services.setter
-    def services(self, value: list[Service]):
+    def services(self, value: Sequence[Service]):
         del self.obj.services[:]
         self.obj.services.extend([m.obj for m in value])
 
@@ -338,6 +412,16 @@ class RegisterServices(Message):
 
 
 class RequestBase(Message):
+    __slots__ = (
+        "_event",
+        "_publish_job",
+        "_register_services",
+    )
+
+    _event: Optional[Event]
+    _publish_job: Optional[PublishJob]
+    _register_services: Optional[RegisterServices]
+
     TYPE = mercaido_client.pb.mercaido_pb2.RequestBase  # type: ignore[attr-defined]
 
     def __init__(
@@ -349,6 +433,7 @@ class RequestBase(Message):
         type: Optional[MessageType] = None,
     ):
         self.obj = self.TYPE()
+        self._reset_cache()
         if event is not None:
             self.obj.event.CopyFrom(event.obj)
         if publish_job is not None:
@@ -358,9 +443,18 @@ class RequestBase(Message):
         if type is not None:
             self.obj.type = type
 
+    def _reset_cache(self) -> None:
+        self._event = None
+        self._publish_job = None
+        self._register_services = None
+
     @property
     def event(self) -> Event:
-        return cast(Event, self._from_pb(self.obj.event))
+        pb = self.obj.event
+        msg = self._event
+        if msg is None or msg.obj is not pb:
+            msg = self._event = Event._wrap(pb)
+        return msg
 
     @event.setter
     def event(self, value: Event):
@@ -372,7 +466,11 @@ class RequestBase(Message):
 
     @property
     def publish_job(self) -> PublishJob:
-        return cast(PublishJob, self._from_pb(self.obj.publish_job))
+        pb = self.obj.publish_job
+        msg = self._publish_job
+        if msg is None or msg.obj is not pb:
+            msg = self._publish_job = PublishJob._wrap(pb)
+        return msg
 
     @publish_job.setter
     def publish_job(self, value: PublishJob):
@@ -384,7 +482,11 @@ class RequestBase(Message):
 
     @property
     def register_services(self) -> RegisterServices:
-        return cast(RegisterServices, self._from_pb(self.obj.register_services))
+        pb = self.obj.register_services
+        msg = self._register_services
+        if msg is None or msg.obj is not pb:
+            msg = self._register_services = RegisterServices._wrap(pb)
+        return msg
 
     @register_services.setter
     def register_services(self, value: RegisterServices):
@@ -408,6 +510,8 @@ class RequestBase(Message):
 
 
 class ResponseBase(Message):
+    __slots__ = ()
+
     TYPE = mercaido_client.pb.mercaido_pb2.ResponseBase  # type: ignore[attr-defined]
 
     def __init__(
@@ -445,6 +549,14 @@ class ResponseBase(Message):
 
 
 class Service(Message):
+    __slots__ = (
+        "_attributes",
+        "_attributes_index",
+    )
+
+    _attributes: Optional[RepeatedMessages[Attribute]]
+    _attributes_index: Optional[tuple[int, dict[str, int]]]
+
     TYPE = mercaido_client.pb.mercaido_pb2.Service  # type: ignore[attr-defined]
 
     def __init__(
@@ -457,6 +569,7 @@ class Service(Message):
         endpoint: Optional[str] = None,
     ):
         self.obj = self.TYPE()
+        self._reset_cache()
         if attributes is not None:
             self.obj.attributes.extend([m.obj for m in attributes])
         if svg is not None:
@@ -468,18 +581,41 @@ class Service(Message):
         if endpoint is not None:
             self.obj.endpoint = endpoint
 
+    def _reset_cache(self) -> None:
+        self._attributes = None
+        self._attributes_index = None
+
     @property
-    def attributes(self) -> list[Attribute]:
-        return cast(list[Attribute], [self._from_pb(m) for m in self.obj.attributes])
+    def attributes(self) -> Sequence[Attribute]:
+        items = self.obj.attributes
+        view = self._attributes
+        if view is None or view._items is not items:
+            view = self._attributes = RepeatedMessages(items, Attribute)
+        return view
 
     @attributes.setter
-    def attributes(self, value: list[Attribute]):
+    def attributes(self, value: Sequence[Attribute]):
         del self.obj.attributes[:]
         self.obj.attributes.extend([m.obj for m in value])
+        self._attributes_index = None
 
     @attributes.deleter
     def attributes(self) -> None:
         self.obj.ClearField("attributes")
+        self._attributes_index = None
+
+    def attribute(self, id: str) -> Attribute:
+        """Return the last of `attributes` with `id`, like a dict
+        keyed by id would."""
+        items = self.obj.attributes
+        index = self._attributes_index
+        if index is not None and index[0] == len(items):
+            n = index[1].get(id)
+            if n is not None and items[n].id == id:
+                return self.attributes[n]
+        positions = {item.id: n for n, item in enumerate(items)}
+        self._attributes_index = (len(items), positions)
+        return self.attributes[positions[id]]
 
     @property
     def svg(self) -> str:
@@ -4,15 +4,28 @@
 
 from __future__ import annotations
 
-from typing import ClassVar, TypeVar, Generic
+import struct
+from collections.abc import Iterator, MutableSequence, Sequence
+from functools import cache
+from typing import Any, ClassVar, Generic, NamedTuple, Optional, TypeVar, overload
 
-from google.protobuf.message import Message as ProtobufMessage
+from google.protobuf.descriptor import FieldDescriptor
+from google.protobuf.message import DecodeError, Message as ProtobufMessage
 
 
 P = TypeVar("P", bound="ProtobufMessage")
+M = TypeVar("M", bound="Message")
 
 
 class Message(Generic[P]):
+    """Wraps a protobuf message.
+
+    Generated wrappers cache the wrappers of their submessages, they are
+    reused for as long as they wrap the submessage of `obj`.
+    """
+
+    __slots__ = ("obj",)
+
     obj: P
     TYPE: type[P]  # XXX: Can't declare this as ClassVar.
 
@@ -24,26 +37,313 @@ class Message(Generic[P]):
 
     @classmethod
     def deserialize(cls: type[Message[P]], data: bytes) -> Message[P]:
-        msg = cls.__new__(cls)
-        msg.obj = cls.TYPE()
-        msg.obj.ParseFromString(data)
-        return msg
+        pb = cls.TYPE()
+        pb.ParseFromString(data)
+        return cls._wrap(pb)
+
+    @classmethod
+    def view(cls: type[M], data: bytes | memoryview) -> MessageView[M]:
+        """Return a lazy, read-only view on the serialized message `data`.
+
+        See `MessageView`.
+        """
+        return MessageView(cls, data)
 
     @staticmethod
     def _from_pb(pb: P) -> Message[P]:
-        msgtype = MessageRegistry.lookup(pb.__class__)
-        msg = msgtype.__new__(msgtype)
+        return MessageRegistry.lookup(pb.__class__)._wrap(pb)
+
+    @classmethod
+    def _wrap(cls: type[M], pb: Any) -> M:
+        msg = cls.__new__(cls)
         msg.obj = pb
+        msg._reset_cache()
+        return msg
+
+    def _reset_cache(self) -> None:
+        pass
+
+
+class RepeatedMessages(Sequence[M]):
+    """A read-only sequence of wrappers for a repeated message field.
+
+    Reflects the field's current items. Wrappers are created when an
+    item is first accessed, and reused afterwards.
+    """
+
+    __slots__ = ("_items", "_wrapper", "_wrapped")
+
+    _items: MutableSequence[Any]
+    _wrapper: type[M]
+    _wrapped: list[Optional[M]]
+
+    def __init__(self, items: MutableSequence[Any], wrapper: type[M]) -> None:
+        self._items = items
+        self._wrapper = wrapper
+        self._wrapped = []
+
+    def __repr__(self) -> str:
+        return repr(list(self))
+
+    def __eq__(self, other: object) -> bool:
+        if isinstance(other, Sequence):
+            return list(self) == list(other)
+        return NotImplemented
+
+    __hash__ = None  # type: ignore[assignment]
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    @overload
+    def __getitem__(self, index: int) -> M:
+        ...
+
+    @overload
+    def __getitem__(self, index: slice) -> list[M]:
+        ...
+
+    def __getitem__(self, index: int | slice) -> M | list[M]:
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self._items)))]
+        pb = self._items[index]
+        return self._get(index if index >= 0 else index + len(self._items), pb)
+
+    def __iter__(self) -> Iterator[M]:
+        for index, pb in enumerate(self._items):
+            yield self._get(index, pb)
+
+    def _get(self, index: int, pb: Any) -> M:
+        wrapped = self._wrapped
+        if index < len(wrapped):
+            msg = wrapped[index]
+            if msg is not None and msg.obj is pb:
+                return msg
+        else:
+            wrapped.extend([None] * (index + 1 - len(wrapped)))
+        msg = wrapped[index] = self._wrapper._wrap(pb)
         return msg
 
 
 class MessageRegistry:
     _LOOKUP: ClassVar[dict[type[ProtobufMessage], type[Message]]] = {}
+    _BY_NAME: ClassVar[dict[str, type[Message]]] = {}
 
     @classmethod
     def register(cls, pb_type: type[ProtobufMessage], wrapper: type[Message]):
         cls._LOOKUP[pb_type] = wrapper
+        cls._BY_NAME[pb_type.DESCRIPTOR.full_name] = wrapper
 
     @classmethod
     def lookup(cls, pb_type: type[ProtobufMessage]) -> type[Message]:
         return cls._LOOKUP[pb_type]
+
+    @classmethod
+    def lookup_name(cls, full_name: str) -> type[Message]:
+        """Look up a wrapper by the full name of its protobuf message."""
+        return cls._BY_NAME[full_name]
+
+
+# Wire types.
+_VARINT = 0
+_I64 = 1
+_LEN = 2
+_I32 = 5
+
+_FIXED_FORMATS = {
+    FieldDescriptor.TYPE_DOUBLE: "<d",
+    FieldDescriptor.TYPE_FLOAT: "<f",
+    FieldDescriptor.TYPE_FIXED64: "<Q",
+    FieldDescriptor.TYPE_SFIXED64: "<q",
+    FieldDescriptor.TYPE_FIXED32: "<I",
+    FieldDescriptor.TYPE_SFIXED32: "<i",
+}
+
+
+class _Field(NamedTuple):
+    number: int
+    type: int
+    repeated: bool
+    default: Any
+    wrapper: Optional[type[Message]]
+
+
+@cache
+def _view_fields(msgtype: type[Message]) -> dict[str, _Field]:
+    fields = {}
+    for field in msgtype.TYPE.DESCRIPTOR.fields:
+        wrapper = None
+        if field.type == FieldDescriptor.TYPE_MESSAGE:
+            wrapper = MessageRegistry.lookup_name(field.message_type.full_name)
+        fields[field.name] = _Field(
+            field.number,
+            field.type,
+            field.label == FieldDescriptor.LABEL_REPEATED,
+            field.default_value,
+            wrapper,
+        )
+    return fields
+
+
+def _read_varint(data: memoryview, pos: int) -> tuple[int, int]:
+    result = 0
+    shift = 0
+    while True:
+        try:
+            b = data[pos]
+        except IndexError:
+            raise DecodeError("truncated varint") from None
+        pos += 1
+        result |= (b & 0x7F) << shift
+        if not b & 0x80:
+            return result, pos
+        shift += 7
+        if shift >= 70:
+            raise DecodeError("varint too long")
+
+
+class MessageView(Generic[M]):
+    """A lazy, read-only view on a serialized message.
+
+    Fields are read like the fields of the wrapper `M`, with the same
+    names, values and defaults. A field is decoded when it is accessed,
+    message fields return a view on their bytes. Only the fields of the
+    outer message are scanned, on first access, skipping over the bytes
+    of message and string fields. This makes it cheap to look at a few
+    fields of a large message, for example to filter or route it.
+
+    The data is not copied, it must not change while the view is used.
+    Call `message()` to parse everything into a wrapper.
+    """
+
+    __slots__ = ("_type", "_data", "_index")
+
+    _type: type[M]
+    _data: memoryview
+    # Field number to (wire type, start, end) of each occurrence.
+    _index: Optional[dict[int, list[tuple[int, int, int]]]]
+
+    def __init__(self, msgtype: type[M], data: bytes | memoryview) -> None:
+        self._type = msgtype
+        self._data = memoryview(data)
+        self._index = None
+
+    def __repr__(self) -> str:
+        return f"{self._type.__name__}.view({self.message()!r})"
+
+    def __bytes__(self) -> bytes:
+        return bytes(self._data)
+
+    def __getattr__(self, name: str) -> Any:
+        try:
+            field = _view_fields(self._type)[name]
+        except KeyError:
+            raise AttributeError(
+                f"{self._type.__name__!r} has no field {name!r}"
+            ) from None
+        occurrences = self._scan().get(field.number, [])
+
+        if field.repeated:
+            values = []
+            for wire_type, start, end in occurrences:
+                if (
+                    wire_type == _LEN
+                    and field.wrapper is None
+                    and (
+                        field.type
+                        not in (FieldDescriptor.TYPE_STRING, FieldDescriptor.TYPE_BYTES)
+                    )
+                ):
+                    values.extend(self._unpack(field, start, end))
+                else:
+                    values.append(self._decode(field, wire_type, start, end))
+            return values
+
+        if not occurrences:
+            if field.wrapper is not None:
+                return MessageView(field.wrapper, b"")
+            return field.default
+        # The last occurrence wins. Protobuf merges repeated occurrences
+        # of message fields, but never writes them.
+        return self._decode(field, *occurrences[-1])
+
+    def has(self, name: str) -> bool:
+        """Return whether the field `name` is present."""
+        return _view_fields(self._type)[name].number in self._scan()
+
+    def message(self) -> M:
+        """Parse all of the data into a wrapper."""
+        return self._type.deserialize(self._data)  # type: ignore[arg-type,return-value]
+
+    def _scan(self) -> dict[int, list[tuple[int, int, int]]]:
+        if self._index is not None:
+            return self._index
+
+        data = self._data
+        index: dict[int, list[tuple[int, int, int]]] = {}
+        pos = 0
+        size = len(data)
+        while pos < size:
+            key, pos = _read_varint(data, pos)
+            number, wire_type = key >> 3, key & 7
+            start = pos
+            if wire_type == _VARINT:
+                _, pos = _read_varint(data, pos)
+            elif wire_type == _I64:
+                pos += 8
+            elif wire_type == _LEN:
+                length, start = _read_varint(data, pos)
+                pos = start + length
+            elif wire_type == _I32:
+                pos += 4
+            else:
+                raise DecodeError(f"unsupported wire type {wire_type}")
+            if pos > size:
+                raise DecodeError("truncated message")
+            index.setdefault(number, []).append((wire_type, start, pos))
+
+        self._index = index
+        return index
+
+    def _decode(self, field: _Field, wire_type: int, start: int, end: int) -> Any:
+        data = self._data
+        if field.wrapper is not None:
+            return MessageView(field.wrapper, data[start:end])
+        match field.type:
+            case FieldDescriptor.TYPE_STRING:
+                return str(data[start:end], "utf-8")
+            case FieldDescriptor.TYPE_BYTES:
+                return bytes(data[start:end])
+        if (fmt := _FIXED_FORMATS.get(field.type)) is not None:
+            return struct.unpack_from(fmt, data, start)[0]
+        value, _ = _read_varint(data, start)
+        return self._varint_value(field, value)
+
+    def _unpack(self, field: _Field, start: int, end: int) -> list[Any]:
+        data = self._data[:end]
+        if (fmt := _FIXED_FORMATS.get(field.type)) is not None:
+            itemsize = struct.calcsize(fmt)
+            return [
+                struct.unpack_from(fmt, data, pos)[0]
+                for pos in range(start, end, itemsize)
+            ]
+        values = []
+        pos = start
+        while pos < end:
+            value, pos = _read_varint(data, pos)
+            values.append(self._varint_value(field, value))
+        return values
+
+    @staticmethod
+    def _varint_value(field: _Field, value: int) -> Any:
+        match field.type:
+            case FieldDescriptor.TYPE_BOOL:
+                return bool(value)
+            case FieldDescriptor.TYPE_SINT32 | FieldDescriptor.TYPE_SINT64:
+                return (value >> 1) ^ -(value & 1)
+            case FieldDescriptor.TYPE_INT32 | FieldDescriptor.TYPE_INT64 | (
+                FieldDescriptor.TYPE_ENUM
+            ):
+                # Negative numbers are sent as 64-bit two's complement.
+                return value - (1 << 64) if value >= 1 << 63 else value
+        return value
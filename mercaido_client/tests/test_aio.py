@@ -0,0 +1,84 @@
+# SPDX-FileCopyrightText: 2023, 2024 Horus View and Explore B.V.
+#
+# SPDX-License-Identifier: MIT
+
+import asyncio
+
+from mercaido_client.mq.aio import (
+    AsyncClient,
+    AsyncEventListenerClient,
+    AsyncInMemoryTransport,
+    AsyncPublishJobClient,
+    AsyncServiceClient,
+    declare_topology,
+)
+from mercaido_client.mq.client import DISPATCHER_QUEUE, EVENTS_EXCHANGE, MAIN_EXCHANGE
+from mercaido_client.mq.transport import InMemoryBroker
+from mercaido_client.pb.mercaido import Event, EventType, PublishJob, Service
+
+
+def test_service_client_runs_jobs_concurrently():
+    transport = AsyncInMemoryTransport(InMemoryBroker())
+    service = Service(endpoint="mercaido.service.test", name="test")
+    service_client = AsyncServiceClient(service, "memory://", transport, concurrency=4)
+    running = 0
+    max_running = 0
+    done = []
+
+    async def handler(job):
+        nonlocal running, max_running
+        running += 1
+        max_running = max(max_running, running)
+        await asyncio.sleep(0.01)
+        running -= 1
+        done.append(job.job_id)
+        if job.job_id == "job-0":
+            raise RuntimeError("failed")
+        if len(done) == 10:
+            await service_client.stop()
+
+    async def main():
+        async with AsyncClient("memory://", transport) as client:
+            await client.exchange(MAIN_EXCHANGE.name, MAIN_EXCHANGE.type)
+            await client.exchange(EVENTS_EXCHANGE.name, EVENTS_EXCHANGE.type)
+
+        async with service_client:
+            await service_client.register()
+            async with AsyncPublishJobClient("memory://", transport) as publisher:
+                for n in range(10):
+                    await publisher.publish(
+                        service.endpoint, PublishJob(job_id=f"job-{n}")
+                    )
+            await asyncio.wait_for(service_client.serve(handler), 5)
+
+    asyncio.run(main())
+
+    assert max_running == 4
+    assert sorted(done) == sorted(f"job-{n}" for n in range(10))
+    assert transport.broker.message_count(service.endpoint) == 0
+
+
+def test_event_listener_receives_events():
+    transport = AsyncInMemoryTransport(InMemoryBroker())
+    service = Service(endpoint="mercaido.service.test", name="test")
+
+    async def main():
+        async with AsyncClient("memory://", transport) as client:
+            await declare_topology(client)
+
+        async with (
+            AsyncServiceClient(service, "memory://", transport) as service_client,
+            AsyncEventListenerClient("memory://", transport) as listener,
+            listener.consume() as consumer,
+        ):
+            await service_client.publish_event(
+                Event(job_id="job-1", type=EventType.EVENT_TYPE_JOB_START)
+            )
+            msg, ack = await asyncio.wait_for(anext(aiter(consumer)), 1)
+            await ack.ok()
+            return msg
+
+    msg = asyncio.run(main())
+    assert msg.request.event.job_id == "job-1"
+    # Published once, routed to the dispatcher too.
+    assert transport.broker.message_count(DISPATCHER_QUEUE.name) == 1
@@ -0,0 +1,493 @@
+# SPDX-FileCopyrightText: 2023, 2024 Horus View and Explore B.V.
+#
+# SPDX-License-Identifier: MIT
+
+import struct
+
+import numpy as np
+import pytest
+
+ogr = pytest.importorskip("osgeo.ogr")
+gdal = pytest.importorskip("osgeo.gdal")
+
+from mercaido_client import gis  # noqa: E402
+from mercaido_client.gis import (  # noqa: E402
+    FeatureServerClient,
+    Layer,
+    Point,
+    Polygon,
+    Polyline,
+    _point_coordinates,
+    _wkb_linestring,
+    _wkb_point_list,
+    _wkb_polygon,
+)
+
+
+def read_points(wkb, offset, dimensions):
+    (count,) = struct.unpack_from("<I", wkb, offset)
+    offset += 4
+    values = struct.unpack_from(f"<{count * dimensions}d", wkb, offset)
+    offset += 8 * count * dimensions
+    points = [values[n : n + dimensions] for n in range(0, len(values), dimensions)]
+    return points, offset
+
+
+@pytest.mark.parametrize(
+    "coordinates, geometry_type",
+    [
+        ([[4.0, 52.0], [5.0, 53.0], [6.0, 51.5]], 2),
+        ([[4.0, 52.0, 1.0], [5.0, 53.0, 2.0]], 1002),
+    ],
+)
+def test_wkb_linestring(coordinates, geometry_type):
+    wkb = _wkb_linestring(np.array(coordinates))
+
+    assert struct.unpack_from("<BI", wkb) == (1, geometry_type)
+    points, offset = read_points(wkb, 5, len(coordinates[0]))
+    assert points == [tuple(point) for point in coordinates]
+    assert offset == len(wkb)
+
+    geometry = ogr.CreateGeometryFromWkb(wkb)
+    assert geometry.GetPoints() == [tuple(point) for point in coordinates]
+
+
+def test_wkb_polygon():
+    outer = np.array([[0.0, 0.0], [4.0, 0.0], [4.0, 4.0], [0.0, 4.0]])
+    # Already closed, and with altitudes.
+    inner = np.array(
+        [[1.0, 1.0, 5.0], [2.0, 1.0, 5.0], [1.0, 2.0, 5.0], [1.0, 1.0, 5.0]]
+    )
+    wkb = _wkb_polygon([outer, inner])
+
+    assert struct.unpack_from("<BII", wkb) == (1, 1003, 2)
+    outer_points, offset = read_points(wkb, 9, 3)
+    inner_points, offset = read_points(wkb, offset, 3)
+    assert offset == len(wkb)
+    # The outer ring is closed and gets an altitude of 0.
+    assert outer_points == [
+        (0.0, 0.0, 0.0),
+        (4.0, 0.0, 0.0),
+        (4.0, 4.0, 0.0),
+        (0.0, 4.0, 0.0),
+        (0.0, 0.0, 0.0),
+    ]
+    assert inner_points == [tuple(point) for point in inner]
+
+    geometry = ogr.CreateGeometryFromWkb(wkb)
+    assert geometry.GetGeometryCount() == 2
+    assert geometry.GetGeometryRef(0).GetPoints() == outer_points
+
+
+@pytest.mark.parametrize("dimensions", [2, 3])
+def test_wkb_point_list(dimensions):
+    coordinates = np.arange(3 * dimensions, dtype=np.float64).reshape(3, dimensions)
+    wkbs = _wkb_point_list(coordinates)
+
+    geometry_type = 1 if dimensions == 2 else 1001
+    assert len(wkbs) == 3
+    for wkb, point in zip(wkbs, coordinates.tolist()):
+        assert len(wkb) == 5 + 8 * dimensions
+        assert struct.unpack("<BI" + "d" * dimensions, wkb) == (
+            1,
+            geometry_type,
+            *point,
+        )
+        geometry = ogr.CreateGeometryFromWkb(wkb)
+        assert list(geometry.GetPoint()[:dimensions]) == point
+
+    np.testing.assert_array_equal(_point_coordinates(wkbs), coordinates)
+
+
+def test_polyline_from_coordinates():
+    polyline = Polyline.from_coordinates([4.0, 52.0, 5.0, 53.0])
+
+    np.testing.assert_array_equal(polyline.coordinates, [[4.0, 52.0], [5.0, 53.0]])
+    assert polyline.geometry.GetPoints() == [(4.0, 52.0), (5.0, 53.0)]
+    assert [(p.longitude, p.latitude) for p in polyline.points] == [
+        (4.0, 52.0),
+        (5.0, 53.0),
+    ]
+
+    polyline = Polyline.from_coordinates([4.0, 52.0, 1.0, 5.0, 53.0, 2.0], 3)
+    assert polyline.geometry.GetPoints() == [(4.0, 52.0, 1.0), (5.0, 53.0, 2.0)]
+
+    # The same geometry as a polyline of points.
+    points = Polyline([Point(52.0, 4.0, 1.0), Point(53.0, 5.0, 2.0)])
+    assert points.geometry.Equals(polyline.geometry)
+
+
+def test_polygon_from_coordinates():
+    polygon = Polygon.from_coordinates([[[0.0, 0.0], [4.0, 0.0], [4.0, 4.0]]])
+
+    assert polygon.geometry.GetGeometryRef(0).GetPoints() == [
+        (0.0, 0.0),
+        (4.0, 0.0),
+        (4.0, 4.0),
+        (0.0, 0.0),
+    ]
+    points = Polygon([[Point(0.0, 0.0), Point(0.0, 4.0), Point(4.0, 4.0)]])
+    assert points.geometry.Equals(polygon.geometry)
+
+    with pytest.raises(ValueError):
+        Polygon.from_coordinates([[[0.0, 0.0], [4.0, 0.0]]])
+    with pytest.raises(ValueError):
+        Polygon.from_coordinates([])
+
+
+def test_point_coordinates():
+    wkbs = [
+        # XY, little and big endian.
+        struct.pack("<BIdd", 1, 1, 1.0, 2.0),
+        struct.pack(">BIdd", 0, 1, 3.0, 4.0),
+        None,
+        # XYM, the M value is dropped.
+        struct.pack("<BIddd", 1, 2001, 5.0, 6.0, 99.0),
+        struct.pack("<BIddd", 1, 0x40000001, 7.0, 8.0, 99.0),
+    ]
+    np.testing.assert_array_equal(
+        _point_coordinates(wkbs),
+        [[1.0, 2.0], [3.0, 4.0], [np.nan, np.nan], [5.0, 6.0], [7.0, 8.0]],
+    )
+
+    wkbs = [
+        # XYZ, ISO and 2.5D.
+        struct.pack("<BIddd", 1, 1001, 1.0, 2.0, 3.0),
+        struct.pack(">BIddd", 0, 0x80000001, 4.0, 5.0, 6.0),
+        # XYZM.
+        struct.pack("<BIdddd", 1, 3001, 7.0, 8.0, 9.0, 99.0),
+        ogr.CreateGeometryFromWkt("POINT Z (10 11 12)").ExportToIsoWkb(),
+    ]
+    np.testing.assert_array_equal(
+        _point_coordinates(wkbs),
+        [[1.0, 2.0, 3.0], [4.0, 5.0, 6.0], [7.0, 8.0, 9.0], [10.0, 11.0, 12.0]],
+    )
+
+    assert _point_coordinates([None]).shape == (1, 2)
+
+
+@pytest.mark.parametrize(
+    "wkbs",
+    [
+        [struct.pack("<BIdd", 1, 1, 1.0, 2.0), struct.pack("<BIddd", 1, 1001, 1, 2, 3)],
+        [struct.pack("<BIdd", 1, 2, 1.0, 2.0)],
+        [ogr.CreateGeometryFromWkt("LINESTRING (1 2, 3 4)").ExportToIsoWkb()],
+    ],
+)
+def test_point_coordinates_of_other_geometries(wkbs):
+    with pytest.raises(TypeError):
+        _point_coordinates(wkbs)
+
+
+class RecordingLayer:
+    """An OGR layer that records transactions and writes.
+
+    The memory driver doesn't implement transactions, so what is rolled
+    back is checked from the recorded calls.
+    """
+
+    def __init__(self, ogr_layer):
+        self._ogr_layer = ogr_layer
+        self.calls = []
+
+    def __getattr__(self, name):
+        return getattr(self._ogr_layer, name)
+
+    def StartTransaction(self):
+        self.calls.append("start")
+        return self._ogr_layer.StartTransaction()
+
+    def CommitTransaction(self):
+        self.calls.append("commit")
+        return self._ogr_layer.CommitTransaction()
+
+    def RollbackTransaction(self):
+        self.calls.append("rollback")
+        return self._ogr_layer.RollbackTransaction()
+
+    def CreateFeature(self, feature):
+        self.calls.append("write")
+        return self._ogr_layer.CreateFeature(feature)
+
+    def SetFeature(self, feature):
+        self.calls.append("write")
+        return self._ogr_layer.SetFeature(feature)
+
+    def DeleteFeature(self, fid):
+        self.calls.append("write")
+        return self._ogr_layer.DeleteFeature(fid)
+
+
+@pytest.fixture
+def ogr_layer():
+    driver = ogr.GetDriverByName("Memory") or ogr.GetDriverByName("MEM")
+    datasource = driver.CreateDataSource("memory")
+    ogr_layer = datasource.CreateLayer("points", geom_type=ogr.wkbPoint)
+    ogr_layer.CreateField(ogr.FieldDefn("name", ogr.OFTString))
+    ogr_layer.CreateField(ogr.FieldDefn("height", ogr.OFTReal))
+    # The layer is only valid while its datasource is open.
+    yield ogr_layer
+    datasource.Close()
+
+
+@pytest.fixture
+def recording_layer(ogr_layer):
+    return RecordingLayer(ogr_layer)
+
+
+def points(layer, count):
+    for n in range(count):
+        feature = layer.create_point(Point(52.0 + n, 4.0 + n))
+        feature["name"] = f"point-{n}"
+        yield feature
+
+
+def names(ogr_layer):
+    ogr_layer.ResetReading()
+    features = iter(ogr_layer.GetNextFeature, None)
+    return sorted(feature["name"] for feature in features)
+
+
+@pytest.mark.parametrize(
+    "count, batch_size, calls",
+    [
+        (
+            5,
+            2,
+            ["start", "write", "write", "commit"] * 2 + ["start", "write", "commit"],
+        ),
+        (4, 2, ["start", "write", "write", "commit"] * 2 + ["start", "commit"]),
+        (3, 3, ["start", "write", "write", "write", "commit", "start", "commit"]),
+        (3, 500, ["start", "write", "write", "write", "commit"]),
+        (0, 500, ["start", "commit"]),
+    ],
+)
+def test_add_features_in_batches(recording_layer, count, batch_size, calls):
+    layer = Layer(recording_layer)
+
+    assert layer.add_features(points(layer, count), batch_size) == count
+    assert recording_layer.calls == calls
+    assert names(recording_layer) == [f"point-{n}" for n in range(count)]
+
+
+def test_update_and_delete_features(recording_layer):
+    layer = Layer(recording_layer)
+    layer.add_features(points(layer, 3))
+    recording_layer.calls.clear()
+
+    features = layer.get_features()
+    for feature in features:
+        feature["name"] = feature["name"].upper()
+    assert layer.update_features(features, batch_size=2) == 3
+    assert names(recording_layer) == ["POINT-0", "POINT-1", "POINT-2"]
+
+    assert layer.delete_features(features[:2], batch_size=2) == 2
+    assert names(recording_layer) == ["POINT-2"]
+    assert recording_layer.calls == [
+        *["start", "write", "write", "commit", "start", "write", "commit"],
+        *["start", "write", "write", "commit", "start", "commit"],
+    ]
+
+
+def test_transaction_rolls_back_on_error(recording_layer):
+    layer = Layer(recording_layer)
+
+    with pytest.raises(RuntimeError):
+        with layer.transaction(batch_size=2):
+            for feature in points(layer, 3):
+                layer.add_feature(feature)
+            raise RuntimeError("failed")
+    # The first batch was committed, the write after it is rolled back.
+    assert recording_layer.calls == [
+        *["start", "write", "write", "commit"],
+        *["start", "write", "rollback"],
+    ]
+
+    def failing_points():
+        yield from points(layer, 1)
+        raise RuntimeError("failed")
+
+    recording_layer.calls.clear()
+    with pytest.raises(RuntimeError):
+        layer.add_features(failing_points())
+    assert recording_layer.calls == ["start", "write", "rollback"]
+
+    # Writes after the failed transaction are not batched.
+    recording_layer.calls.clear()
+    layer.add_feature(next(points(layer, 1)))
+    assert recording_layer.calls == ["write"]
+
+
+def test_nested_transactions(recording_layer):
+    layer = Layer(recording_layer)
+
+    with layer.transaction():
+        layer.add_features(points(layer, 2), batch_size=1)
+        layer.add_feature(next(points(layer, 1)))
+    # The inner transaction is part of the outer one, without batches.
+    assert recording_layer.calls == ["start", "write", "write", "write", "commit"]
+
+
+@pytest.fixture
+def layer(ogr_layer):
+    layer = Layer(ogr_layer)
+    for n, feature in enumerate(points(layer, 5)):
+        feature["height"] = float(n)
+        layer.add_feature(feature)
+    return layer
+
+
+def feature_names(features):
+    return sorted(feature["name"] for feature in features)
+
+
+def test_iter_features_filters(layer, ogr_layer):
+    assert feature_names(layer.iter_features(where="height >= 3")) == [
+        "point-3",
+        "point-4",
+    ]
+    # Points are at (4 + n, 52 + n).
+    assert feature_names(layer.iter_features(bbox=(4.5, 52.5, 6.5, 54.5))) == [
+        "point-1",
+        "point-2",
+    ]
+    assert feature_names(
+        layer.iter_features(where="height >= 2", bbox=(3.5, 51.5, 6.5, 54.5))
+    ) == ["point-2"]
+
+    # Ignored fields are not requested from the server.
+    features = layer.iter_features(fields=["name"], geometry=False)
+    first = next(features)
+    assert first["name"] is not None
+    definition = ogr_layer.GetLayerDefn()
+    assert not definition.GetFieldDefn(definition.GetFieldIndex("name")).IsIgnored()
+    assert definition.GetFieldDefn(definition.GetFieldIndex("height")).IsIgnored()
+    assert definition.IsGeometryIgnored()
+    assert len([first, *features]) == 5
+
+
+@pytest.mark.parametrize(
+    "filters",
+    [
+        {"where": "height >= 3"},
+        {"bbox": (4.5, 52.5, 6.5, 54.5)},
+        {"fields": ["name"], "geometry": False},
+    ],
+)
+def test_iter_features_resets_filters(layer, ogr_layer, filters):
+    def assert_reset():
+        assert ogr_layer.GetSpatialFilter() is None
+        definition = ogr_layer.GetLayerDefn()
+        assert not any(
+            definition.GetFieldDefn(n).IsIgnored()
+            for n in range(definition.GetFieldCount())
+        )
+        assert not definition.IsGeometryIgnored()
+        features = list(layer.iter_features())
+        assert len(features) == 5
+        for feature in features:
+            assert feature["height"] is not None
+            assert feature._ogr_feature.GetGeometryRef() is not None
+
+    list(layer.iter_features(**filters))
+    assert_reset()
+
+    # Also when the iteration stops early.
+    features = layer.iter_features(**filters)
+    next(features)
+    features.close()
+    assert_reset()
+
+
+@pytest.mark.parametrize(
+    "kwargs, flags, open_options",
+    [
+        (
+            {"page_size": 100},
+            gdal.OF_VECTOR | gdal.OF_UPDATE,
+            ["PAGING_ALLOWED=ON", "PAGE_SIZE=100"],
+        ),
+        (
+            {"page_size": 10, "readonly": True},
+            gdal.OF_VECTOR,
+            ["PAGING_ALLOWED=ON", "PAGE_SIZE=10"],
+        ),
+    ],
+)
+def test_page_size_is_passed_to_gdal(monkeypatch, kwargs, flags, open_options):
+    opened = []
+
+    def open_ex(path, open_flags, open_options):
+        opened.append((path, open_flags, open_options))
+        return FakeDatasource()
+
+    monkeypatch.setattr(gis.gdal, "OpenEx", open_ex)
+    with FeatureServerClient("https://example.com/wfs", cache=None, **kwargs):
+        pass
+
+    assert opened == [("WFS:https://example.com/wfs", flags, open_options)]
+
+
+def test_without_page_size_features_are_not_paged(monkeypatch):
+    opened = []
+
+    def open(path, update):
+        opened.append((path, update))
+        return FakeDatasource()
+
+    monkeypatch.setattr(gis.ogr, "Open", open)
+    with FeatureServerClient("https://example.com/wfs", cache=None):
+        pass
+
+    assert opened == [("WFS:https://example.com/wfs", True)]
+
+
+class FakeDatasource:
+    def Close(self):
+        pass
+
+
+def read_columns_both_ways(layer, monkeypatch, **filters):
+    read_arrow_columns = Layer._read_arrow_columns
+    arrow_reads = []
+
+    def spy(self):
+        columns = read_arrow_columns(self)
+        arrow_reads.append(columns)
+        return columns
+
+    with monkeypatch.context() as patch:
+        patch.setattr(Layer, "_read_arrow_columns", spy)
+        arrow = layer.read_columns(**filters)
+    assert len(arrow_reads) == 1 and arrow_reads[0] is arrow
+
+    with monkeypatch.context() as patch:
+        patch.setattr(Layer, "_read_arrow_columns", lambda self: None)
+        fallback = layer.read_columns(**filters)
+    return arrow, fallback
+
+
+@pytest.mark.parametrize(
+    "filters",
+    [
+        {},
+        {"where": "height >= 2"},
+        {"bbox": (4.5, 52.5, 6.5, 54.5), "fields": ["height"]},
+    ],
+)
+def test_read_columns_with_and_without_arrow(layer, monkeypatch, filters):
+    if not hasattr(layer._ogr_layer, "GetArrowStreamAsNumPy"):
+        pytest.skip("GDAL has no Arrow stream interface")
+
+    arrow, fallback = read_columns_both_ways(layer, monkeypatch, **filters)
+
+    assert len(arrow) == len(fallback) > 0
+    # The memory driver names neither the FID nor the geometry column.
+    assert arrow.fid.dtype == fallback.fid.dtype == np.int64
+    np.testing.assert_array_equal(arrow.fid, fallback.fid)
+    np.testing.assert_array_equal(arrow.coordinates(), fallback.coordinates())
+    assert arrow.columns.keys() == fallback.columns.keys()
+    for name in arrow.columns:
+        assert arrow[name].tolist() == fallback[name].tolist()
+    if "fields" in filters:
+        assert list(arrow.columns) == filters["fields"]
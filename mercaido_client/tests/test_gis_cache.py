@@ -0,0 +1,175 @@
+# SPDX-FileCopyrightText: 2023, 2024 Horus View and Explore B.V.
+#
+# SPDX-License-Identifier: MIT
+
+import itertools
+
+import pytest
+
+pytest.importorskip("osgeo")
+
+from mercaido_client.gis import cache  # noqa: E402
+from mercaido_client.gis.cache import DatasourceCache  # noqa: E402
+
+
+class FakeDatasource:
+    def __init__(self, name):
+        self.name = name
+        self.closed = False
+
+    def Close(self):
+        self.closed = True
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def monotonic(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(cache, "time", clock)
+    return clock
+
+
+@pytest.fixture
+def opener():
+    opened = []
+    names = itertools.count()
+
+    def open():
+        datasource = FakeDatasource(f"ds-{next(names)}")
+        opened.append(datasource)
+        return datasource
+
+    open.opened = opened
+    return open
+
+
+def test_leases_one_client_at_a_time(clock, opener):
+    datasources = DatasourceCache()
+
+    first = datasources.acquire("a", "key", opener)
+    # Leased, a second client gets its own datasource.
+    second = datasources.acquire("a", "key", opener)
+    assert first is not second
+    assert len(opener.opened) == 2
+
+    datasources.release(first)
+    assert datasources.acquire("a", "key", opener) is first
+    assert len(opener.opened) == 2
+    # Other keys don't share datasources.
+    assert datasources.acquire("a", "other", opener) not in (first, second)
+    assert not any(ds.closed for ds in opener.opened)
+
+
+def test_ttl(clock, opener):
+    datasources = DatasourceCache(ttl=10)
+
+    old = datasources.acquire("a", "key", opener)
+    datasources.release(old)
+    clock.now = 10
+    new = datasources.acquire("a", "key", opener)
+    assert new is not old
+    assert old.closed
+
+    # Released after the TTL, it is closed instead of reused.
+    clock.now = 20
+    datasources.release(new)
+    assert new.closed
+
+
+def test_max_idle(clock, opener):
+    datasources = DatasourceCache(max_idle=2)
+
+    leased = [datasources.acquire("a", "key", opener) for _ in range(3)]
+    for datasource in leased:
+        datasources.release(datasource)
+    assert [ds.closed for ds in leased] == [False, False, True]
+
+    # The last released is reused first.
+    assert datasources.acquire("a", "key", opener) is leased[1]
+
+
+def test_invalidate_endpoint(clock, opener):
+    datasources = DatasourceCache()
+
+    a = datasources.acquire("a", "a", opener)
+    b = datasources.acquire("b", "b", opener)
+    datasources.release(a)
+    datasources.release(b)
+
+    datasources.invalidate("a")
+    assert a.closed
+    assert not b.closed
+    assert datasources.acquire("a", "a", opener) is not a
+    assert datasources.acquire("b", "b", opener) is b
+
+
+def test_invalidate_all(clock, opener):
+    datasources = DatasourceCache()
+
+    a = datasources.acquire("a", "a", opener)
+    b = datasources.acquire("b", "b", opener)
+    datasources.release(a)
+    datasources.release(b)
+
+    datasources.invalidate()
+    assert a.closed and b.closed
+    new = datasources.acquire("a", "a", opener)
+    assert new is not a
+    # Datasources opened after invalidating are reused.
+    datasources.release(new)
+    assert datasources.acquire("a", "a", opener) is new
+
+
+@pytest.mark.parametrize("endpoint", ["a", None])
+def test_invalidated_leased_datasource_is_closed_on_release(clock, opener, endpoint):
+    datasources = DatasourceCache()
+
+    leased = datasources.acquire("a", "key", opener)
+    datasources.invalidate(endpoint)
+    assert not leased.closed
+
+    datasources.release(leased)
+    assert leased.closed
+    assert datasources.acquire("a", "key", opener) is not leased
+
+
+def test_invalidated_while_opening(clock, opener):
+    datasources = DatasourceCache()
+
+    def open():
+        # Like a layer that is created while the datasource is opened.
+        datasources.invalidate("a")
+        return opener()
+
+    datasource = datasources.acquire("a", "key", open)
+    datasources.release(datasource)
+    assert datasource.closed
+
+
+def test_release_unknown_datasource(clock):
+    datasources = DatasourceCache()
+
+    datasource = FakeDatasource("unknown")
+    datasources.release(datasource)
+    assert datasource.closed
+
+
+def test_clear(clock, opener):
+    datasources = DatasourceCache()
+
+    idle = datasources.acquire("a", "key", opener)
+    leased = datasources.acquire("a", "key", opener)
+    datasources.release(idle)
+
+    datasources.clear()
+    assert idle.closed
+    assert not leased.closed
+    datasources.release(leased)
+    assert datasources.acquire("a", "key", opener) is leased
@@ -2,10 +2,15 @@
 #
 # SPDX-License-Identifier: MIT
 
+import pytest
+
 from mercaido_client.pb.mercaido import (
     AttributeType,
     Attribute,
+    Event,
+    EventType,
     MessageBase,
+    MessageType,
     PublishJob,
     RegisterServices,
     RequestBase,
@@ -22,3 +27,178 @@ def test_init():
     RequestBase()
     ResponseBase()
     Service()
+
+
+def test_view():
+    msg = MessageBase(
+        recipient="mercaido.dispatcher",
+        request=RequestBase(
+            type=MessageType.MESSAGE_TYPE_EVENT,
+            event=Event(
+                job_id="job-1",
+                type=EventType.EVENT_TYPE_JOB_PROGRESS,
+                progress=42.5,
+            ),
+        ),
+    )
+    view = MessageBase.view(msg.serialize())
+
+    assert view.recipient == "mercaido.dispatcher"
+    assert view.request.type == MessageType.MESSAGE_TYPE_EVENT
+    assert view.request.event.job_id == "job-1"
+    assert view.request.event.type == EventType.EVENT_TYPE_JOB_PROGRESS
+    assert view.request.event.progress == 42.5
+    # Absent fields have their defaults, like parsed messages.
+    assert view.request.event.error_message == msg.request.event.error_message
+    assert view.request.register_services.services == []
+    assert not view.has("response")
+    assert view.response.success == msg.response.success
+    assert view.message().serialize() == msg.serialize()
+
+
+def test_view_repeated():
+    service = Service(
+        endpoint="mercaido.service.test",
+        attributes=[
+            Attribute(type=AttributeType.ATTRIBUTE_TYPE_TEXT, values=["a", "b"]),
+            Attribute(type=AttributeType.ATTRIBUTE_TYPE_NUMBER, id="n"),
+        ],
+    )
+    view = Service.view(service.serialize())
+
+    assert view.endpoint == "mercaido.service.test"
+    assert [a.type for a in view.attributes] == [
+        AttributeType.ATTRIBUTE_TYPE_TEXT,
+        AttributeType.ATTRIBUTE_TYPE_NUMBER,
+    ]
+    assert view.attributes[0].values == ["a", "b"]
+    assert view.attributes[1].id == "n"
+    with pytest.raises(AttributeError):
+        view.nonexistent
+
+
+def test_cached_wrappers():
+    msg = MessageBase(request=RequestBase(type=MessageType.MESSAGE_TYPE_EVENT))
+    request = msg.request
+    assert msg.request is request
+
+    msg.request = RequestBase(type=MessageType.MESSAGE_TYPE_PUBLISH_JOB)
+    assert request.type == MessageType.MESSAGE_TYPE_PUBLISH_JOB
+
+    # A cleared submessage is detached, its wrapper is not reused.
+    del msg.request
+    assert msg.request is not request
+    assert msg.request.type == MessageType.MESSAGE_TYPE_UNSPECIFIED
+
+
+def test_repeated_wrappers():
+    job = PublishJob(job_id="42", services=[Service(endpoint="a")])
+    services = job.services
+    first = services[0]
+    assert job.services is services
+    assert list(services) == [first]
+
+    job.obj.services.add(endpoint="b")
+    assert [s.endpoint for s in services] == ["a", "b"]
+    assert services[0] is first
+    assert services[-1] is services[1]
+
+    job.services = [Service(endpoint="c")]
+    assert [s.endpoint for s in job.services] == ["c"]
+    del job.services
+    assert job.services == []
+
+
+def test_attribute_lookup():
+    service = Service(
+        attributes=[
+            Attribute(type=AttributeType.ATTRIBUTE_TYPE_NUMBER, id="n", values=["2.5"]),
+            Attribute(
+                type=AttributeType.ATTRIBUTE_TYPE_BOOLEAN, id="b", values=["True"]
+            ),
+            Attribute(
+                type=AttributeType.ATTRIBUTE_TYPE_RECORDING_ID, id="r", values=["7"]
+            ),
+        ]
+    )
+    assert service.attribute("n").number() == 2.5
+    assert service.attribute("b").boolean() is True
+    assert service.attribute("r").recording_id() == 7
+    with pytest.raises(ValueError):
+        service.attribute("n").boolean()
+    with pytest.raises(KeyError):
+        service.attribute("x")
+
+    service.obj.attributes.add(type=AttributeType.ATTRIBUTE_TYPE_TEXT, id="x")
+    assert service.attribute("x").type == AttributeType.ATTRIBUTE_TYPE_TEXT
+    service.attributes = [Attribute(type=AttributeType.ATTRIBUTE_TYPE_TEXT, id="y")]
+    with pytest.raises(KeyError):
+        service.attribute("n")
+    with pytest.raises(ValueError):
+        service.attribute("y").recording_id()
+
+    # Changes in place are seen, and the last of duplicate ids wins.
+    service.attributes[0].obj.id = "z"
+    assert service.attribute("z").type == AttributeType.ATTRIBUTE_TYPE_TEXT
+    with pytest.raises(KeyError):
+        service.attribute("y")
+    service.obj.attributes.add(type=AttributeType.ATTRIBUTE_TYPE_NUMBER, id="z")
+    assert service.attribute("z").type == AttributeType.ATTRIBUTE_TYPE_NUMBER
+
+    # Same length edits of cached lookups.
+    assert service.attribute("z").type == AttributeType.ATTRIBUTE_TYPE_NUMBER
+    service.obj.attributes[0].id, service.obj.attributes[1].id = "w", "z2"
+    assert service.attribute("w").type == AttributeType.ATTRIBUTE_TYPE_TEXT
+    with pytest.raises(KeyError):
+        service.attribute("z")
+    service.obj.CopyFrom(
+        Service(
+            attributes=[
+                Attribute(type=AttributeType.ATTRIBUTE_TYPE_BOOLEAN, id="w"),
+                Attribute(type=AttributeType.ATTRIBUTE_TYPE_TEXT, id="z"),
+            ]
+        ).obj
+    )
+    assert service.attribute("w").type == AttributeType.ATTRIBUTE_TYPE_BOOLEAN
+    assert service.attribute("z").type == AttributeType.ATTRIBUTE_TYPE_TEXT
+    service.obj.MergeFrom(
+        Service(
+            attributes=[Attribute(type=AttributeType.ATTRIBUTE_TYPE_NUMBER, id="w")]
+        ).obj
+    )
+    assert service.attribute("w").type == AttributeType.ATTRIBUTE_TYPE_NUMBER
+
+
+def test_values_as_dict():
+    attr = Attribute(type=AttributeType.ATTRIBUTE_TYPE_FEATURESERVER)
+    assert attr.values_as_dict() == {}
+
+    attr.values = ["a", "1", "b", "2"]
+    values = attr.values_as_dict()
+    assert values == {"a": "1", "b": "2"}
+    values["c"] = "3"
+    assert attr.values_as_dict() == {"a": "1", "b": "2"}
+
+    attr.values.extend(["c", "3"])
+    assert attr.values_as_dict() == {"a": "1", "b": "2", "c": "3"}
+
+    attr.values[1] = "changed"
+    assert attr.values_as_dict() == {"a": "changed", "b": "2", "c": "3"}
+    attr.obj.CopyFrom(
+        Attribute(
+            type=AttributeType.ATTRIBUTE_TYPE_FEATURESERVER, values=["d", "4"]
+        ).obj
+    )
+    assert attr.values_as_dict() == {"d": "4"}
+    attr.obj.MergeFrom(
+        Attribute(
+            type=AttributeType.ATTRIBUTE_TYPE_FEATURESERVER, values=["e", "5"]
+        ).obj
+    )
+    assert attr.values_as_dict() == {"d": "4", "e": "5"}
+    attr.values[0], attr.values[2] = "e", "d"
+    assert attr.values_as_dict() == {"e": "4", "d": "5"}
+
+    attr.values = ["a"]
+    with pytest.raises(ValueError):
+        attr.values_as_dict()
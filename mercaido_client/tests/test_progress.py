@@ -0,0 +1,56 @@
+# SPDX-FileCopyrightText: 2023, 2024 Horus View and Explore B.V.
+#
+# SPDX-License-Identifier: MIT
+
+from mercaido_client.mq.progress import ProgressReporter, progress_event
+from mercaido_client.pb.mercaido import Event, EventType
+
+
+def summary(events):
+    return [
+        (
+            e.job_id,
+            e.type,
+            e.progress if e.type == EventType.EVENT_TYPE_JOB_PROGRESS else None,
+        )
+        for e in events
+    ]
+
+
+def test_progress_is_coalesced():
+    published = []
+    reporter = ProgressReporter(published.append, interval=3600, min_delta=1)
+
+    reporter.publish_event(Event(job_id="a", type=EventType.EVENT_TYPE_JOB_START))
+    for n in range(1000):
+        reporter.publish_event(progress_event("a", n / 10))
+        reporter.publish_event(progress_event("b", n / 10))
+    reporter.flush()
+    reporter.publish_event(Event(job_id="a", type=EventType.EVENT_TYPE_JOB_STOP))
+
+    start, progress, stop = (
+        EventType.EVENT_TYPE_JOB_START,
+        EventType.EVENT_TYPE_JOB_PROGRESS,
+        EventType.EVENT_TYPE_JOB_STOP,
+    )
+    assert summary(published) == [
+        ("a", start, None),
+        ("a", progress, 0.0),
+        ("b", progress, 0.0),
+        # The latest progress goes before the stop event.
+        ("a", progress, 99.9),
+        ("a", stop, None),
+    ]
+
+    reporter.finish("b")
+    assert summary(published[5:]) == [("b", progress, 99.9)]
+
+
+def test_progress_min_delta():
+    published = []
+    reporter = ProgressReporter(published.append, interval=0, min_delta=10)
+
+    for n in range(100):
+        reporter.publish_event(progress_event("a", n))
+
+    assert [e.progress for e in published] == list(range(0, 100, 10))
@@ -0,0 +1,552 @@
+# SPDX-FileCopyrightText: 2023, 2024 Horus View and Explore B.V.
+#
+# SPDX-License-Identifier: MIT
+
+import threading
+import time
+
+import pika.frame
+import pika.spec
+import pytest
+from pika.exchange_type import ExchangeType
+
+from mercaido_client.mq.client import (
+    BlockingClient,
+    ClientError,
+    DISPATCHER_QUEUE,
+    EVENT_INGRESS_EXCHANGE,
+    EVENTS_EXCHANGE,
+    EventListenerClient,
+    MAIN_EXCHANGE,
+    PublishError,
+    PublishJobClient,
+    ServiceClient,
+    declare_topology,
+)
+from mercaido_client.mq.transport import (
+    ConnectionLost,
+    InMemoryBroker,
+    InMemoryTransport,
+    PikaConnection,
+    TransportError,
+    topic_matches,
+)
+from mercaido_client.pb.mercaido import (
+    Event,
+    EventType,
+    MessageBase,
+    MessageType,
+    PublishJob,
+    RequestBase,
+    Service,
+)
+
+
+@pytest.mark.parametrize(
+    "binding_key, routing_key, expected",
+    [
+        ("mercaido.dispatcher", "mercaido.dispatcher", True),
+        ("mercaido.dispatcher", "mercaido.discovery", False),
+        ("mercaido.*", "mercaido.discovery", True),
+        ("mercaido.*", "mercaido", False),
+        ("mercaido.*", "mercaido.a.b", False),
+        ("mercaido.#", "mercaido", True),
+        ("mercaido.#", "mercaido.a.b", True),
+        ("#.b", "a.b", True),
+        ("#.b", "b", True),
+        ("a.#.c", "a.c", True),
+        ("a.#.c", "a.b.b.c", True),
+        ("a.#.c", "a.b.b", False),
+        ("#", "", True),
+    ],
+)
+def test_topic_matches(binding_key, routing_key, expected):
+    assert topic_matches(binding_key, routing_key) is expected
+
+
+def message(recipient):
+    return MessageBase(
+        recipient=recipient,
+        request=RequestBase(type=MessageType.MESSAGE_TYPE_REGISTER_SERVICES),
+    )
+
+
+def drain(client, queue, **kwargs):
+    received = []
+    with client.consume(queue, timeout=0, **kwargs) as consumer:
+        for msg, ack in consumer:
+            if msg is None:
+                break
+            received.append(msg.recipient)
+            ack.ok()
+    return received
+
+
+@pytest.fixture
+def transport():
+    return InMemoryTransport(InMemoryBroker())
+
+
+def test_main_and_broadcast_routing(transport):
+    with BlockingClient("memory://", transport) as client:
+        client.exchange(MAIN_EXCHANGE.name, MAIN_EXCHANGE.type)
+        client.exchange(EVENTS_EXCHANGE.name, EVENTS_EXCHANGE.type)
+        client.queue("dispatcher", MAIN_EXCHANGE.name, ["mercaido.dispatcher"])
+        client.queue("service", MAIN_EXCHANGE.name, ["service", "mercaido.*"])
+        client.queue("events-1", EVENTS_EXCHANGE.name, [""])
+        client.queue("events-2", EVENTS_EXCHANGE.name, [""])
+
+        client.publish(MAIN_EXCHANGE.name, "mercaido.dispatcher", message("a"))
+        client.publish(MAIN_EXCHANGE.name, "service", message("b"))
+        client.publish(MAIN_EXCHANGE.name, "unrouted", message("c"))
+        client.publish(EVENTS_EXCHANGE.name, "", message("d"))
+        client.publish("", "service", message("e"))
+
+        assert drain(client, "dispatcher") == ["a"]
+        assert drain(client, "service") == ["a", "b", "e"]
+        assert drain(client, "events-1") == ["d"]
+        assert drain(client, "events-2") == ["d"]
+
+
+def test_unknown_exchange(transport):
+    with BlockingClient("memory://", transport) as client:
+        with pytest.raises(TransportError):
+            client.publish("missing", "", message("a"))
+        client.exchange("x", ExchangeType.topic)
+        with pytest.raises(TransportError):
+            client.exchange("x", ExchangeType.fanout)
+
+
+def test_prefetch_and_requeue(transport):
+    with BlockingClient("memory://", transport) as client:
+        client.queue("q", "", [])
+        for recipient in "abc":
+            client.publish("", "q", message(recipient))
+
+        with client.consume("q", timeout=0, prefetch_count=2) as consumer:
+            received = []
+            for msg, ack in consumer:
+                if msg is None:
+                    break
+                received.append((msg.recipient, ack))
+            # Nothing is acknowledged, prefetch holds back "c".
+            assert [r for r, _ in received] == ["a", "b"]
+            received[1][1].cancel()
+            client.process_data_events()
+            assert transport.broker.message_count("q") == 2
+
+    # Unacknowledged messages return when the connection closes.
+    assert transport.broker.message_count("q") == 3
+    with BlockingClient("memory://", transport) as client:
+        assert drain(client, "q") == ["a", "b", "c"]
+
+
+def test_consume_closes_its_channel(transport):
+    def open_channels(client):
+        return [c for c in client._state.connection._channels if c.is_open]
+
+    with BlockingClient("memory://", transport, reconnect=True) as client:
+        client.queue("q", "", [])
+        before = len(open_channels(client))
+        for recipient in "abc":
+            client.publish("", "q", message(recipient))
+            assert drain(client, "q") == [recipient]
+        assert len(open_channels(client)) == before
+
+        # Not acknowledged, the message is returned to the queue.
+        client.publish("", "q", message("d"))
+        with client.consume("q", timeout=0) as consumer:
+            msg, ack = next(consumer)
+        assert len(open_channels(client)) == before
+        assert transport.broker.message_count("q") == 1
+
+        # Also the channel that replaces one of a lost connection.
+        with client.consume("q", timeout=0) as consumer:
+            transport.broker.restart()
+            msg, ack = next(consumer)
+            assert msg.recipient == "d"
+            ack.ok()
+        assert len(open_channels(client)) == before
+        assert transport.broker.message_count("q") == 0
+
+
+def test_acks_from_other_threads(transport):
+    with BlockingClient("memory://", transport) as client:
+        client.queue("q", "", [])
+        for n in range(10):
+            client.publish("", "q", message(str(n)))
+
+        received = []
+        with client.consume("q", timeout=0.5, prefetch_count=1) as consumer:
+            for msg, ack in consumer:
+                if msg is None:
+                    break
+                received.append(msg.recipient)
+                threading.Thread(target=ack.ok).start()
+
+    assert received == [str(n) for n in range(10)]
+    assert transport.broker.message_count("q") == 0
+
+
+def test_memory_url_shares_broker():
+    with (
+        BlockingClient("memory://test-shared") as client,
+        EventListenerClient("memory://test-shared") as listener,
+    ):
+        client.exchange(EVENTS_EXCHANGE.name, EVENTS_EXCHANGE.type)
+        with listener.consume(timeout=0) as consumer:
+            client.publish(EVENTS_EXCHANGE.name, "", message("a"))
+            msg, ack = next(consumer)
+            assert msg.recipient == "a"
+            ack.ok()
+
+
+def test_publisher_confirms(transport):
+    with BlockingClient("memory://", transport, confirms=True) as client:
+        client.queue("q", "", [])
+        for recipient in "abc":
+            client.publish("", "q", message(recipient), persistent=True)
+        client.wait_for_confirms(timeout=1)
+
+        for recipient in "def":
+            client.publish("", "q", message(recipient))
+        # Pretend the broker rejected the second message of this window.
+        client._on_confirm(5, False, False)
+        with pytest.raises(PublishError) as excinfo:
+            client.wait_for_confirms(timeout=1)
+        assert [m.recipient for m in excinfo.value.nacked] == ["e"]
+        assert excinfo.value.unconfirmed == []
+
+        # Windows are independent.
+        client.publish("", "q", message("g"))
+        client.wait_for_confirms(timeout=1)
+
+
+class FakeBlockingConnection:
+    """The parts of pika's BlockingConnection used by the pika transport.
+
+    Its channels confirm everything published since the previous round
+    of I/O with a single multiple ack. Messages in `rejected` are nacked.
+    """
+
+    def __init__(self, rejected):
+        self.is_open = True
+        self.rejected = rejected
+        self.io_rounds = 0
+        self.channels = []
+
+    def add_on_connection_blocked_callback(self, callback):
+        pass
+
+    def add_on_connection_unblocked_callback(self, callback):
+        pass
+
+    def channel(self):
+        channel = FakeBlockingChannel(self)
+        self.channels.append(channel)
+        return channel
+
+    def process_data_events(self, time_limit=0):
+        self.io_rounds += 1
+        for channel in self.channels:
+            channel.confirm()
+
+    def close(self):
+        self.is_open = False
+
+
+class FakeBlockingChannel:
+    def __init__(self, connection):
+        self.connection = connection
+        self.is_open = True
+        # Confirms are enabled on the underlying channel.
+        self._impl = self
+        self.on_ack_nack = None
+        self.on_select_ok = None
+        self.published = []
+        self.confirmed = 0
+
+    def add_on_return_callback(self, callback):
+        pass
+
+    def confirm_delivery(self, ack_nack_callback, callback):
+        self.on_ack_nack = ack_nack_callback
+        self.on_select_ok = callback
+
+    def basic_publish(self, exchange, routing_key, body, properties=None):
+        self.published.append(body)
+
+    def confirm(self):
+        if self.on_select_ok is not None:
+            self.on_select_ok(pika.frame.Method(1, pika.spec.Confirm.SelectOk()))
+            self.on_select_ok = None
+        if self.on_ack_nack is None or self.confirmed == len(self.published):
+            return
+        for tag in range(self.confirmed + 1, len(self.published) + 1):
+            if self.published[tag - 1] in self.connection.rejected:
+                method = pika.spec.Basic.Nack(delivery_tag=tag)
+                self.on_ack_nack(pika.frame.Method(1, method))
+        self.confirmed = len(self.published)
+        method = pika.spec.Basic.Ack(delivery_tag=self.confirmed, multiple=True)
+        self.on_ack_nack(pika.frame.Method(1, method))
+
+    def close(self):
+        self.is_open = False
+
+
+class FakePikaTransport:
+    def __init__(self, rejected=()):
+        self.connection = FakeBlockingConnection(set(rejected))
+
+    def connect(self):
+        return PikaConnection(self.connection)
+
+
+def test_pika_publisher_confirms():
+    transport = FakePikaTransport(rejected={message("e").serialize()})
+    with BlockingClient("amqp://", transport, confirms=True) as client:
+        io_rounds = transport.connection.io_rounds
+        for recipient in "abc":
+            client.publish("", "q", message(recipient))
+        # All messages are in flight, publishing did not wait for them.
+        assert len(client._unconfirmed) == 3
+        assert transport.connection.io_rounds == io_rounds
+
+        client.wait_for_confirms(timeout=1)
+        assert transport.connection.io_rounds == io_rounds + 1
+
+        for recipient in "def":
+            client.publish("", "q", message(recipient))
+        with pytest.raises(PublishError) as excinfo:
+            client.wait_for_confirms(timeout=1)
+        assert [m.recipient for m in excinfo.value.nacked] == ["e"]
+        assert excinfo.value.unconfirmed == []
+
+
+def test_service_client_runs_jobs_concurrently(transport):
+    service = Service(endpoint="mercaido.service.test", name="test")
+    running = 0
+    max_running = 0
+    done = []
+    lock = threading.Lock()
+
+    with BlockingClient("memory://", transport) as client:
+        client.exchange(MAIN_EXCHANGE.name, MAIN_EXCHANGE.type)
+
+    service_client = ServiceClient(service, "memory://", transport, concurrency=3)
+
+    def handler(job):
+        nonlocal running, max_running
+        with lock:
+            running += 1
+            max_running = max(max_running, running)
+        time.sleep(0.05)
+        with lock:
+            running -= 1
+            done.append(job.job_id)
+            if len(done) == 9:
+                service_client.stop()
+        if job.job_id == "job-0":
+            raise RuntimeError("failed")
+
+    with service_client:
+        service_client.register()
+        with PublishJobClient("memory://", transport) as publisher:
+            for n in range(9):
+                publisher.publish(service.endpoint, PublishJob(job_id=f"job-{n}"))
+        service_client.serve(handler)
+
+    assert max_running == 3
+    assert sorted(done) == [f"job-{n}" for n in range(9)]
+    # All jobs are acknowledged, the failed one is not requeued.
+    assert transport.broker.message_count(service.endpoint) == 0
+
+
+def test_reconnect_after_broker_restart(transport):
+    with BlockingClient("memory://", transport, reconnect=True) as client:
+        client.exchange(MAIN_EXCHANGE.name, MAIN_EXCHANGE.type)
+        client.queue("durable", MAIN_EXCHANGE.name, ["durable"])
+        client.queue("transient", MAIN_EXCHANGE.name, ["transient"], durable=False)
+        for recipient in "ab":
+            client.publish(MAIN_EXCHANGE.name, "durable", message(recipient))
+
+        received = []
+        with client.consume("durable", timeout=0) as consumer:
+            for msg, ack in consumer:
+                if msg is None:
+                    break
+                received.append(msg.recipient)
+                if len(received) == 1:
+                    # "a" is not acknowledged and delivered again.
+                    transport.broker.restart()
+                else:
+                    ack.ok()
+        assert received == ["a", "a", "b"]
+
+        # The transient queue is declared again after reconnecting.
+        client.publish(MAIN_EXCHANGE.name, "transient", message("c"))
+        assert drain(client, "transient") == ["c"]
+
+        transport.broker.restart()
+        client.process_data_events()
+        client.publish(MAIN_EXCHANGE.name, "transient", message("d"))
+        assert drain(client, "transient") == ["d"]
+
+    assert client.metrics.disconnects == 2
+    assert client.metrics.reconnects == 2
+    assert client.metrics.reconnect_attempts == 2
+
+
+def test_no_reconnect_by_default(transport):
+    with BlockingClient("memory://", transport) as client:
+        client.queue("q", "", [])
+        transport.broker.restart()
+        with pytest.raises(ConnectionLost):
+            client.publish("", "q", message("a"))
+
+
+def test_service_client_does_io_while_consumer_is_busy(transport):
+    service = Service(endpoint="mercaido.service.test", name="test")
+
+    with BlockingClient("memory://", transport) as client:
+        declare_topology(client)
+        client.queue("events", EVENTS_EXCHANGE.name, [""])
+
+    with ServiceClient(service, "memory://", transport) as service_client:
+        service_client.register()
+        with PublishJobClient("memory://", transport) as publisher:
+            publisher.publish(service.endpoint, PublishJob(job_id="job-0"))
+
+        with service_client.consume(timeout=1) as consumer:
+            msg, ack = next(consumer)
+            assert msg.request.publish_job.job_id == "job-0"
+            service_client.publish_event(
+                Event(job_id="job-0", type=EventType.EVENT_TYPE_JOB_START)
+            )
+            ack.ok()
+            # Without advancing the consumer, the I/O thread sends both.
+            deadline = time.monotonic() + 1
+            while not transport.broker.message_count("events"):
+                assert time.monotonic() < deadline
+                time.sleep(0.01)
+
+    assert transport.broker.message_count(service.endpoint) == 0
+
+
+def test_service_client_declares_topology(transport):
+    service = Service(endpoint="mercaido.service.test", name="test")
+
+    # Nothing is declared on the broker before the service starts.
+    with ServiceClient(service, "memory://", transport) as service_client:
+        service_client.publish_event(
+            Event(job_id="job-0", type=EventType.EVENT_TYPE_JOB_START)
+        )
+        deadline = time.monotonic() + 1
+        while not transport.broker.message_count(DISPATCHER_QUEUE.name):
+            assert time.monotonic() < deadline
+            time.sleep(0.01)
+
+
+def test_service_client_logs_failed_events(transport, caplog):
+    service = Service(endpoint="mercaido.service.test", name="test")
+
+    with ServiceClient(service, "memory://", transport) as service_client:
+
+        def publish(*args):
+            raise TransportError("not routed")
+
+        service_client._client.publish = publish
+        service_client.publish_event(
+            Event(job_id="job-0", type=EventType.EVENT_TYPE_JOB_START)
+        )
+        deadline = time.monotonic() + 1
+        while "failed to publish event" not in caplog.text:
+            assert time.monotonic() < deadline
+            time.sleep(0.01)
+
+
+def test_service_client_publishes_across_reconnect(transport):
+    service = Service(endpoint="mercaido.service.test", name="test")
+
+    with BlockingClient("memory://", transport) as client:
+        declare_topology(client)
+        client.queue("events", EVENTS_EXCHANGE.name, [""])
+
+    service_client = ServiceClient(service, "memory://", transport)
+
+    def handler(job):
+        for event_type in (
+            EventType.EVENT_TYPE_JOB_START,
+            EventType.EVENT_TYPE_JOB_STOP,
+        ):
+            service_client.publish_event(Event(job_id=job.job_id, type=event_type))
+            # The I/O thread reconnects while the job is publishing.
+            transport.broker.restart()
+        service_client.stop()
+
+    with service_client:
+        service_client.register()
+        with PublishJobClient("memory://", transport) as publisher:
+            publisher.publish(service.endpoint, PublishJob(job_id="job-0"))
+        service_client.serve(handler)
+
+    received = []
+    with BlockingClient("memory://", transport) as client:
+        with client.consume("events", timeout=0) as consumer:
+            for msg, ack in consumer:
+                if msg is None:
+                    break
+                received.append(msg.request.event.type)
+                ack.ok()
+    assert received == [EventType.EVENT_TYPE_JOB_START, EventType.EVENT_TYPE_JOB_STOP]
+    assert service_client._client.metrics.reconnects >= 1
+
+
+def test_service_client_fails_calls_when_connection_is_lost(transport):
+    service = Service(endpoint="mercaido.service.test", name="test")
+
+    running = threading.Event()
+    release = threading.Event()
+
+    def block():
+        running.set()
+        release.wait(1)
+
+    with ServiceClient(service, "memory://", transport, reconnect=False) as client:
+        blocked = client._call(block)
+        assert running.wait(1)
+        transport.broker.restart()
+        # Queued while the I/O thread is busy, it then finds the
+        # connection lost.
+        pending = client._call(lambda: None)
+        release.set()
+        blocked.result(timeout=1)
+        with pytest.raises(ClientError):
+            pending.result(timeout=1)
+        with pytest.raises(ClientError):
+            client._call(lambda: None)
+
+
+def test_exchange_to_exchange_bindings(transport):
+    with BlockingClient("memory://", transport, reconnect=True) as client:
+        declare_topology(client)
+        client.queue("events", EVENTS_EXCHANGE.name, [""])
+        client.exchange("a", ExchangeType.topic)
+        client.exchange_bind("a", MAIN_EXCHANGE.name, ["x.*"])
+        # Cycles do not route a message twice.
+        client.exchange_bind(MAIN_EXCHANGE.name, "a", ["#"])
+        client.queue("from-a", "a", ["#"])
+
+        client.publish(EVENT_INGRESS_EXCHANGE.name, "", message("event"))
+        client.publish(MAIN_EXCHANGE.name, "x.y", message("x"))
+        client.publish(MAIN_EXCHANGE.name, "z", message("z"))
+
+        assert drain(client, "mercaido.dispatcher") == ["event"]
+        assert drain(client, "events") == ["event"]
+        assert drain(client, "from-a") == ["x"]
+
+        # Bindings between durable exchanges survive a restart.
+        transport.broker.restart()
+        client.publish(EVENT_INGRESS_EXCHANGE.name, "", message("event"))
+        assert drain(client, "mercaido.dispatcher") == ["event"]
+        assert drain(client, "events") == ["event"]
@@ -0,0 +1,322 @@
+# SPDX-FileCopyrightText: 2023, 2024 Horus View and Explore B.V.
+#
+# SPDX-License-Identifier: MIT
+
+"""Throughput benchmarks for the dispatcher.
+
+Runs the dispatcher against the in-memory transport and a temporary
+SQLite database, so no RabbitMQ server or network is needed. Messages
+still go through `BlockingClient`: publishing, routing, decoding and
+acknowledging.
+
+Usage::
+
+    python benchmarks/bench_dispatcher.py
+    python benchmarks/bench_dispatcher.py progress-flood --batch-size 100 --workers 4
+
+For every scenario the following is reported:
+
+- msgs/s: messages acknowledged per second, from first delivery to
+  last acknowledgement.
+- p50/p99: time between delivering a message to the dispatcher and
+  its acknowledgement.
+- writes: INSERT/UPDATE statements and commits sent to the database.
+"""
+
+import argparse
+import logging
+import statistics
+import tempfile
+import time
+from collections.abc import Iterator
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Optional
+
+import sqlalchemy as sa
+
+from mercaido_client.mq.client import (
+    BlockingClient,
+    DISPATCHER_QUEUE,
+    DISPATCHER_ROUTING_KEY,
+    MAIN_EXCHANGE,
+)
+from mercaido_client.mq.transport import (
+    InMemoryBroker,
+    InMemoryChannel,
+    InMemoryConnection,
+    InMemoryTransport,
+)
+from mercaido_client.pb.mercaido import (
+    Event,
+    EventType,
+    MessageBase,
+    MessageType,
+    RegisterServices,
+    RequestBase,
+    Service,
+)
+
+from mercaido_server import models
+from mercaido_server.dispatcher import Dispatcher
+from mercaido_server.testing_utils import create_tables
+
+
+@dataclass
+class Timings:
+    latencies: list[float] = field(default_factory=list)
+    rejected: int = 0
+    first_delivery: Optional[float] = None
+    last_ack: Optional[float] = None
+
+
+class TimedChannel(InMemoryChannel):
+    """Records the time between delivering a message and settling it.
+
+    Consuming stops once the queue is empty and every delivered message
+    has been settled.
+    """
+
+    def __init__(self, connection, broker, timings: Timings) -> None:
+        super().__init__(connection, broker)
+        self._timings = timings
+        self._delivered_at: dict[int, float] = {}
+
+    def consume(self, queue, inactivity_timeout=None):
+        for delivery in super().consume(queue, inactivity_timeout):
+            if delivery is not None:
+                now = time.perf_counter()
+                if self._timings.first_delivery is None:
+                    self._timings.first_delivery = now
+                self._delivered_at[delivery.delivery_tag] = now
+            elif not self._unacked and not self._broker.message_count(queue):
+                return
+            yield delivery
+
+    def basic_nack(self, delivery_tag, multiple=False, requeue=True):
+        # Requeueing would deliver rejected messages forever.
+        self._timings.rejected += 1
+        super().basic_nack(delivery_tag, multiple, requeue=False)
+
+    def _settle(self, delivery_tag, multiple):
+        settled = super()._settle(delivery_tag, multiple)
+        now = time.perf_counter()
+        for tag, _ in settled:
+            self._timings.latencies.append(now - self._delivered_at.pop(tag))
+        self._timings.last_ack = now
+        return settled
+
+
+class TimedConnection(InMemoryConnection):
+    def __init__(self, broker: InMemoryBroker, timings: Timings) -> None:
+        super().__init__(broker)
+        self._timings = timings
+
+    def channel(self) -> TimedChannel:
+        return TimedChannel(self, self._broker, self._timings)
+
+
+class TimedTransport(InMemoryTransport):
+    def __init__(self, broker: InMemoryBroker) -> None:
+        super().__init__(broker)
+        self.timings = Timings()
+
+    def connect(self) -> TimedConnection:
+        return TimedConnection(self._broker, self.timings)
+
+
+def register_message(endpoint: str) -> MessageBase:
+    return MessageBase(
+        request=RequestBase(
+            type=MessageType.MESSAGE_TYPE_REGISTER_SERVICES,
+            register_services=RegisterServices(
+                services=[Service(endpoint=endpoint, name=endpoint)]
+            ),
+        )
+    )
+
+
+def event_message(job_id: str, typ: EventType, **kwargs) -> MessageBase:
+    return MessageBase(
+        request=RequestBase(
+            type=MessageType.MESSAGE_TYPE_EVENT,
+            event=Event(job_id=job_id, type=typ, **kwargs),
+        )
+    )
+
+
+def job_ids(jobs: int) -> list[str]:
+    return [f"job-{n}" for n in range(jobs)]
+
+
+def register_storm(messages: int, jobs: int) -> Iterator[MessageBase]:
+    """Services re-registering, for example after a broker restart."""
+    for n in range(messages):
+        yield register_message(f"mercaido.service.bench-{n % 50}")
+
+
+def progress_flood(messages: int, jobs: int) -> Iterator[MessageBase]:
+    """Concurrent jobs reporting progress as fast as they can."""
+    ids = job_ids(jobs)
+    for job_id in ids:
+        yield event_message(job_id, EventType.EVENT_TYPE_JOB_START)
+    for n in range(messages - 2 * jobs):
+        yield event_message(
+            ids[n % jobs], EventType.EVENT_TYPE_JOB_PROGRESS, progress=float(n)
+        )
+    for job_id in ids:
+        yield event_message(job_id, EventType.EVENT_TYPE_JOB_STOP)
+
+
+def mixed_lifecycle(messages: int, jobs: int) -> Iterator[MessageBase]:
+    """Jobs starting, progressing and finishing, with registrations."""
+    ids = job_ids(jobs)
+    per_job = max(messages // jobs, 3)
+    for n, job_id in enumerate(ids):
+        yield register_message(f"mercaido.service.bench-{n % 5}")
+        yield event_message(job_id, EventType.EVENT_TYPE_JOB_START)
+        for p in range(per_job - 3):
+            yield event_message(
+                job_id, EventType.EVENT_TYPE_JOB_PROGRESS, progress=100 * p / per_job
+            )
+        if n % 10 == 0:
+            yield event_message(
+                job_id, EventType.EVENT_TYPE_JOB_ERROR, error_message="failed"
+            )
+        else:
+            yield event_message(job_id, EventType.EVENT_TYPE_JOB_STOP)
+
+
+SCENARIOS = {
+    "register-storm": register_storm,
+    "progress-flood": progress_flood,
+    "mixed-lifecycle": mixed_lifecycle,
+}
+
+
+@dataclass
+class Result:
+    scenario: str
+    messages: int
+    rejected: int
+    publish_rate: float
+    rate: float
+    latencies: list[float] = field(repr=False)
+    statements: int
+    commits: int
+
+    def __str__(self) -> str:
+        p50 = statistics.median(self.latencies) * 1000
+        p99 = statistics.quantiles(self.latencies, n=100)[98] * 1000
+        return (
+            f"{self.scenario:<16} {self.messages:>7} msgs "
+            f"{self.rate:>9.0f} msgs/s  p50 {p50:>7.2f} ms  p99 {p99:>7.2f} ms  "
+            f"{self.statements:>6} writes  {self.commits:>5} commits  "
+            f"{self.rejected} rejected  (publish {self.publish_rate:.0f} msgs/s)"
+        )
+
+
+def run(
+    scenario: str,
+    messages: int,
+    jobs: int,
+    db_dir: Path,
+    **options,
+) -> Result:
+    db_url = f"sqlite:///{db_dir / scenario}.sqlite"
+    dispatcher = Dispatcher("amqp://localhost", db_url, **options)
+    create_tables(dispatcher._db)
+    with dispatcher._db.begin() as db:
+        db.execute(
+            sa.insert(models.Job),
+            [
+                {"id": job_id, "service_id": "bench", "attributes": {}}
+                for job_id in job_ids(jobs)
+            ],
+        )
+
+    transport = TimedTransport(InMemoryBroker())
+    dispatcher._mq = BlockingClient("memory://", transport)
+
+    with BlockingClient("memory://", transport) as publisher:
+        publisher.exchange(MAIN_EXCHANGE.name, MAIN_EXCHANGE.type)
+        publisher.queue(
+            DISPATCHER_QUEUE.name,
+            DISPATCHER_QUEUE.exchange,
+            DISPATCHER_QUEUE.binding_keys,
+        )
+        stream = list(SCENARIOS[scenario](messages, jobs))
+        start = time.perf_counter()
+        for msg in stream:
+            publisher.publish(MAIN_EXCHANGE.name, DISPATCHER_ROUTING_KEY, msg)
+        publish_rate = len(stream) / (time.perf_counter() - start)
+
+    counts = {"statements": 0, "commits": 0}
+
+    def count_statement(conn, cursor, statement, parameters, context, executemany):
+        if statement.startswith(("INSERT", "UPDATE")):
+            counts["statements"] += 1
+
+    def count_commit(conn):
+        counts["commits"] += 1
+
+    sa.event.listen(dispatcher._db, "before_cursor_execute", count_statement)
+    sa.event.listen(dispatcher._db, "commit", count_commit)
+
+    dispatcher.run()
+
+    timings = transport.timings
+    assert timings.first_delivery is not None and timings.last_ack is not None
+    return Result(
+        scenario=scenario,
+        messages=len(stream),
+        rejected=timings.rejected,
+        publish_rate=publish_rate,
+        rate=len(stream) / (timings.last_ack - timings.first_delivery),
+        latencies=timings.latencies,
+        **counts,
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "scenarios",
+        nargs="*",
+        metavar="scenario",
+        help=f"scenarios to run: {', '.join(SCENARIOS)} (default: all)",
+    )
+    parser.add_argument("--messages", type=int, default=10_000)
+    parser.add_argument("--jobs", type=int, default=100)
+    parser.add_argument("--batch-size", type=int, default=Dispatcher.DEFAULT_BATCH_SIZE)
+    parser.add_argument(
+        "--batch-window", type=float, default=Dispatcher.DEFAULT_BATCH_WINDOW
+    )
+    parser.add_argument("--prefetch", type=int, default=None)
+    parser.add_argument("--workers", type=int, default=0)
+    parser.add_argument("--progress-interval", type=float, default=1.0)
+    args = parser.parse_args()
+    for scenario in args.scenarios:
+        if scenario not in SCENARIOS:
+            parser.error(f"unknown scenario: {scenario}")
+
+    logging.basicConfig(level=logging.WARNING)
+
+    with tempfile.TemporaryDirectory() as db_dir:
+        for scenario in args.scenarios or SCENARIOS:
+            result = run(
+                scenario,
+                args.messages,
+                args.jobs,
+                Path(db_dir),
+                batch_size=args.batch_size,
+                batch_window=args.batch_window,
+                prefetch=args.prefetch,
+                workers=args.workers,
+                progress_interval=args.progress_interval,
+            )
+            print(result)
+
+
+if __name__ == "__main__":
+    main()
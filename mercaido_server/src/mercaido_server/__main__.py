@@ -13,16 +13,11 @@ from pika.exchange_type import ExchangeType
 from pyramid.paster import get_appsettings, setup_logging
 from sqlalchemy import engine_from_config
 
-from mercaido_client.mq.client import (
-    BlockingClient,
-    MAIN_EXCHANGE,
-    EVENTS_EXCHANGE,
-    DISPATCHER_QUEUE,
-)
+from mercaido_client.mq.client import BlockingClient, declare_topology
 
 from .attrs import AttrDict
 from .models.meta import Base as BaseModel
-from .dispatcher import Dispatcher
+from .dispatcher import Dispatcher, ProgressCoalescer
 
 
 def main():
@@ -65,6 +60,18 @@ def parse_cli_arguments(args: list[str]) -> argparse.Namespace:
     dispatcher_parser = subparsers.add_parser("dispatcher", help="Run dispatcher process.")
     dispatcher_parser.set_defaults(func=dispatcher_command)
 
+    event_server_parser = subparsers.add_parser(
+        "event-server",
+        help="Run the asynchronous job event stream server (requires uvicorn).",
+    )
+    event_server_parser.add_argument(
+        "--host", default="127.0.0.1", help="address to listen on."
+    )
+    event_server_parser.add_argument(
+        "--port", type=int, default=3001, help="port to listen on."
+    )
+    event_server_parser.set_defaults(func=event_server_command)
+
     parsed_args = parser.parse_args(args)
 
     return parsed_args
@@ -99,27 +106,31 @@ def message_queue_migrate(ctx: AttrDict) -> None:
     # migration manually here, I guess.
 
     with BlockingClient(ctx.settings["amqp.url"]) as client:
-        client.exchange(
-            MAIN_EXCHANGE.name,
-            MAIN_EXCHANGE.type,
-            MAIN_EXCHANGE.durable,
-        )
-        client.exchange(
-            EVENTS_EXCHANGE.name,
-            EVENTS_EXCHANGE.type,
-            EVENTS_EXCHANGE.durable,
-        )
-        client.queue(
-            DISPATCHER_QUEUE.name,
-            DISPATCHER_QUEUE.exchange,
-            binding_keys=DISPATCHER_QUEUE.binding_keys,
-        )
+        # Declaring is idempotent, this also adds exchanges and bindings
+        # introduced since the last run.
+        declare_topology(client)
 
 
 def dispatcher_command(ctx: AttrDict) -> None:
+    settings = ctx.settings
+    prefetch = settings.get("dispatcher.prefetch")
     dispatcher = Dispatcher(
-        ctx.settings["amqp.url"],
-        ctx.settings["sqlalchemy.url"],
+        settings["amqp.url"],
+        settings["sqlalchemy.url"],
+        batch_size=int(
+            settings.get("dispatcher.batch_size", Dispatcher.DEFAULT_BATCH_SIZE)
+        ),
+        batch_window=float(
+            settings.get("dispatcher.batch_window", Dispatcher.DEFAULT_BATCH_WINDOW)
+        ),
+        prefetch=int(prefetch) if prefetch else None,
+        progress_interval=float(
+            settings.get(
+                "dispatcher.progress_interval",
+                ProgressCoalescer.DEFAULT_INTERVAL,
+            )
+        ),
+        workers=int(settings.get("dispatcher.workers", 0)),
     )
 
     try:
@@ -128,5 +139,21 @@ def dispatcher_command(ctx: AttrDict) -> None:
         dispatcher.stop()
 
 
+def event_server_command(ctx: AttrDict) -> None:
+    try:
+        import uvicorn
+    except ImportError:
+        raise CommandError("the event server requires uvicorn: pip install uvicorn")
+
+    from .asgi import make_app
+
+    uvicorn.run(
+        make_app(ctx.settings),
+        host=ctx.args.host,
+        port=ctx.args.port,
+        log_config=None,  # Logging is set up from the configuration file.
+    )
+
+
 if __name__ == "__main__":
     main()
@@ -0,0 +1,296 @@
+# SPDX-FileCopyrightText: 2023, 2024 Horus View and Explore B.V.
+#
+# SPDX-License-Identifier: MIT
+
+"""ASGI application serving the job event stream.
+
+The WSGI view at ``/events/job`` occupies one worker thread per
+connected browser. This application serves the same stream from an
+asyncio event loop, so one process can keep thousands of clients
+connected. Run it next to the web application, for example with::
+
+    python -m mercaido_server --config production.ini event-server
+
+and route ``/events/job`` to it, or set ``events.url`` so the browser
+connects to it directly.
+"""
+
+import asyncio
+import json
+import logging
+from datetime import datetime, timezone
+from functools import partial
+from typing import Any, ClassVar, Optional
+
+from pyramid.interfaces import ISettings
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from mercaido_client.mq.client import EventListenerClient
+
+from . import models
+from .events import EventHub, EventMessage, Subscription
+from .sse import SSE, job_event
+
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncSubscription:
+    """A bounded per-client buffer of translated SSE events.
+
+    Like `Subscription`, the oldest event is dropped when the client
+    does not keep up and the client is told to reload the job list.
+    """
+
+    _queue: asyncio.Queue[tuple[str, Any]]
+    dropped: bool
+
+    def __init__(self, maxsize: int) -> None:
+        self._queue = asyncio.Queue(maxsize)
+        self.dropped = False
+
+    def deliver(self, item: tuple[str, Any]) -> None:
+        if self._queue.full():
+            self._queue.get_nowait()
+            self.dropped = True
+        self._queue.put_nowait(item)
+
+    async def get(self, timeout: float) -> Optional[tuple[str, Any]]:
+        try:
+            return await asyncio.wait_for(self._queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+
+class LoopBridge:
+    """Moves messages from the event hub thread onto the event loop.
+
+    Every broadcast message is translated once, including the database
+    lookup for started jobs, and then fanned out to all clients.
+    """
+
+    _loop: asyncio.AbstractEventLoop
+    _incoming: asyncio.Queue[EventMessage]
+    _clients: set[AsyncSubscription]
+
+    def __init__(self, loop: asyncio.AbstractEventLoop, load_job, maxsize: int):
+        self._loop = loop
+        self._load_job = load_job
+        self._incoming = asyncio.Queue(maxsize)
+        self._clients = set()
+
+    def deliver(self, msg: EventMessage) -> None:
+        # Called from the event hub thread.
+        self._loop.call_soon_threadsafe(self._enqueue, msg)
+
+    def _enqueue(self, msg: EventMessage) -> None:
+        if self._incoming.full():
+            self._incoming.get_nowait()
+            logger.warning("event loop is not keeping up, dropped an event")
+        self._incoming.put_nowait(msg)
+
+    def add(self, client: AsyncSubscription) -> None:
+        self._clients.add(client)
+
+    def remove(self, client: AsyncSubscription) -> None:
+        self._clients.discard(client)
+
+    async def run(self) -> None:
+        while True:
+            msg = await self._incoming.get()
+            # Missing messages are read as empty ones, without a job ID.
+            event = msg.request.event
+            if not event.job_id:
+                logger.error(f"incomplete event message: {msg!r}")
+                continue
+
+            try:
+                translated = await self._loop.run_in_executor(
+                    None, job_event, event, self._load_job
+                )
+            except Exception:
+                logger.exception(f"failed to translate event: {event!r}")
+                continue
+            if translated is None:
+                continue
+
+            # Serialize once for all clients.
+            name, data = translated
+            item = (name, json.dumps(data))
+            for client in list(self._clients):
+                client.deliver(item)
+
+
+class JobEventStreamApp:
+    PATH: ClassVar[str] = "/events/job"
+    DEFAULT_HEARTBEAT_INTERVAL: ClassVar[float] = 15.0
+
+    _hub: EventHub
+    _session_factory: Any
+    _bridge: Optional[LoopBridge]
+    _bridge_task: Optional[asyncio.Task]
+
+    def __init__(
+        self,
+        hub: EventHub,
+        session_factory,
+        heartbeat_interval: float = DEFAULT_HEARTBEAT_INTERVAL,
+        buffer_size: int = Subscription.DEFAULT_MAXSIZE,
+        cors_origin: Optional[str] = None,
+    ) -> None:
+        self._hub = hub
+        self._session_factory = session_factory
+        self._heartbeat_interval = heartbeat_interval
+        self._buffer_size = buffer_size
+        self._cors_origin = cors_origin
+        self._bridge = None
+        self._bridge_task = None
+
+    async def __call__(self, scope, receive, send) -> None:
+        match scope["type"]:
+            case "lifespan":
+                await self._lifespan(receive, send)
+            case "http":
+                if scope["path"] != self.PATH or scope["method"] != "GET":
+                    await self._not_found(send)
+                else:
+                    await self._stream(receive, send)
+
+    async def _lifespan(self, receive, send) -> None:
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                self._start()
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                await self._shutdown()
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    def _start(self) -> LoopBridge:
+        if self._bridge is None:
+            loop = asyncio.get_running_loop()
+            self._bridge = LoopBridge(loop, self._load_job, self._buffer_size)
+            self._bridge_task = loop.create_task(self._bridge.run())
+            self._hub.add(self._bridge)
+        return self._bridge
+
+    async def _shutdown(self) -> None:
+        if self._bridge is not None:
+            self._hub.unsubscribe(self._bridge)
+            self._bridge = None
+        if self._bridge_task is not None:
+            self._bridge_task.cancel()
+            self._bridge_task = None
+        await asyncio.get_running_loop().run_in_executor(None, self._hub.stop)
+
+    async def _not_found(self, send) -> None:
+        await send(
+            {
+                "type": "http.response.start",
+                "status": 404,
+                "headers": [(b"content-type", b"text/plain")],
+            }
+        )
+        await send({"type": "http.response.body", "body": b"Not Found"})
+
+    async def _stream(self, receive, send) -> None:
+        # Servers without lifespan support start the bridge lazily.
+        bridge = self._start()
+        loop = asyncio.get_running_loop()
+        client = AsyncSubscription(self._buffer_size)
+        bridge.add(client)
+
+        async def watch_disconnect():
+            while (await receive())["type"] != "http.disconnect":
+                pass
+
+        disconnected = loop.create_task(watch_disconnect())
+
+        try:
+            jobs = await loop.run_in_executor(None, self._load_jobs)
+            headers = [
+                (b"content-type", b"text/event-stream"),
+                (b"cache-control", b"no-cache"),
+            ]
+            if self._cors_origin:
+                headers.append(
+                    (b"access-control-allow-origin", self._cors_origin.encode())
+                )
+            await send(
+                {"type": "http.response.start", "status": 200, "headers": headers}
+            )
+
+            sse = SSE()
+            await self._send(send, sse.retry(100))
+            await self._send(send, sse.event("job-list", jobs))
+
+            while not disconnected.done():
+                getter = loop.create_task(client.get(self._heartbeat_interval))
+                await asyncio.wait(
+                    [getter, disconnected], return_when=asyncio.FIRST_COMPLETED
+                )
+                if disconnected.done():
+                    getter.cancel()
+                    break
+
+                if client.dropped:
+                    client.dropped = False
+                    jobs = await loop.run_in_executor(None, self._load_jobs)
+                    await self._send(send, sse.event("job-list", jobs))
+
+                if (item := getter.result()) is None:
+                    timestamp = datetime.now(timezone.utc).isoformat()
+                    await self._send(
+                        send, sse.event("job-ping", {"timestamp": timestamp})
+                    )
+                else:
+                    await self._send(send, sse.event(*item))
+        except OSError:
+            pass  # Client went away while sending.
+        finally:
+            bridge.remove(client)
+            disconnected.cancel()
+
+    @staticmethod
+    async def _send(send, chunk: bytes) -> None:
+        await send({"type": "http.response.body", "body": chunk, "more_body": True})
+
+    def _load_job(self, job_id: str) -> dict[str, Any]:
+        with self._session_factory() as dbsession:
+            return (
+                dbsession.scalars(select(models.Job).where(models.Job.id == job_id))
+                .one()
+                .as_dict()
+            )
+
+    def _load_jobs(self) -> list[dict[str, Any]]:
+        with self._session_factory() as dbsession:
+            jobs = dbsession.scalars(
+                select(models.Job).order_by(models.Job.started_at)
+            ).all()
+            return [job.as_dict() for job in jobs]
+
+
+def make_app(settings: ISettings) -> JobEventStreamApp:
+    """Create the job event stream application from the app settings."""
+    engine = models.get_engine(settings)
+    hub = EventHub(
+        partial(EventListenerClient, settings["amqp.url"]),
+        maxsize=int(settings.get("events.buffer_size", Subscription.DEFAULT_MAXSIZE)),
+    )
+    return JobEventStreamApp(
+        hub,
+        partial(Session, engine),
+        heartbeat_interval=float(
+            settings.get(
+                "events.heartbeat_interval",
+                JobEventStreamApp.DEFAULT_HEARTBEAT_INTERVAL,
+            )
+        ),
+        buffer_size=int(
+            settings.get("events.buffer_size", Subscription.DEFAULT_MAXSIZE)
+        ),
+        cors_origin=settings.get("events.cors_origin"),
+    )
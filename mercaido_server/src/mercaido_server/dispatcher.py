@@ -3,12 +3,19 @@
 # SPDX-License-Identifier: MIT
 
 import logging
+import threading
+import time
+import zlib
+from collections import defaultdict
+from collections.abc import Iterable
+from dataclasses import dataclass, field
 from datetime import datetime, timezone
-from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from typing import Any, ClassVar
 
 import sqlalchemy as sa
 from sqlalchemy.dialects.sqlite import insert as sqlite_upsert
-from mercaido_client.mq.client import BlockingClient, DISPATCHER_QUEUE
+from mercaido_client.mq.client import Ack, BlockingClient, DISPATCHER_QUEUE
 from mercaido_client.pb.mercaido import MessageType, MessageBase, EventType
 
 from . import models
@@ -17,14 +24,143 @@ from . import models
 logger = logging.getLogger(__name__)
 
 
+@dataclass
+class Batch:
+    """Database changes collected from one or more messages.
+
+    Changes are coalesced per row: a later message for the same service
+    or job overwrites the columns set by an earlier one.
+
+    `progress` holds the job progress taken from the `ProgressCoalescer`
+    for this batch, it is restored when the batch fails.
+    """
+
+    services: dict[str, dict[str, Any]] = field(default_factory=dict)
+    jobs: dict[str, dict[str, Any]] = field(default_factory=dict)
+    progress: dict[str, float] = field(default_factory=dict)
+
+    def __bool__(self) -> bool:
+        return bool(self.services or self.jobs)
+
+    def update_service(self, ident: str, **kwargs) -> None:
+        self.services.setdefault(ident, {}).update(kwargs)
+
+    def update_job(self, job_id: str, **kwargs) -> None:
+        self.jobs.setdefault(job_id, {}).update(kwargs)
+
+
+class ProgressCoalescer:
+    """Keeps the latest progress per job and writes it at a bounded rate.
+
+    Services may report progress thousands of times per job. Only the
+    most recent value is kept, and a job's progress is written at most
+    once every `interval` seconds. Progress that has not been written
+    yet is lost when the dispatcher stops, the next report restores it.
+    """
+
+    DEFAULT_INTERVAL: ClassVar[float] = 1.0
+
+    _interval: float
+    _pending: dict[str, float]
+    _written_at: dict[str, float]
+    _lock: threading.Lock
+
+    def __init__(self, interval: float = DEFAULT_INTERVAL) -> None:
+        self._interval = interval
+        self._pending = {}
+        self._written_at = {}
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._pending)
+
+    def add(self, job_id: str, progress: float) -> None:
+        with self._lock:
+            self._pending[job_id] = progress
+
+    def discard(self, job_id: str) -> float | None:
+        """Forget a finished job, returning its unwritten progress."""
+        with self._lock:
+            self._written_at.pop(job_id, None)
+            return self._pending.pop(job_id, None)
+
+    def flush(self, batch: Batch, job_ids: Iterable[str] | None = None) -> None:
+        """Add progress that is due for writing to `batch`.
+
+        Only the jobs in `job_ids` are considered, if given.
+        """
+        now = time.monotonic()
+        with self._lock:
+            for job_id, written_at in list(self._written_at.items()):
+                if now - written_at >= self._interval:
+                    del self._written_at[job_id]
+            candidates = list(self._pending if job_ids is None else job_ids)
+            for job_id in candidates:
+                if job_id in self._pending and job_id not in self._written_at:
+                    progress = batch.progress[job_id] = self._pending.pop(job_id)
+                    batch.update_job(job_id, progress=progress)
+                    self._written_at[job_id] = now
+
+    def restore(self, batch: Batch) -> None:
+        """Take back the progress of `batch`, because writing it failed.
+
+        It is due for writing again right away. Progress reported since
+        is newer and kept instead.
+        """
+        with self._lock:
+            for job_id, progress in batch.progress.items():
+                self._pending.setdefault(job_id, progress)
+                self._written_at.pop(job_id, None)
+
+
 class Dispatcher:
+    DEFAULT_BATCH_SIZE: ClassVar[int] = 1
+    DEFAULT_BATCH_WINDOW: ClassVar[float] = 0.05
+
     _mq: BlockingClient
     _queue: str
+    _batch_size: int
+    _batch_window: float
+    _prefetch: int
+    _workers: int
+
+    def __init__(
+        self,
+        amqp_url: str,
+        db_url: str,
+        batch_size: int = DEFAULT_BATCH_SIZE,
+        batch_window: float = DEFAULT_BATCH_WINDOW,
+        prefetch: int | None = None,
+        progress_interval: float = ProgressCoalescer.DEFAULT_INTERVAL,
+        workers: int = 0,
+    ) -> None:
+        """Create a dispatcher.
 
-    def __init__(self, amqp_url: str, db_url: str) -> None:
+        With a `batch_size` larger than one, up to `batch_size` messages
+        received within `batch_window` seconds are applied in a single
+        database transaction and acknowledged together after it commits.
+        `prefetch` defaults to `batch_size`.
+
+        Job progress is written at most once per `progress_interval`
+        seconds per job.
+
+        With `workers`, messages are handled by that many worker threads.
+        Messages are partitioned by job ID, or service endpoint for
+        registrations, so messages about the same job are still handled
+        in order. Every message is then acknowledged on its own and
+        `prefetch` defaults to `batch_size` times `workers`.
+        """
+        if batch_size < 1:
+            raise ValueError(f"batch size must be at least 1, got {batch_size}")
         self._db = sa.create_engine(db_url)
-        self._mq = BlockingClient(amqp_url)
+        self._mq = BlockingClient(amqp_url, reconnect=True)
         self._queue = DISPATCHER_QUEUE.name
+        self._batch_size = batch_size
+        self._batch_window = batch_window
+        self._workers = workers
+        self._prefetch = max(prefetch or batch_size * max(workers, 1), batch_size)
+        self._progress = ProgressCoalescer(progress_interval)
+        self._progress_interval = progress_interval
         self._handlers = {
             MessageType.MESSAGE_TYPE_REGISTER_SERVICES: self._handle_register_service,
             MessageType.MESSAGE_TYPE_EVENT: self._handle_event,
@@ -32,31 +168,189 @@ class Dispatcher:
         }
 
     def run(self):
-        with self._mq, self._mq.consume(self._queue) as consumer:
-            for msg, ack in consumer:
-                if msg is None:
-                    continue
-                try:
-                    self._handlers[msg.request.type](msg)
-                    ack.ok()
-                except KeyError:
-                    logger.error(f"unknown request type: {msg.request.type!r}")
-                    ack.cancel()
-                except Exception:
-                    logger.exception("request handler failed")
-                    ack.cancel()
+        # Wake up regularly to write progress while the queue is idle.
+        timeout = (
+            self._batch_window if self._batch_size > 1 else self._progress_interval
+        )
+        pending: list[tuple[MessageBase, Ack]] = []
+        deadline = 0.0
+        next_progress_flush = time.monotonic() + self._progress_interval
+
+        executors = [
+            ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"dispatcher-{n}")
+            for n in range(self._workers)
+        ]
+        futures: list[Future] = []
+
+        with self._mq, self._mq.consume(
+            self._queue, timeout, prefetch_count=self._prefetch
+        ) as consumer:
+            try:
+                for msg, ack in consumer:
+                    if msg is not None:
+                        if not pending:
+                            deadline = time.monotonic() + self._batch_window
+                        pending.append((msg, ack))
+
+                    if pending and (
+                        msg is None
+                        or len(pending) >= self._batch_size
+                        or time.monotonic() >= deadline
+                    ):
+                        futures = self._dispatch(pending, executors, futures)
+                        pending = []
+
+                    if time.monotonic() >= next_progress_flush:
+                        futures = self._flush_progress(executors, futures)
+                        next_progress_flush = time.monotonic() + self._progress_interval
+            finally:
+                self._drain(executors, futures)
 
     def stop(self):
         pass
 
-    def _handle_register_service(self, msg: MessageBase) -> None:
+    def _dispatch(
+        self,
+        pending: list[tuple[MessageBase, Ack]],
+        executors: list[ThreadPoolExecutor],
+        futures: list[Future],
+    ) -> list[Future]:
+        if not executors:
+            self._process(pending)
+            return futures
+
+        # A job or service always goes to the same worker, which keeps
+        # its messages in order. Every worker applies its share of the
+        # messages as one batch.
+        batches = defaultdict(list)
+        for msg, ack in pending:
+            batches[self._worker(self._partition(msg), executors)].append((msg, ack))
+
+        futures = [f for f in futures if not f.done()]
+        for executor, items in batches.items():
+            # Acknowledge separately, other workers may still be handling
+            # earlier deliveries that a multiple-ack would include.
+            futures.append(executor.submit(self._process, items, False))
+        return futures
+
+    def _flush_progress(
+        self, executors: list[ThreadPoolExecutor], futures: list[Future]
+    ) -> list[Future]:
+        batch = Batch()
+        self._progress.flush(batch)
+        if not batch:
+            return futures
+
+        if not executors:
+            self._write_progress(batch)
+            return futures
+
+        # Write on the job's own worker to keep its updates in order.
+        batches: defaultdict[ThreadPoolExecutor, Batch] = defaultdict(Batch)
+        for job_id, kwargs in batch.jobs.items():
+            worker_batch = batches[self._worker(job_id, executors)]
+            worker_batch.update_job(job_id, **kwargs)
+            worker_batch.progress[job_id] = batch.progress[job_id]
+
+        futures = [f for f in futures if not f.done()]
+        for executor, worker_batch in batches.items():
+            futures.append(executor.submit(self._write_progress, worker_batch))
+        return futures
+
+    def _write_progress(self, batch: Batch) -> None:
+        try:
+            self._apply(batch)
+        except Exception:
+            logger.exception("failed to write job progress")
+            self._progress.restore(batch)
+
+    def _drain(
+        self, executors: list[ThreadPoolExecutor], futures: list[Future]
+    ) -> None:
+        # Acknowledgements from workers are sent by the connection's
+        # thread, so keep processing I/O until all workers are done.
+        while futures:
+            done, not_done = wait(futures, timeout=0.1)
+            futures = list(not_done)
+            try:
+                self._mq.process_data_events()
+            except Exception:
+                logger.exception("lost connection while draining workers")
+                break
+        for executor in executors:
+            executor.shutdown(wait=True)
+
+    @staticmethod
+    def _worker(key: str, executors: list[ThreadPoolExecutor]) -> ThreadPoolExecutor:
+        return executors[zlib.crc32(key.encode()) % len(executors)]
+
+    @staticmethod
+    def _partition(msg: MessageBase) -> str:
+        request = msg.request
+        match request.type:
+            case MessageType.MESSAGE_TYPE_EVENT:
+                return request.event.job_id
+            case MessageType.MESSAGE_TYPE_REGISTER_SERVICES:
+                services = request.register_services.services
+                return services[0].endpoint if services else ""
+        return ""
+
+    def _process(
+        self, pending: list[tuple[MessageBase, Ack]], multiple_ack: bool = True
+    ) -> None:
+        batch = Batch()
+        accepted: list[tuple[MessageBase, Ack]] = []
+
+        for msg, ack in pending:
+            try:
+                self._handlers[msg.request.type](batch, msg)
+                accepted.append((msg, ack))
+            except KeyError:
+                logger.error(f"unknown request type: {msg.request.type!r}")
+                ack.cancel()
+            except Exception:
+                logger.exception("request handler failed")
+                ack.cancel()
+
+        if not accepted:
+            return
+
+        self._progress.flush(batch, {self._partition(msg) for msg, _ in accepted})
+
+        try:
+            self._apply(batch)
+        except Exception:
+            # The progress messages are already acknowledged, keep their
+            # progress for the next write.
+            self._progress.restore(batch)
+            if len(accepted) == 1:
+                logger.exception("request handler failed")
+                accepted[0][1].cancel()
+                return
+            # Find the message(s) that made the batch fail by applying
+            # every message on its own.
+            logger.exception(
+                f"batch of {len(accepted)} messages failed, retrying one by one"
+            )
+            for item in accepted:
+                self._process([item], multiple_ack)
+            return
+
+        if multiple_ack:
+            # Acknowledge everything up to and including the last
+            # delivery in one go. Messages that were rejected above are
+            # already nacked, which multiple-ack leaves alone.
+            accepted[-1][1].ok(multiple=len(accepted) > 1)
+        else:
+            for _, ack in accepted:
+                ack.ok()
+
+    def _apply(self, batch: Batch) -> None:
+        if not batch:
+            return
+
         with self._db.begin() as db:
-            for service in msg.request.register_services.services:
-                ident = service.endpoint
-                kwargs = {
-                    "last_seen": now(),
-                    "data": service,
-                }
+            for ident, kwargs in batch.services.items():
                 db.execute(
                     sqlite_upsert(models.Service)
                     .values(ident=ident, **kwargs)
@@ -65,12 +359,22 @@ class Dispatcher:
                         set_=kwargs,
                     )
                 )
-                logger.info(
-                    f"registered service: endpoint={service.endpoint} (ident) "
-                    f"name={service.name}"
+            for job_id, kwargs in batch.jobs.items():
+                db.execute(
+                    sa.update(models.Job)
+                    .where(models.Job.id == job_id)
+                    .values(**kwargs)
                 )
 
-    def _handle_event(self, msg: MessageBase) -> None:
+    def _handle_register_service(self, batch: Batch, msg: MessageBase) -> None:
+        for service in msg.request.register_services.services:
+            batch.update_service(service.endpoint, last_seen=now(), data=service)
+            logger.info(
+                f"registered service: endpoint={service.endpoint} (ident) "
+                f"name={service.name}"
+            )
+
+    def _handle_event(self, batch: Batch, msg: MessageBase) -> None:
         if (
             msg.request is None
             or msg.request.event is None
@@ -87,7 +391,8 @@ class Dispatcher:
         # that action arrived at the dispatcher.
         match event.type:
             case EventType.EVENT_TYPE_JOB_START:
-                kwargs.update(started_at=now())
+                self._progress.discard(event.job_id)
+                kwargs.update(started_at=now(), progress=None)
             case EventType.EVENT_TYPE_JOB_STOP:
                 kwargs.update(finished_at=now(), error_msg=None, error=False)
             case EventType.EVENT_TYPE_JOB_ERROR:
@@ -95,19 +400,23 @@ class Dispatcher:
                     finished_at=now(), error=True, error_msg=event.error_message
                 )
             case EventType.EVENT_TYPE_JOB_PROGRESS:
-                pass  # ignore
+                self._progress.add(event.job_id, event.progress)
             case _:
                 logger.error(f"unknown event type: {event.type!r}")
 
+        # Write the last reported progress together with the final state.
+        if event.type in (
+            EventType.EVENT_TYPE_JOB_STOP,
+            EventType.EVENT_TYPE_JOB_ERROR,
+        ):
+            if (progress := self._progress.discard(event.job_id)) is not None:
+                kwargs.update(progress=progress)
+                batch.progress[event.job_id] = progress
+
         if kwargs:
-            with self._db.begin() as db:
-                db.execute(
-                    sa.update(models.Job)
-                    .where(models.Job.id == event.job_id)
-                    .values(**kwargs)
-                )
+            batch.update_job(event.job_id, **kwargs)
 
-    def _handle_publish_job(self, msg: MessageBase) -> None:
+    def _handle_publish_job(self, batch: Batch, msg: MessageBase) -> None:
         print("TODO _handle_publish_job", msg)
         pass  # TODO: Copy and pass to service. Save to DB.
 
@@ -0,0 +1,169 @@
+# SPDX-FileCopyrightText: 2023, 2024 Horus View and Explore B.V.
+#
+# SPDX-License-Identifier: MIT
+
+import logging
+import threading
+from collections.abc import Callable
+from queue import Empty, Full, Queue
+from typing import ClassVar, Optional
+
+from mercaido_client.mq.client import EventListenerClient
+from mercaido_client.pb.mercaido import MessageBase
+from mercaido_client.pb.message import MessageView
+
+# Events are consumed lazily, see `EventHub`.
+EventMessage = MessageBase | MessageView[MessageBase]
+
+
+logger = logging.getLogger(__name__)
+
+
+class Subscription:
+    """A bounded buffer of broadcast messages for a single listener.
+
+    When the listener does not keep up, the oldest buffered message is
+    dropped to make room for the newest one. The number of dropped
+    messages is tracked so the listener can resynchronize its state.
+    """
+
+    DEFAULT_MAXSIZE: ClassVar[int] = 256
+
+    _hub: "EventHub"
+    _queue: Queue[EventMessage]
+    _dropped: int
+    _lock: threading.Lock
+
+    def __init__(self, hub: "EventHub", maxsize: int = DEFAULT_MAXSIZE) -> None:
+        self._hub = hub
+        self._queue = Queue(maxsize)
+        self._dropped = 0
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self) -> None:
+        self._hub.unsubscribe(self)
+
+    def get(self, timeout: Optional[float] = None) -> Optional[EventMessage]:
+        """Return the next message, or None when `timeout` expires."""
+        try:
+            return self._queue.get(timeout=timeout)
+        except Empty:
+            return None
+
+    def take_dropped(self) -> int:
+        """Return the number of messages dropped since the last call."""
+        with self._lock:
+            dropped, self._dropped = self._dropped, 0
+        return dropped
+
+    def deliver(self, msg: EventMessage) -> None:
+        while True:
+            try:
+                self._queue.put_nowait(msg)
+                return
+            except Full:
+                try:
+                    self._queue.get_nowait()
+                except Empty:
+                    continue  # The listener caught up in the meantime.
+                with self._lock:
+                    self._dropped += 1
+
+
+class EventHub:
+    """Fans out the broadcast exchange to all listeners in this process.
+
+    A single background thread consumes ``mercaido.broadcast`` through
+    one `EventListenerClient`, instead of one connection and temporary
+    queue per listener. The thread is started on the first subscription
+    and reconnects with exponential backoff when the broker goes away.
+
+    Messages are passed on as `MessageView`s, only the fields that the
+    listeners read are decoded.
+    """
+
+    RECONNECT_DELAY: ClassVar[float] = 1.0
+    MAX_RECONNECT_DELAY: ClassVar[float] = 30.0
+
+    _client_factory: Callable[[], EventListenerClient]
+    _subscribers: set[Subscription]
+    _lock: threading.Lock
+    _stopping: threading.Event
+    _thread: Optional[threading.Thread]
+
+    def __init__(
+        self,
+        client_factory: Callable[[], EventListenerClient],
+        maxsize: int = Subscription.DEFAULT_MAXSIZE,
+    ) -> None:
+        self._client_factory = client_factory
+        self._maxsize = maxsize
+        self._subscribers = set()
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._thread = None
+
+    def subscribe(self, maxsize: Optional[int] = None) -> Subscription:
+        return self.add(Subscription(self, maxsize or self._maxsize))
+
+    def add(self, subscription):
+        """Register a subscription-like object with a `deliver` method."""
+        with self._lock:
+            self._subscribers.add(subscription)
+            if self._thread is None:
+                # Each thread has its own event, a hub that was stopped
+                # consumes again when it is used after stop().
+                self._stopping = threading.Event()
+                self._thread = threading.Thread(
+                    target=self._run,
+                    args=(self._stopping,),
+                    name="EventHub",
+                    daemon=True,
+                )
+                self._thread.start()
+        return subscription
+
+    def unsubscribe(self, subscription) -> None:
+        with self._lock:
+            self._subscribers.discard(subscription)
+
+    def stop(self) -> None:
+        with self._lock:
+            self._stopping.set()
+            thread, self._thread = self._thread, None
+        if thread is not None:
+            thread.join()
+
+    def publish(self, msg: EventMessage) -> None:
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for subscriber in subscribers:
+            subscriber.deliver(msg)
+
+    def _run(self, stopping: threading.Event) -> None:
+        delay = self.RECONNECT_DELAY
+        while not stopping.is_set():
+            try:
+                with (
+                    self._client_factory() as client,
+                    client.consume(timeout=1, lazy=True) as consumer,
+                ):
+                    logger.info("event hub connected")
+                    delay = self.RECONNECT_DELAY
+                    for msg, ack in consumer:
+                        if stopping.is_set():
+                            break
+                        if msg is None:
+                            continue
+                        ack.ok()
+                        self.publish(msg)
+            except Exception:
+                logger.exception(f"event hub disconnected, retrying in {delay}s")
+                stopping.wait(delay)
+                delay = min(delay * 2, self.MAX_RECONNECT_DELAY)
@@ -31,6 +31,7 @@ class Job(Base):
     finished_at: Mapped[datetime] = mapped_column(insert_default=None)
     error: Mapped[bool] = mapped_column(insert_default=False)
     error_msg: Mapped[str] = mapped_column(Text(), insert_default=None)
+    progress: Mapped[float] = mapped_column(insert_default=None)
 
     def as_dict(self) -> dict[str, Any]:
         return dict(
@@ -45,4 +46,5 @@ class Job(Base):
             else None,
             error=self.error,
             error_msg=self.error_msg,
+            progress=self.progress,
         )
@@ -2,28 +2,155 @@
 #
 # SPDX-License-Identifier: MIT
 
+import logging
+from collections.abc import Callable, Generator
 from functools import partial
 from contextlib import contextmanager
+from queue import Empty, LifoQueue
+from typing import ClassVar, Optional
 
-from mercaido_client.mq.client import PublishJobClient, EventListenerClient
+import pika.exceptions
+from mercaido_client.mq.client import (
+    ClientError,
+    PublishJobClient,
+    EventListenerClient,
+)
 from pyramid.config import Configurator
 from pyramid.interfaces import IRequest
+from pyramid.settings import asbool
 
 from .attrs import AttrDict
+from .events import EventHub, Subscription
 
 
-def includeme(config: Configurator):
-    url = config.get_settings()["amqp.url"]
+logger = logging.getLogger(__name__)
+
+
+class PublisherPool:
+    """A process-wide pool of long-lived publishing connections.
+
+    pika's ``BlockingConnection`` is not thread-safe, so every pooled
+    client is handed to one thread at a time. Clients are connected
+    lazily, health checked on checkout and replaced when the broker
+    dropped them. Publishing a job is then a single ``basic_publish``
+    instead of a TCP connect, AMQP handshake and channel open.
+    """
+
+    DEFAULT_SIZE: ClassVar[int] = 4
+    DEFAULT_ACQUIRE_TIMEOUT: ClassVar[float] = 10.0
+
+    _factory: Callable[[], PublishJobClient]
+    _idle: LifoQueue[Optional[PublishJobClient]]
+    _timeout: float
+
+    def __init__(
+        self,
+        factory: Callable[[], PublishJobClient],
+        size: int = DEFAULT_SIZE,
+        acquire_timeout: float = DEFAULT_ACQUIRE_TIMEOUT,
+    ) -> None:
+        if size < 1:
+            raise ValueError(f"pool size must be at least 1, got {size}")
+        self._factory = factory
+        self._timeout = acquire_timeout
+        # Every slot starts out empty (None) and is connected on first
+        # use. LIFO order keeps the most recently used, and therefore
+        # most likely healthy, connections in rotation.
+        self._idle = LifoQueue()
+        for _ in range(size):
+            self._idle.put(None)
 
     @contextmanager
-    def publish_job_client(request: IRequest):
-        with PublishJobClient(url) as client:
+    def acquire(self) -> Generator[PublishJobClient, None, None]:
+        try:
+            client = self._idle.get(timeout=self._timeout)
+        except Empty:
+            raise ClientError(
+                f"no publisher available after {self._timeout} seconds"
+            ) from None
+
+        try:
+            client = self._checkout(client)
+        except Exception:
+            self._idle.put(None)
+            raise
+
+        try:
             yield client
+        except pika.exceptions.AMQPError:
+            self._discard(client)
+            client = None
+            raise
+        finally:
+            self._idle.put(client)
+
+    def close(self) -> None:
+        while True:
+            try:
+                client = self._idle.get_nowait()
+            except Empty:
+                break
+            if client is not None:
+                self._discard(client)
+
+    def _checkout(self, client: Optional[PublishJobClient]) -> PublishJobClient:
+        if client is not None:
+            try:
+                # Services heartbeats that were missed while the client
+                # was idle and raises if the broker closed the socket.
+                client.process_data_events()
+                if client.is_open():
+                    return client
+            except pika.exceptions.AMQPError as e:
+                logger.warning(f"pooled publisher is unhealthy, reconnecting: {e!r}")
+            self._discard(client)
+
+        client = self._factory()
+        client.open()
+        return client
+
+    @staticmethod
+    def _discard(client: PublishJobClient) -> None:
+        try:
+            client.close()
+        except Exception as e:
+            logger.debug(f"error while closing pooled publisher: {e!r}")
+
+
+def includeme(config: Configurator):
+    settings = config.get_settings()
+    url = settings["amqp.url"]
+
+    confirms = asbool(settings.get("amqp.publisher_confirms", False))
+
+    pool = PublisherPool(
+        partial(PublishJobClient, url, confirms=confirms),
+        size=int(settings.get("amqp.publisher_pool_size", PublisherPool.DEFAULT_SIZE)),
+        acquire_timeout=float(
+            settings.get(
+                "amqp.publisher_pool_timeout", PublisherPool.DEFAULT_ACQUIRE_TIMEOUT
+            )
+        ),
+    )
+    config.registry["publisher_pool"] = pool
+
+    hub = EventHub(
+        partial(EventListenerClient, url),
+        maxsize=int(settings.get("events.buffer_size", Subscription.DEFAULT_MAXSIZE)),
+    )
+    config.registry["event_hub"] = hub
+
+    def publish_job_client(request: IRequest):
+        return pool.acquire()
 
     @contextmanager
     def event_listener_client(request: IRequest):
         with EventListenerClient(url) as client:
             yield client
 
+    def job_event_subscription(request: IRequest) -> Subscription:
+        return hub.subscribe()
+
     config.add_request_method(publish_job_client)
     config.add_request_method(event_listener_client)
+    config.add_request_method(job_event_subscription)
@@ -0,0 +1,65 @@
+# SPDX-FileCopyrightText: 2023, 2024 Horus View and Explore B.V.
+#
+# SPDX-License-Identifier: MIT
+
+import json
+import logging
+from collections.abc import Callable
+from typing import Any, Optional
+
+import mercaido_client.pb.mercaido as messages
+
+
+logger = logging.getLogger(__name__)
+
+
+def job_event(
+    event: messages.Event, load_job: Callable[[str], dict[str, Any]]
+) -> Optional[tuple[str, Any]]:
+    """Translate a job event into an SSE event name and data.
+
+    `load_job` is called to fetch the full job when it has started.
+    Returns None for events that are not forwarded to browsers.
+    """
+    match event.type:
+        case messages.EventType.EVENT_TYPE_JOB_START:
+            return "job-started", load_job(event.job_id)
+        case messages.EventType.EVENT_TYPE_JOB_STOP:
+            return "job-stopped", {
+                "id": event.job_id,
+                "error_message": event.error_message,
+                "error": event.error_message is not None,
+            }
+        case messages.EventType.EVENT_TYPE_JOB_ERROR:
+            pass  # ignore
+        case messages.EventType.EVENT_TYPE_JOB_PROGRESS:
+            return "job-progress", {"id": event.job_id, "progress": event.progress}
+        case _:
+            logger.error(f"unknown event type: {event.type!r}")
+    return None
+
+
+class SSE:
+    _id: int
+
+    def __init__(self):
+        self._id = -1
+
+    def _encode(self, **kwargs) -> bytes:
+        # FIXME: It "data" contains newlines, split the value and put
+        # it on muldiple lines prefixed with "data: "
+        # FIXME: Only allow SSE fields id, event, data, retry.
+        def convert(v):
+            if isinstance(v, (dict, list, tuple)):
+                v = json.dumps(v)
+            return v
+
+        buf = "\n".join(f"{k}: {convert(v)}" for k, v in kwargs.items())
+        return (buf + "\n\n").encode("utf-8")
+
+    def retry(self, n: int) -> bytes:
+        return self._encode(retry=n)
+
+    def event(self, name: str, data: Any) -> bytes:
+        self._id += 1
+        return self._encode(id=self._id, event=name, data=data)
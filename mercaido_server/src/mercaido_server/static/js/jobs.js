@@ -28,7 +28,7 @@ export class Jobs extends LitElement {
   connectedCallback() {
     super.connectedCallback();
     console.log("[Jobs] Connected");
-    this._sse = new EventSource("/events/job");
+    this._sse = new EventSource(this.getAttribute("events-url") || "/events/job");
 
     this._sse.addEventListener("job-list", (event) => {
       console.log("[Jobs] Received new job list:"); // , event.data);
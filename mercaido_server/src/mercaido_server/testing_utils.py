@@ -0,0 +1,23 @@
+# SPDX-FileCopyrightText: 2023, 2024 Horus View and Explore B.V.
+#
+# SPDX-License-Identifier: MIT
+
+import sqlalchemy as sa
+from sqlalchemy import MetaData
+
+from .models.meta import Base
+
+
+def create_tables(engine: sa.Engine) -> None:
+    """Create the tables of all models on an engine.
+
+    The migrations, not the models, define the real schema. They leave
+    most columns nullable, so do the same here.
+    """
+    metadata = MetaData()
+    for table in Base.metadata.tables.values():
+        table = table.to_metadata(metadata)
+        for column in table.columns:
+            if not column.primary_key:
+                column.nullable = True
+    metadata.create_all(engine)
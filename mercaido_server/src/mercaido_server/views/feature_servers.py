@@ -109,9 +109,12 @@ class FeatureServerViews:
         if featureserver is None:
             return HTTPNotFound()
 
-        client = FeatureServerClient(featureserver.endpoint)
-
-        client.open()
-        layers = client.get_layers()
-
-        return dict(client=client, layers=layers, featureserver=featureserver)
+        # Opening the server is fast when the datasource is cached, the
+        # layers are read before the client is closed again.
+        with FeatureServerClient(featureserver.endpoint, readonly=True) as client:
+            layers = [
+                dict(name=layer.name, extent=layer.extent, crs=layer.crs)
+                for layer in client.get_layers()
+            ]
+
+        return dict(layers=layers, featureserver=featureserver)
@@ -2,11 +2,9 @@
 #
 # SPDX-License-Identifier: MIT
 
-import json
 import logging
 from dataclasses import asdict
 from typing import Any
-from queue import Empty
 from datetime import datetime, timezone
 
 from pyramid.view import view_config
@@ -15,7 +13,7 @@ from pyramid.interfaces import IRequest, IResponse
 from sqlalchemy import select, delete
 
 from .. import models
-import mercaido_client.pb.mercaido as messages
+from ..sse import SSE, job_event
 
 
 logger = logging.getLogger(__name__)
@@ -27,17 +25,45 @@ class JobViews:
     def __init__(self, request: IRequest) -> None:
         self.request = request
 
+    def _load_job(self, job_id: str) -> dict[str, Any]:
+        self.request.tm.begin()
+        try:
+            job = self.request.dbsession.scalars(
+                select(models.Job).where(models.Job.id == job_id)
+            ).one()
+            return job.as_dict()
+        finally:
+            self.request.tm.abort()
+
+    def _load_jobs(self) -> list[dict[str, Any]]:
+        self.request.tm.begin()
+        try:
+            jobs = self.request.dbsession.scalars(
+                select(models.Job).order_by(models.Job.started_at)
+            ).all()
+            return [job.as_dict() for job in jobs]
+        finally:
+            self.request.tm.abort()
+
     def _job_event_stream(self, jobs: list[dict[str, Any]]):
         sse = SSE()
 
         yield sse.retry(100)
         yield sse.event("job-list", jobs)
 
-        # XXX: When does this stop?
-        with self.request.event_listener_client() as client, client.consume(
-            timeout=1
-        ) as consumer:
-            for msg, ack in consumer:
+        # Events are received through the process-wide event hub. The
+        # stream stops when the client disconnects and the WSGI server
+        # closes this generator.
+        with self.request.job_event_subscription() as subscription:
+            while True:
+                msg = subscription.get(timeout=1)
+
+                # This stream fell behind and missed events, send the
+                # current state of all jobs to get back in sync.
+                if dropped := subscription.take_dropped():
+                    logger.warning(f"job event stream dropped {dropped} events")
+                    yield sse.event("job-list", self._load_jobs())
+
                 if msg is None:
                     yield sse.event(
                         "job-ping",
@@ -52,39 +78,10 @@ class JobViews:
                     or msg.request.event.job_id is None
                 ):
                     logger.error(f"incomplete event message: {msg!r}")
-                    ack.ok()
                     continue
 
-                # Handle events.
-                event = msg.request.event
-                match event.type:
-                    case messages.EventType.EVENT_TYPE_JOB_START:
-                        self.request.tm.begin()
-                        job = self.request.dbsession.scalars(
-                            select(models.Job).where(models.Job.id == event.job_id)
-                        ).one()
-                        self.request.tm.abort()
-                        yield sse.event("job-started", job.as_dict())
-                    case messages.EventType.EVENT_TYPE_JOB_STOP:
-                        yield sse.event(
-                            "job-stopped",
-                            {
-                                "id": event.job_id,
-                                "error_message": event.error_message,
-                                "error": event.error_message is not None,
-                            },
-                        )
-                    case messages.EventType.EVENT_TYPE_JOB_ERROR:
-                        pass  # ignore
-                    case messages.EventType.EVENT_TYPE_JOB_PROGRESS:
-                        yield sse.event(
-                            "job-progress",
-                            {"id": event.job_id, "progress": event.progress},
-                        )
-                    case _:
-                        logger.error(f"unknown event type: {event.type!r}")
-
-                ack.ok()
+                if translated := job_event(msg.request.event, self._load_job):
+                    yield sse.event(*translated)
 
     @view_config(route_name="job_events")
     def job_events(self) -> IResponse:
@@ -128,29 +125,3 @@ class JobViews:
             delete(models.Job).where(models.Job.id == job_id)
         )
         return dict(success=True, deleted_job=job_id)
-
-
-class SSE:
-    _id: int
-
-    def __init__(self):
-        self._id = -1
-
-    def _encode(self, **kwargs) -> bytes:
-        # FIXME: It "data" contains newlines, split the value and put
-        # it on muldiple lines prefixed with "data: "
-        # FIXME: Only allow SSE fields id, event, data, retry.
-        def convert(v):
-            if isinstance(v, (dict, list, tuple)):
-                v = json.dumps(v)
-            return v
-
-        buf = "\n".join(f"{k}: {convert(v)}" for k, v in kwargs.items())
-        return (buf + "\n\n").encode("utf-8")
-
-    def retry(self, n: int) -> bytes:
-        return self._encode(retry=n)
-
-    def event(self, name: str, data: Any) -> bytes:
-        self._id += 1
-        return self._encode(id=self._id, event=name, data=data)
@@ -2,6 +2,7 @@
 #
 # SPDX-License-Identifier: MIT
 
+from collections.abc import Sequence
 from typing import Any
 from functools import reduce
 
@@ -98,6 +99,9 @@ class ServiceViews:
 
         with self.request.publish_job_client() as client:
             client.publish(service.endpoint, publish_job)
+            # With amqp.publisher_confirms, a job the broker did not
+            # accept raises and rolls back the insert above.
+            client.wait_for_confirms()
 
         for attr in service.attributes:
             attr.values = []
@@ -120,7 +124,7 @@ class ServiceViews:
             return None
 
     def _attributes_to_dict(
-        self, attributes: list[messages.Attribute]
+        self, attributes: Sequence[messages.Attribute]
     ) -> dict[str, Any]:
         def deconstruct_attribute(result, attr):
             if not attr.sensitive:
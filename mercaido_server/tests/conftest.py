@@ -0,0 +1,13 @@
+# SPDX-FileCopyrightText: 2023, 2024 Horus View and Explore B.V.
+#
+# SPDX-License-Identifier: MIT
+
+import pytest
+
+from mercaido_server import testing_utils
+
+
+@pytest.fixture
+def create_tables():
+    """Create the tables of all models on an engine."""
+    return testing_utils.create_tables
@@ -0,0 +1,161 @@
+# SPDX-FileCopyrightText: 2023, 2024 Horus View and Explore B.V.
+#
+# SPDX-License-Identifier: MIT
+
+import asyncio
+import queue
+from functools import partial
+
+import sqlalchemy as sa
+from sqlalchemy.orm import Session
+from sqlalchemy.pool import StaticPool
+
+from mercaido_client.pb.mercaido import (
+    Event,
+    EventType,
+    MessageBase,
+    MessageType,
+    RequestBase,
+)
+
+from mercaido_server import models
+from mercaido_server.asgi import AsyncSubscription, JobEventStreamApp, LoopBridge
+from mercaido_server.events import EventHub
+
+from .test_events import FakeListener
+
+
+class FakeHub:
+    def __init__(self):
+        self.subscribers = set()
+
+    def add(self, subscriber):
+        self.subscribers.add(subscriber)
+
+    def unsubscribe(self, subscriber):
+        self.subscribers.discard(subscriber)
+
+    def stop(self):
+        pass
+
+
+def make_session_factory(create_tables):
+    engine = sa.create_engine(
+        "sqlite://",
+        poolclass=StaticPool,
+        connect_args={"check_same_thread": False},
+    )
+    create_tables(engine)
+    factory = partial(Session, engine)
+    with factory() as dbsession, dbsession.begin():
+        dbsession.execute(
+            sa.insert(models.Job),
+            [{"service_id": "test", "attributes": {}}],
+        )
+    return factory
+
+
+def progress_message(job_id, progress):
+    return MessageBase(
+        request=RequestBase(
+            type=MessageType.MESSAGE_TYPE_EVENT,
+            event=Event(
+                type=EventType.EVENT_TYPE_JOB_PROGRESS,
+                job_id=job_id,
+                progress=progress,
+            ),
+        )
+    )
+
+
+def test_job_event_stream(create_tables):
+    hub = FakeHub()
+    app = JobEventStreamApp(
+        hub, make_session_factory(create_tables), heartbeat_interval=0.05
+    )
+    scope = {"type": "http", "path": "/events/job", "method": "GET"}
+    disconnect = asyncio.Event()
+    chunks = []
+
+    async def receive():
+        await disconnect.wait()
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        if message["type"] == "http.response.body":
+            chunks.append(message["body"].decode())
+            if len(chunks) == 2:
+                (bridge,) = hub.subscribers
+                bridge.deliver(progress_message("job-1", 42.0))
+            if any("job-progress" in c for c in chunks) and any(
+                "job-ping" in c for c in chunks
+            ):
+                disconnect.set()
+
+    async def main():
+        await asyncio.wait_for(app(scope, receive, send), 5)
+
+    asyncio.run(main())
+
+    assert chunks[0] == "retry: 100\n\n"
+    assert "event: job-list" in chunks[1]
+    assert '"service_id": "test"' in chunks[1]
+    assert 'data: {"id": "job-1", "progress": 42.0}' in "".join(chunks)
+
+
+def test_not_found():
+    app = JobEventStreamApp(FakeHub(), None)
+    sent = []
+
+    async def send(message):
+        sent.append(message)
+
+    asyncio.run(app({"type": "http", "path": "/", "method": "GET"}, None, send))
+    assert sent[0]["status"] == 404
+
+
+def test_lifespan_restart(create_tables):
+    messages = queue.Queue()
+    hub = EventHub(client_factory=lambda: FakeListener(messages))
+    app = JobEventStreamApp(hub, make_session_factory(create_tables))
+
+    async def run_lifespan(job_id):
+        lifespan = asyncio.Queue()
+        sent = asyncio.Queue()
+        await lifespan.put({"type": "lifespan.startup"})
+        task = asyncio.create_task(app({"type": "lifespan"}, lifespan.get, sent.put))
+        assert (await sent.get())["type"] == "lifespan.startup.complete"
+
+        client = AsyncSubscription(10)
+        app._bridge.add(client)
+        messages.put(progress_message(job_id, 1.0))
+        assert await client.get(5) == (
+            "job-progress",
+            f'{{"id": "{job_id}", "progress": 1.0}}',
+        )
+
+        await lifespan.put({"type": "lifespan.shutdown"})
+        assert (await sent.get())["type"] == "lifespan.shutdown.complete"
+        await task
+
+    # Like a server that is started again in the same process.
+    asyncio.run(run_lifespan("job-1"))
+    asyncio.run(run_lifespan("job-2"))
+
+
+def test_bridge_skips_incomplete_messages(caplog):
+    async def main():
+        bridge = LoopBridge(asyncio.get_running_loop(), None, 10)
+        client = AsyncSubscription(10)
+        bridge.add(client)
+        task = asyncio.create_task(bridge.run())
+        # The hub passes on views, missing fields are empty.
+        for msg in (MessageBase(recipient="x"), progress_message("job-1", 2.0)):
+            bridge.deliver(MessageBase.view(msg.serialize()))
+        try:
+            return await client.get(5)
+        finally:
+            task.cancel()
+
+    assert asyncio.run(main()) == ("job-progress", '{"id": "job-1", "progress": 2.0}')
+    assert "incomplete event message" in caplog.text
@@ -0,0 +1,81 @@
+# SPDX-FileCopyrightText: 2023, 2024 Horus View and Explore B.V.
+#
+# SPDX-License-Identifier: MIT
+
+import queue
+from contextlib import contextmanager
+
+from mercaido_server.events import EventHub, Subscription
+
+
+def test_subscription_drops_oldest_messages():
+    hub = EventHub(client_factory=None)
+    subscription = Subscription(hub, maxsize=2)
+
+    for n in range(5):
+        subscription.deliver(n)
+
+    assert subscription.take_dropped() == 3
+    assert subscription.take_dropped() == 0
+    assert subscription.get(timeout=0) == 3
+    assert subscription.get(timeout=0) == 4
+    assert subscription.get(timeout=0) is None
+
+
+def test_hub_fans_out_to_subscribers():
+    hub = EventHub(client_factory=None)
+    a = Subscription(hub)
+    b = Subscription(hub)
+    # Bypass subscribe() to avoid starting the consumer thread.
+    hub._subscribers.update({a, b})
+
+    hub.publish("msg")
+    assert a.get(timeout=0) == "msg"
+    assert b.get(timeout=0) == "msg"
+
+    b.close()
+    hub.publish("msg2")
+    assert a.get(timeout=0) == "msg2"
+    assert b.get(timeout=0) is None
+
+
+class FakeAck:
+    def ok(self):
+        pass
+
+
+class FakeListener:
+    """An `EventListenerClient` that yields messages put in `messages`."""
+
+    def __init__(self, messages):
+        self._messages = messages
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+    @contextmanager
+    def consume(self, timeout=None, lazy=False):
+        yield self._consume()
+
+    def _consume(self):
+        while True:
+            try:
+                yield self._messages.get(timeout=0.01), FakeAck()
+            except queue.Empty:
+                yield None, None
+
+
+def test_hub_consumes_again_after_stop():
+    messages = queue.Queue()
+    hub = EventHub(client_factory=lambda: FakeListener(messages))
+
+    for msg in ("msg", "msg2"):
+        subscription = hub.subscribe()
+        messages.put(msg)
+        assert subscription.get(timeout=1) == msg
+        subscription.close()
+        hub.stop()
+        assert hub._thread is None
@@ -0,0 +1,90 @@
+# SPDX-FileCopyrightText: 2023, 2024 Horus View and Explore B.V.
+#
+# SPDX-License-Identifier: MIT
+
+import pika.exceptions
+import pytest
+
+from mercaido_client.mq.client import ClientError
+
+from mercaido_server.mq import PublisherPool
+
+
+class FakePublisher:
+    def __init__(self):
+        self.opened = 0
+        self.closed = 0
+        self.healthy = True
+
+    def open(self):
+        self.opened += 1
+
+    def close(self):
+        self.closed += 1
+
+    def is_open(self):
+        return self.opened > self.closed
+
+    def process_data_events(self, time_limit=0):
+        if not self.healthy:
+            raise pika.exceptions.StreamLostError("gone")
+
+
+def test_publisher_pool_reuses_connections():
+    created = []
+
+    def factory():
+        created.append(FakePublisher())
+        return created[-1]
+
+    pool = PublisherPool(factory, size=2)
+
+    for _ in range(5):
+        with pool.acquire() as client:
+            assert client.is_open()
+
+    assert len(created) == 1
+
+
+def test_publisher_pool_replaces_unhealthy_connections():
+    created = []
+
+    def factory():
+        created.append(FakePublisher())
+        return created[-1]
+
+    pool = PublisherPool(factory, size=1)
+
+    with pool.acquire() as client:
+        client.healthy = False
+
+    with pool.acquire() as client:
+        assert client is created[1]
+
+    assert created[0].closed == 1
+
+
+def test_publisher_pool_discards_on_amqp_error():
+    created = []
+
+    def factory():
+        created.append(FakePublisher())
+        return created[-1]
+
+    pool = PublisherPool(factory, size=1)
+
+    with pytest.raises(pika.exceptions.AMQPConnectionError):
+        with pool.acquire():
+            raise pika.exceptions.AMQPConnectionError()
+
+    with pool.acquire() as client:
+        assert client is created[1]
+
+
+def test_publisher_pool_timeout():
+    pool = PublisherPool(FakePublisher, size=1, acquire_timeout=0.01)
+
+    with pool.acquire():
+        with pytest.raises(ClientError):
+            with pool.acquire():
+                pass